@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+CPU benchmark suite for the hot paths of the pipeline, with a baseline comparison.
+
+Cases (inputs built from --seed before timing, so every run does the same work):
+  gen_line                  model.gen_line, --samples_per_class images one at a time
+  gen_line_batch            datagen.gen_line_batch, --samples_per_class images
+  make_dataset_batched      datagen.make_dataset_batched(packed=True), --samples_per_class per class
+  train_step                MLP2 + Adam steps (unpack, forward, backward, step, clip) at --batch_size
+  int_infer_batch[backend]  model.int_infer_batch on --infer_rows packed rows, every INT_BACKENDS entry
+  choose_shift              model.choose_shift on --calib_size rows of layer-1 accumulators
+  quantize_model            model.quantize_model (PTQ + calibration on --calib_size rows)
+  pack_weights              weight_to_memh.pack_weights of a 64x3600 int8 export
+  memh_bytes                weight_to_memh.memh_bytes of those words (the weights.memh text)
+
+Every case runs in its own spawned process (--inprocess to skip that): setup,
+one run under tracemalloc (py_peak_mb: NumPy/Python allocations above the
+setup; torch tensor storage is not traced) whose peak RSS growth over the setup
+is rss_grow_mb, then --warmup untimed runs and timed runs -- at least --repeat
+of them and at least --min_time seconds' worth (min / median / mean / max
+seconds and items/s at the median). torch runs on CPU with --threads threads.
+
+Results go to --out as JSON. With --baseline, every case present in both is
+compared. Timings are gated on the fastest run, which is far steadier than the
+median on a shared machine: a case is SLOWER only when even its min time is
+above the baseline median * (1 + --threshold) plus the baseline's own spread
+(median - min; the max is too outlier-prone), so noisy cases get a wider gate
+than steady ones ("faster" when the median is below the baseline min /
+(1 + --threshold)). A memory figure above baseline *
+(1 + --mem_threshold) + 1 MB is a regression too; the exit status is then 1.
+--update_baseline rewrites the baseline with this run.
+
+Only deps: torch, numpy, standard library
+
+  python bench.py --out bench.json --update_baseline --baseline bench_baseline.json
+  python bench.py --baseline bench_baseline.json --cases "int_infer*" "choose_shift"
+"""
+
+import argparse
+import fnmatch
+import json
+import multiprocessing as mp
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import datagen
+from profiling import max_rss_mb
+
+MEM_SLACK_MB = 1.0     # absolute slack on top of --mem_threshold for small figures
+
+
+# -----------------------------
+# Inputs
+# -----------------------------
+
+def _packed_images(n: int, seed: int, noise_flip: float = 0.012, drop_on: float = 0.02) -> tuple:
+    """n packed (n, 450) uint8 images + labels, balanced over the classes."""
+    X, y = datagen.make_dataset_batched(-(-n // 3), noise_flip=noise_flip, drop_on=drop_on,
+                                        rng=np.random.default_rng(seed), packed=True)
+    return X[:n], y[:n]
+
+def _int_weights(seed: int, hidden: int = 64, in_dim: int = 3600, classes: int = 3) -> tuple:
+    """Seeded int8/int32 weights with export-like ranges (numpy arrays)."""
+    rng = np.random.default_rng(seed)
+    w1 = np.clip(np.round(rng.normal(0, 24, (hidden, in_dim))), -127, 127).astype(np.int8)
+    b1 = np.round(rng.normal(0, 2000, hidden)).astype(np.int32)
+    w2 = np.clip(np.round(rng.normal(0, 48, (classes, hidden))), -127, 127).astype(np.int8)
+    b2 = np.round(rng.normal(0, 500, classes)).astype(np.int32)
+    return w1, b1, w2, b2
+
+
+# -----------------------------
+# Cases: setup(args) -> (fn, items); fn() is what gets timed
+# -----------------------------
+
+def case_gen_line(args):
+    from model import gen_line
+
+    def fn():
+        rng = np.random.default_rng(args.seed)
+        for _ in range(args.samples_per_class):
+            gen_line(rng=rng)
+    return fn, args.samples_per_class
+
+def case_gen_line_batch(args):
+    return (lambda: datagen.gen_line_batch(args.samples_per_class, rng=np.random.default_rng(args.seed)),
+            args.samples_per_class)
+
+def case_make_dataset_batched(args):
+    return (lambda: datagen.make_dataset_batched(args.samples_per_class, noise_flip=0.012, drop_on=0.02,
+                                                 rng=np.random.default_rng(args.seed), packed=True),
+            3 * args.samples_per_class)
+
+def case_train_step(args):
+    import torch
+    import torch.nn as nn
+    from model import MLP2, as_float_input
+
+    X, y = _packed_images(args.batch_size * args.train_steps, args.seed)
+    X, y = torch.from_numpy(X), torch.from_numpy(y)
+    torch.manual_seed(args.seed)
+    model = MLP2(in_dim=3600, hidden=64, out_dim=3)
+    opt = torch.optim.Adam(model.parameters(), lr=1e-3)
+    criterion = nn.CrossEntropyLoss()
+    weights = [p for p in model.parameters() if p.dim() >= 2]
+
+    def fn():
+        model.train()
+        for i in range(0, X.shape[0], args.batch_size):
+            xb, yb = as_float_input(X[i:i + args.batch_size]), y[i:i + args.batch_size]
+            opt.zero_grad(set_to_none=True)
+            loss = criterion(model(xb), yb)
+            loss.backward()
+            opt.step()
+            with torch.no_grad():
+                for p in weights:
+                    p.clamp_(-2.0, 2.0)
+    opt.zero_grad(set_to_none=True)   # first Adam step pulls in lazy imports; keep it out of the case
+    criterion(model(as_float_input(X[:1])), y[:1]).backward()
+    opt.step()
+    return fn, X.shape[0]
+
+def case_int_infer_batch(args, backend: str):
+    import torch
+    from model import int_infer_batch
+
+    X = torch.from_numpy(_packed_images(args.infer_rows, args.seed)[0])
+    w1, b1, w2, b2 = (torch.from_numpy(a) for a in _int_weights(args.seed))
+    return (lambda: int_infer_batch(X, w1, b1, w2, b2, 8, backend=backend)), args.infer_rows
+
+def case_choose_shift(args):
+    import torch
+    from model import choose_shift, int_layer1_acc
+
+    X = torch.from_numpy(_packed_images(args.calib_size, args.seed)[0])
+    w1, b1, _, _ = (torch.from_numpy(a) for a in _int_weights(args.seed))
+    a1 = torch.clamp(int_layer1_acc(X, w1, b1, "reference"), min=0)
+    return (lambda: choose_shift(a1)), args.calib_size
+
+def case_quantize_model(args):
+    import torch
+    from model import MLP2, default_int_backend, quantize_model
+
+    calib_x = torch.from_numpy(_packed_images(args.calib_size, args.seed)[0])
+    torch.manual_seed(args.seed)
+    model = MLP2(in_dim=3600, hidden=64, out_dim=3)
+    return (lambda: quantize_model(model, calib_x, default_int_backend())), args.calib_size
+
+def case_pack_weights(args):
+    from weight_to_memh import pack_weights
+
+    w = _int_weights(args.seed)
+    return (lambda: pack_weights(*w)), w[0].size
+
+def case_memh_bytes(args):
+    from weight_to_memh import memh_bytes, pack_weights
+
+    words = pack_weights(*_int_weights(args.seed))
+    return (lambda: memh_bytes(words)), len(words)
+
+def cases() -> dict:
+    """Case name -> setup function."""
+    from model import INT_BACKENDS, default_int_backend
+
+    out = {"gen_line": case_gen_line,
+           "gen_line_batch": case_gen_line_batch,
+           "make_dataset_batched": case_make_dataset_batched,
+           "train_step": case_train_step}
+    for backend in INT_BACKENDS:
+        if backend != "int_mm" or default_int_backend() == "int_mm":   # needs torch._int_mm
+            out[f"int_infer_batch[{backend}]"] = lambda a, b=backend: case_int_infer_batch(a, b)
+    out.update({"choose_shift": case_choose_shift,
+                "quantize_model": case_quantize_model,
+                "pack_weights": case_pack_weights,
+                "memh_bytes": case_memh_bytes})
+    return out
+
+
+# -----------------------------
+# Measurement
+# -----------------------------
+
+def run_case(name: str, args) -> dict:
+    """Setup, one traced run for memory, args.warmup untimed runs, then timed runs (args.repeat, args.min_time)."""
+    import torch
+    torch.set_num_threads(args.threads)
+
+    fn, items = cases()[name](args)
+    rss0 = max_rss_mb()
+    tracemalloc.start()
+    py0 = tracemalloc.get_traced_memory()[0]
+    fn()
+    py_peak = tracemalloc.get_traced_memory()[1] - py0
+    tracemalloc.stop()
+    rss_grow = max_rss_mb() - rss0
+
+    for _ in range(args.warmup):
+        fn()
+    times = []
+    while len(times) < args.repeat or sum(times) < args.min_time:
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    median = statistics.median(times)
+    return {"items": items, "runs": len(times), "min_s": min(times), "median_s": median, "mean_s": statistics.fmean(times),
+            "max_s": max(times), "items_per_s": items / max(median, 1e-12), "py_peak_mb": py_peak / (1 << 20),
+            "rss_grow_mb": rss_grow}
+
+def _run_case_isolated(name: str, args_dict: dict) -> dict:
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    return run_case(name, argparse.Namespace(**args_dict))
+
+def environment(args) -> dict:
+    import torch
+    return {"python": platform.python_version(), "numpy": np.__version__, "torch": torch.__version__,
+            "platform": platform.platform(), "cpu_count": os.cpu_count(), "threads": args.threads}
+
+
+# -----------------------------
+# Baseline comparison
+# -----------------------------
+
+def compare(current: dict, baseline: dict, threshold: float, mem_threshold: float,
+            patterns=("*",)) -> tuple[list[str], int]:
+    """Report lines and the number of regressions of current vs baseline results (cases matching patterns)."""
+    out, regressions = [], 0
+    if current["params"] != baseline.get("params"):
+        diff = {k: (baseline.get("params", {}).get(k), v) for k, v in current["params"].items()
+                if baseline.get("params", {}).get(k) != v}
+        out.append(f"warning: parameters differ from the baseline (baseline, current): {diff}")
+    out.append(f"{'case':28s} {'base med s':>10s} {'now min s':>10s} {'now med s':>10s} {'min/med':>7s} "
+               f"{'py MB':>14s} {'rss MB':>14s}  status")
+    base = baseline.get("results", {})
+    for name, r in current["results"].items():
+        if name not in base:
+            out.append(f"{name:28s} {'-':>10s} {r['min_s']:10.4f} {r['median_s']:10.4f} {'-':>7s} "
+                       f"{'':>14s} {'':>14s}  new")
+            continue
+        b = base[name]
+        # gate on the fastest run (noise only ever adds time) against the baseline's
+        # median + threshold, widened by the spread the baseline itself measured
+        ratio = r["min_s"] / max(b["median_s"], 1e-12)
+        limit = b["median_s"] * (1 + threshold) + (b["median_s"] - b["min_s"])
+        status = []
+        if r["min_s"] > limit:
+            status.append("SLOWER")
+        elif r["median_s"] * (1 + threshold) < b["min_s"]:
+            status.append("faster")
+        for key, label in (("py_peak_mb", "PY MEM"), ("rss_grow_mb", "RSS")):
+            if r[key] > b[key] * (1 + mem_threshold) + MEM_SLACK_MB:
+                status.append(label)
+        regressions += any(s.isupper() for s in status)
+        out.append(f"{name:28s} {b['median_s']:10.4f} {r['min_s']:10.4f} {r['median_s']:10.4f} {ratio:7.2f} "
+                   f"{b['py_peak_mb']:6.1f} ->{r['py_peak_mb']:6.1f} {b['rss_grow_mb']:6.1f} ->{r['rss_grow_mb']:6.1f}  "
+                   f"{' '.join(status) or 'ok'}")
+    for name in base:
+        if name not in current["results"] and any(fnmatch.fnmatchcase(name, p) for p in patterns):
+            out.append(f"{name:28s} (in the baseline only)")
+    out.append(f"{regressions} regression(s) (min time > baseline median +{threshold*100:.0f}% + spread, memory > +{mem_threshold*100:.0f}% "
+               f"+ {MEM_SLACK_MB:g} MB)")
+    return out, regressions
+
+
+# -----------------------------
+# Main
+# -----------------------------
+
+def main():
+    ap = argparse.ArgumentParser(description="CPU benchmarks of the hot paths, compared with a stored baseline.")
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--samples_per_class", type=int, default=500, help="generator cases")
+    ap.add_argument("--batch_size", type=int, default=128, help="train_step mini-batch")
+    ap.add_argument("--train_steps", type=int, default=20, help="mini-batches per train_step run")
+    ap.add_argument("--infer_rows", type=int, default=4096, help="int_infer_batch rows")
+    ap.add_argument("--calib_size", type=int, default=4096, help="choose_shift / quantize_model rows")
+    ap.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    ap.add_argument("--warmup", type=int, default=1, help="untimed runs per case before the timed ones")
+    ap.add_argument("--min_time", type=float, default=2.0, help="keep timing a case until this many seconds of runs")
+    ap.add_argument("--threads", type=int, default=1, help="torch intra-op threads (and OMP/BLAS in the spawned cases)")
+    ap.add_argument("--cases", nargs="*", default=["*"], help="case name patterns (fnmatch)")
+    ap.add_argument("--list", action="store_true", help="list the cases and exit")
+    ap.add_argument("--inprocess", action="store_true", help="run every case in this process")
+    ap.add_argument("--out", type=str, default="bench.json")
+    ap.add_argument("--baseline", type=str, default="", help="JSON of an earlier run to compare with")
+    ap.add_argument("--threshold", type=float, default=0.10,
+                    help="allowed increase of the min time over the baseline median (fraction)")
+    ap.add_argument("--mem_threshold", type=float, default=0.20, help="allowed memory increase (fraction)")
+    ap.add_argument("--update_baseline", action="store_true", help="also write this run to --baseline")
+    args = ap.parse_args()
+
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""   # CPU only, here and in the spawned cases
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(args.threads)
+
+    names = [n for n in cases() if any(fnmatch.fnmatchcase(n, p) for p in args.cases)]
+    if args.list or not names:
+        print("\n".join(cases()))
+        return
+
+    params = {k: getattr(args, k) for k in ("seed", "samples_per_class", "batch_size", "train_steps",
+                                            "infer_rows", "calib_size", "repeat", "warmup", "min_time", "threads")}
+    results = {}
+    ctx = mp.get_context("spawn")
+    for name in names:
+        if args.inprocess:
+            r = run_case(name, args)
+        else:
+            with ctx.Pool(1) as pool:
+                r = pool.apply(_run_case_isolated, (name, vars(args)))
+        results[name] = r
+        print(f"{name:28s} median {r['median_s']*1e3:10.2f} ms  (min {r['min_s']*1e3:10.2f}, {r['runs']:4d} runs)  "
+              f"{r['items_per_s']:12.0f} items/s  py peak {r['py_peak_mb']:7.2f} MB  "
+              f"rss +{r['rss_grow_mb']:7.2f} MB")
+
+    current = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "params": params,
+               "environment": environment(args), "results": results}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(current, f, indent=1)
+    print(f"Results -> {os.path.abspath(args.out)}")
+
+    regressions = 0
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            lines, regressions = compare(current, json.load(f), args.threshold, args.mem_threshold,
+                                         args.cases)
+        print(f"Against baseline {os.path.abspath(args.baseline)}:")
+        print("\n".join("  " + s for s in lines))
+    elif args.baseline and not args.update_baseline:
+        print(f"no baseline at {args.baseline} (write one with --update_baseline)")
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=1)
+        print(f"Baseline updated -> {os.path.abspath(args.baseline)}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
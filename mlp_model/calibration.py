@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Requant SHIFT calibration (NumPy, no torch).
+
+ShiftHistogram is the exact one-pass histogram behind model.choose_shift and
+model.quantize_model: layer-1 accumulators are counted at the requant bin
+edges of every candidate SHIFT, and choose() / choose_per_channel() minimize
+the choose_shift objective (low saturation, enough nonzero outputs, mean a1_q
+near 24) over all shifts at once. Together with int_engine.py (inference and
+requant_relu_np) and weight_to_memh.py (packing) this covers everything after
+training without importing torch; model.py uses the same class.
+
+Only deps: numpy, standard library
+
+Run directly to calibrate an export's SHIFT on fresh generated samples and
+compare it with the exported one (text dumps or a weights.memh / .bin):
+  python calibration.py --weights_dir export_mlp_int --samples 30000
+  python calibration.py --memh weights.memh --per_channel
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+# -----------------------------
+# Histogram
+# -----------------------------
+
+class ShiftHistogram:
+    """
+    Exact histogram of layer-1 accumulators (after ReLU) at the requant bin edges
+    of every candidate SHIFT, so one pass over the activations gives the a1_q
+    distribution -- and choose_shift's statistics -- for all shifts at once.
+    a1_q == k exactly when a1 >= k*2^s - r for k, s (r = rounding offset), so the
+    edges k*2^s - r (k = 1..127) of all shifts are the only places counts can change.
+    update() can be called on chunks of any size; memory is O(#edges).
+    channels=H keeps one histogram per hidden unit (per-row shifts).
+    """
+
+    def __init__(self, shift_min: int = 0, shift_max: int = 20, channels: int = 0):
+        if shift_min < 0 or shift_max < shift_min:
+            raise ValueError("need 0 <= shift_min <= shift_max")
+        self.shifts = np.arange(shift_min, shift_max + 1, dtype=np.int64)
+        k = np.arange(1, 128, dtype=np.int64)
+        rnd = np.where(self.shifts > 0, 1 << np.maximum(self.shifts - 1, 0), 0)
+        self.thresholds = (k[None, :] << self.shifts[:, None]) - rnd[:, None]   # (S, 127)
+        self.edges = np.unique(self.thresholds)
+        self.channels = channels
+        # counts[c, i] = #a of channel c with edges[i-1] <= a < edges[i]
+        self.counts = np.zeros((max(1, channels), len(self.edges) + 1), dtype=np.int64)
+        self.n = 0  # activations per channel
+
+    def update(self, a1_int32) -> None:
+        """a1_int32: (N, H) accumulators >= 0 (NumPy array or CPU torch tensor)."""
+        C, E = self.counts.shape
+        a = np.asarray(a1_int32, dtype=np.int64).reshape(-1, C)
+        if a.size and a.min() < 0:
+            raise ValueError("calibration activations must be >= 0 (after ReLU)")
+        idx = np.searchsorted(self.edges, a, side="right") + np.arange(C) * E
+        self.counts += np.bincount(idx.reshape(-1), minlength=C * E).reshape(C, E)
+        self.n += a.shape[0]
+
+    def level_counts(self) -> np.ndarray:
+        """(C, S, 128) int64: how many activations requantize to each a1_q value, per channel and shift."""
+        below = np.cumsum(self.counts, axis=1)[:, np.searchsorted(self.edges, self.thresholds)]
+        full = np.full(below.shape[:2] + (1,), self.n, dtype=np.int64)
+        return np.diff(np.concatenate([np.zeros_like(full), below, full], axis=2), axis=2)
+
+    @staticmethod
+    def _stats(L: np.ndarray, n: int) -> dict:
+        """choose_shift statistics + objective for level counts L (..., 128)."""
+        L = L.astype(np.float64)
+        sat = L[..., 127] / n
+        nz = 1.0 - L[..., 0] / n
+        mean = (L @ np.arange(128, dtype=np.float64)) / n
+        # lower median, as torch.median returns
+        med = np.argmax(np.cumsum(L, axis=-1) > (n - 1) // 2, axis=-1).astype(np.float64)
+        # objective: lower is better
+        # - heavy penalty for saturation
+        # - penalty if too sparse (dead)
+        # - penalty if mean too tiny (all near 0) or too huge (likely to saturate later)
+        target_mean = 24.0
+        obj = (sat * 10.0) + (np.maximum(0.20 - nz, 0.0) * 3.0) + (np.abs(mean - target_mean) / target_mean)
+        return {"sat_pct": sat * 100.0, "nonzero_pct": nz * 100.0, "mean": mean, "median": med, "obj": obj}
+
+    def _stat_dict(self, st: dict, i, shift) -> dict:
+        return {"shift": shift, **{k: v[i].item() for k, v in st.items()}}
+
+    def _index(self, shift) -> np.ndarray:
+        i = np.asarray(shift, dtype=np.int64) - self.shifts[0]
+        if (i < 0).any() or (i >= len(self.shifts)).any():
+            raise ValueError(f"shift {shift} outside the histogram's range "
+                             f"{int(self.shifts[0])}..{int(self.shifts[-1])}")
+        return i
+
+    def choose(self, shift=None):
+        """
+        Returns best_shift, stats_dict_for_best, all_stats_list (channels summed).
+        shift: report this (fixed) shift instead of the best one.
+        """
+        if self.n == 0:
+            raise ValueError("no calibration activations")
+        st = self._stats(self.level_counts().sum(0), self.n * self.counts.shape[0])
+        all_stats = [self._stat_dict(st, i, s) for i, s in enumerate(self.shifts.tolist())]
+        best = all_stats[int(np.argmin(st["obj"])) if shift is None else int(self._index(shift))]
+        return best["shift"], best, all_stats
+
+    def choose_per_channel(self, shifts=None):
+        """
+        Same objective, minimized per channel. Returns (shifts (C,) int32,
+        stats of all channels at their own shifts, per-channel best stats list).
+        shifts: report this (fixed) per-channel table instead of the best one.
+        """
+        if self.n == 0 or not self.channels:
+            raise ValueError("no calibration activations / not a per-channel histogram")
+        L = self.level_counts()
+        st = self._stats(L, self.n)                     # (C, S)
+        best = np.argmin(st["obj"], axis=1) if shifts is None else self._index(shifts)
+        shifts = self.shifts[best].astype(np.int32)
+        per_channel = [self._stat_dict(st, (c, int(b)), int(shifts[c])) for c, b in enumerate(best)]
+        combined = self._stats(L[np.arange(self.channels), best].sum(0, keepdims=True),
+                               self.n * self.channels)
+        return shifts, self._stat_dict(combined, 0, "per-row"), per_channel
+
+
+def choose_shift(calib_a1_int32: np.ndarray, shift_min=0, shift_max=20):
+    """
+    Heuristic SHIFT search over (N, H) accumulators >= 0, one histogram pass.
+    Returns: best_shift, stats_dict_for_best, all_stats_list
+    """
+    hist = ShiftHistogram(shift_min, shift_max)
+    hist.update(calib_a1_int32)
+    return hist.choose()
+
+
+def calibrate(engine, chunks, shift_min: int = 0, shift_max: int = 20, per_channel: bool = False) -> ShiftHistogram:
+    """ShiftHistogram of int_engine.IntMLP layer-1 accumulators (after ReLU) over packed (X, y) chunks."""
+    hist = ShiftHistogram(shift_min, shift_max, channels=engine.hidden if per_channel else 0)
+    for X, _ in chunks:
+        hist.update(np.maximum(engine.layer1(X), 0))
+    return hist
+
+
+# -----------------------------
+# Main
+# -----------------------------
+
+def main():
+    from evaluate import generated_chunks
+    from int_engine import IntMLP, MappedIntMLP, MemhImage, load_txt_weights
+
+    ap = argparse.ArgumentParser(description="Calibrate an export's requant SHIFT on generated samples (no torch).")
+    ap.add_argument("--weights_dir", type=str, default=str(Path(__file__).resolve().parent))
+    ap.add_argument("--memh", type=str, default="", help="use this weights.memh / .bin (SHIFT from --weights_dir)")
+    ap.add_argument("--samples", type=int, default=30000)
+    ap.add_argument("--chunk", type=int, default=8192)
+    ap.add_argument("--seed", type=int, default=11)
+    ap.add_argument("--noise_flip", type=float, default=0.012)
+    ap.add_argument("--drop_on", type=float, default=0.02)
+    ap.add_argument("--shift_min", type=int, default=0)
+    ap.add_argument("--shift_max", type=int, default=20)
+    ap.add_argument("--per_channel", action="store_true", help="one SHIFT per hidden unit")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    if args.memh:
+        eng = MappedIntMLP(MemhImage(args.memh), load_txt_weights(args.weights_dir)[4])
+    else:
+        eng = IntMLP(*load_txt_weights(args.weights_dir))
+    chunks = generated_chunks(args.samples, args.chunk, args.seed, args.noise_flip, args.drop_on)
+    hist = calibrate(eng, chunks, args.shift_min, args.shift_max, args.per_channel)
+    dt = time.perf_counter() - t0
+
+    exported = eng.shift
+    n = hist.n if args.per_channel else hist.n // eng.hidden   # a per-tensor histogram counts activations
+    print(f"{n} samples x {eng.hidden} hidden units in {dt:.2f}s")
+    if args.per_channel:
+        shifts, combined, _ = hist.choose_per_channel()
+        counts = {int(s): int(c) for s, c in zip(*np.unique(shifts, return_counts=True))}
+        print(f"Per-row SHIFT: min={shifts.min()} max={shifts.max()}  rows per shift {counts}")
+        print(f"  combined: sat={combined['sat_pct']:.2f}%  nonzero={combined['nonzero_pct']:.2f}%  "
+              f"mean={combined['mean']:.2f}  median={combined['median']:.2f}")
+        if np.ndim(exported):
+            print(f"  differs from the exported table on {int((shifts != exported).sum())} rows")
+        return
+    best, stats, all_stats = hist.choose()
+    print("SHIFT search results (top 5 by objective):")
+    for s in sorted(all_stats, key=lambda d: d["obj"])[:5]:
+        print(f"  SHIFT={s['shift']:2d}  sat={s['sat_pct']:.2f}%  nonzero={s['nonzero_pct']:.2f}%  "
+              f"mean={s['mean']:.2f}  median={s['median']:.2f}")
+    print(f"Chosen SHIFT = {best}")
+    if not np.ndim(exported) and args.shift_min <= exported <= args.shift_max:
+        st = hist.choose(exported)[1]
+        print(f"Exported SHIFT = {exported}  (sat={st['sat_pct']:.2f}%, nonzero={st['nonzero_pct']:.2f}%, "
+              f"mean={st['mean']:.2f}, median={st['median']:.2f})")
+
+
+if __name__ == "__main__":
+    main()
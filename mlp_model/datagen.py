@@ -0,0 +1,772 @@
+#!/usr/bin/env python3
+"""
+Batched synthetic data generation for the 60x60 circle/square/line dataset.
+
+The per-sample generators in model.py (gen_circle / gen_square / gen_line)
+build one image at a time with Python loops. This module produces the same
+shape distributions for N samples at once using whole-array NumPy ops:
+  * circle : radius/angle harmonics are precomputed once per possible center
+             and combined with one GEMM per center (no per-image trig)
+  * square : per-column / per-row edge wobble is drawn as (N, size) arrays and
+             rasterized with one broadcast compare
+  * line   : all segment sample points are rasterized with one scatter, then
+             dilated by the per-sample thickness
+  * dropout / salt-and-pepper noise are applied over the full batch
+
+Datasets can be kept bit-packed (np.packbits along the pixel axis, 450 bytes
+per 60x60 image instead of 3600 float32) with packed=True; see pack_images /
+unpack_images.
+
+Generated datasets can be cached on disk as .npy files keyed by a hash of the
+generation parameters and the generator source (cached_datasets), and are
+reopened memory-mapped on later runs.
+
+StreamingBatches produces an endless stream of fresh packed mini-batches from
+background threads or processes through a bounded queue, for training on
+unlimited augmented data in constant memory.
+
+Only deps: numpy, standard library
+
+Run directly to benchmark against the per-sample path in model.py:
+  python datagen.py --n_per_class 5000
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import math
+import multiprocessing as mp
+import os
+import pickle
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+DEFAULT_CHUNK = 2048
+DEFAULT_SHARDS = 32
+CACHE_VERSION = 2
+STREAM_POLL_S = 1.0    # StreamingBatches: how often a waiting consumer checks its producers
+
+LINE_ANGLES = np.array([0, 15, 30, 45, 60, 75, 90, 105, 120, 135, 150, 165], dtype=np.float64)
+
+
+# -----------------------------
+# Precomputed grids
+# -----------------------------
+
+@lru_cache(maxsize=None)
+def _grid(size: int):
+    """Row / column coordinate grids, shape (size, size), int32."""
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.int32)
+    return yy, xx
+
+@lru_cache(maxsize=None)
+def _circle_tables(size: int, center_jitter: int):
+    """
+    Distance and angular harmonics for every possible circle center.
+    Centers are size//2 + [-center_jitter, center_jitter] on each axis, so there
+    are K = (2*center_jitter+1)^2 of them; table index is (cy_off+cj)*(2cj+1) + (cx_off+cj).
+    Returns:
+      (K, 7, size*size) float32 -> [dist, sin3a, cos3a, sin5a, cos5a, sin7a, cos7a]
+    """
+    yy, xx = _grid(size)
+    offs = np.arange(-center_jitter, center_jitter + 1)
+    cy = size // 2 + offs[:, None]
+    cx = size // 2 + offs[None, :]
+    shape = (offs.size, offs.size, size, size)
+    dy = np.broadcast_to(yy - cy[:, :, None, None], shape).reshape(-1, size * size)
+    dx = np.broadcast_to(xx - cx[:, :, None, None], shape).reshape(-1, size * size)
+    ang = np.arctan2(dy, dx)
+    tab = np.empty((dy.shape[0], 7, size * size), dtype=np.float32)
+    tab[:, 0] = np.sqrt(dx * dx + dy * dy)
+    for i, k in enumerate((3, 5, 7)):
+        tab[:, 1 + 2 * i] = np.sin(k * ang)
+        tab[:, 2 + 2 * i] = np.cos(k * ang)
+    return tab
+
+
+# -----------------------------
+# Batched shape generators
+# -----------------------------
+
+def gen_circle_batch(n: int, size=60, rng=None,
+                     r_min=12, r_max=22,
+                     thickness_min=1, thickness_max=3,
+                     center_jitter=4,
+                     roughness=2.5) -> np.ndarray:
+    """Batched gen_circle. Returns (n, size*size) uint8 in {0,1}."""
+    if rng is None:
+        rng = np.random.default_rng()
+    tab = _circle_tables(size, center_jitter)
+
+    ox = rng.integers(-center_jitter, center_jitter + 1, size=n)
+    oy = rng.integers(-center_jitter, center_jitter + 1, size=n)
+    r0 = rng.integers(r_min, r_max + 1, size=n).astype(np.float32)
+    t = rng.integers(thickness_min, thickness_max + 1, size=n).astype(np.float32)
+    amp = rng.uniform(-1.0, 1.0, size=(n, 3)) * np.array([0.50, 0.30, 0.20]) * roughness
+    phase = rng.uniform(0, 2 * math.pi, size=(n, 3))
+
+    k = (oy + center_jitter) * (2 * center_jitter + 1) + (ox + center_jitter)
+
+    # dist - rad_noise as a (m,7) @ (7,size*size) GEMM per center, using
+    # sin(k*ang + p) = sin(k*ang)*cos(p) + cos(k*ang)*sin(p)
+    # (grouping by center avoids gathering a (n,7,size*size) copy of the tables)
+    coef = np.empty((n, 7), dtype=np.float32)
+    coef[:, 0] = 1.0
+    coef[:, 1::2] = -amp * np.cos(phase)
+    coef[:, 2::2] = -amp * np.sin(phase)
+    d = np.empty((n, size * size), dtype=np.float32)
+    order = np.argsort(k, kind="stable")
+    centers, starts = np.unique(k[order], return_index=True)
+    for c, rows in zip(centers, np.split(order, starts[1:])):
+        d[rows] = coef[rows] @ tab[c]
+    d -= r0[:, None]
+
+    ring = np.abs(d, out=d) <= t[:, None]
+    return ring.view(np.uint8)
+
+def gen_square_batch(n: int, size=60, rng=None,
+                     side_min=22, side_max=34,
+                     thickness_min=1, thickness_max=3,
+                     center_jitter=4,
+                     wobble=2,
+                     fill_prob=0.10) -> np.ndarray:
+    """Batched gen_square. Returns (n, size*size) uint8 in {0,1}."""
+    if rng is None:
+        rng = np.random.default_rng()
+
+    cx = size // 2 + rng.integers(-center_jitter, center_jitter + 1, size=n)
+    cy = size // 2 + rng.integers(-center_jitter, center_jitter + 1, size=n)
+    side = rng.integers(side_min, side_max + 1, size=n)
+    t = rng.integers(thickness_min, thickness_max + 1, size=n)
+
+    half = side // 2
+    x0 = np.maximum(0, cx - half)
+    x1 = np.minimum(size - 1, cx + half)
+    y0 = np.maximum(0, cy - half)
+    y1 = np.minimum(size - 1, cy + half)
+
+    # ragged outline: one wobble draw per column (top/bottom) and per row (left/right)
+    wob = rng.integers(-wobble, wobble + 1, size=(4, n, size), dtype=np.int16)
+    edge = np.stack([y0, y1, x0, x1]).astype(np.int16)[:, :, None] + wob
+    np.clip(edge, 0, size - 1, out=edge)
+
+    axis = np.arange(size, dtype=np.int16)
+    col_on = ((axis >= x0[:, None]) & (axis <= x1[:, None]))[:, None, :]
+    row_on = ((axis >= y0[:, None]) & (axis <= y1[:, None]))[:, :, None]
+
+    # pixel is on if within t of its column's top/bottom edge or its row's left/right edge
+    tt = t.astype(np.int16)[:, None, None]
+    ay = axis[None, :, None]
+    ax = axis[None, None, :]
+    img = (np.abs(ay - edge[0][:, None, :]) <= tt) | (np.abs(ay - edge[1][:, None, :]) <= tt)
+    img &= col_on
+    img |= ((np.abs(ax - edge[2][:, :, None]) <= tt) | (np.abs(ax - edge[3][:, :, None]) <= tt)) & row_on
+
+    # occasionally add some interior pixels (imperfect fill)
+    filled = np.flatnonzero(rng.random(n) < fill_prob)
+    if filled.size:
+        dens = rng.uniform(0.02, 0.10, size=filled.size)
+        fill_mask = rng.random((filled.size, size, size)) < dens[:, None, None]
+        fill_mask &= col_on[filled] & row_on[filled]
+        img[filled] |= fill_mask
+
+    return img.reshape(n, -1).view(np.uint8)
+
+def _dilate_square(img: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """Chebyshev dilation of (n, size, size) bool images by per-sample radius t."""
+    out = img.copy()
+    for k in range(1, int(t.max(initial=0)) + 1):
+        m = t >= k
+        src = img[m]
+        acc = out[m]
+        acc[:, :, k:] |= src[:, :, :-k]
+        acc[:, :, :-k] |= src[:, :, k:]
+        out[m] = acc
+    rows = out.copy()
+    for k in range(1, int(t.max(initial=0)) + 1):
+        m = t >= k
+        src = rows[m]
+        acc = out[m]
+        acc[:, k:, :] |= src[:, :-k, :]
+        acc[:, :-k, :] |= src[:, k:, :]
+        out[m] = acc
+    return out
+
+def _scatter_points(n: int, size: int, px: np.ndarray, py: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """Set pixels (py, px) where valid and in bounds. px/py/valid: (n, P)."""
+    valid = valid & (px >= 0) & (px < size) & (py >= 0) & (py < size)
+    img = np.zeros((n, size, size), dtype=bool)
+    sample = np.broadcast_to(np.arange(n)[:, None], px.shape)
+    img[sample[valid], py[valid], px[valid]] = True
+    return img
+
+def gen_line_batch(n: int, size=60, rng=None,
+                   thickness_min=1, thickness_max=3,
+                   angle_choices=None,
+                   center_jitter=6,
+                   length_min=30, length_max=56,
+                   broken_prob=0.35) -> np.ndarray:
+    """Batched gen_line. Returns (n, size*size) uint8 in {0,1}."""
+    if rng is None:
+        rng = np.random.default_rng()
+
+    if angle_choices is None:
+        # prefer some easy angles but allow random too
+        easy = rng.random(n) < 0.7
+        angle = np.where(easy, rng.choice(LINE_ANGLES, size=n), rng.uniform(0, 180, size=n))
+    else:
+        angle = rng.choice(np.asarray(angle_choices, dtype=np.float64), size=n)
+
+    theta = np.radians(angle)
+    cx = size // 2 + rng.integers(-center_jitter, center_jitter + 1, size=n)
+    cy = size // 2 + rng.integers(-center_jitter, center_jitter + 1, size=n)
+    length = rng.integers(length_min, length_max + 1, size=n)
+    t = rng.integers(thickness_min, thickness_max + 1, size=n)
+
+    # endpoints
+    dx = np.cos(theta) * (length / 2.0)
+    dy = np.sin(theta) * (length / 2.0)
+    x0, y0 = cx - dx, cy - dy
+    x1, y1 = cx + dx, cy + dy
+
+    # rasterize all segments by sampling points along them
+    steps = np.maximum(2, length * 2)
+    i = np.arange(int(steps.max()) + 1)[None, :]
+    u = i / steps[:, None]
+    px = np.rint(x0[:, None] * (1 - u) + x1[:, None] * u).astype(np.int64)
+    py = np.rint(y0[:, None] * (1 - u) + y1[:, None] * u).astype(np.int64)
+
+    img = _dilate_square(_scatter_points(n, size, px, py, i <= steps[:, None]), t)
+
+    # sometimes break the line (remove a chunk)
+    broken = np.flatnonzero(rng.random(n) < broken_prob)
+    if broken.size:
+        st = steps[broken]
+        cut_len = rng.integers(np.maximum(2, st // 6), np.maximum(3, st // 3))
+        cut_start = rng.integers(0, np.maximum(1, st - cut_len))
+        in_cut = (i >= cut_start[:, None]) & (i < (cut_start + cut_len)[:, None])
+        cut = _dilate_square(_scatter_points(broken.size, size, px[broken], py[broken], in_cut), t[broken])
+        img[broken] &= ~cut
+
+    return img.reshape(n, -1).view(np.uint8)
+
+
+GENERATORS = (gen_circle_batch, gen_square_batch, gen_line_batch)
+
+
+# -----------------------------
+# Batched noise
+# -----------------------------
+
+def apply_noise_batch(img: np.ndarray, drop_on: float, noise_flip: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    In-place dropout of "on" pixels followed by salt/pepper flips over a whole
+    (n, size*size) uint8 batch. Same semantics as _add_dropout + _add_salt_pepper.
+    """
+    if drop_on > 0.0:
+        img &= (rng.random(img.shape, dtype=np.float32) >= drop_on).view(np.uint8)
+    if noise_flip > 0.0:
+        img ^= (rng.random(img.shape, dtype=np.float32) < noise_flip).view(np.uint8)
+    return img
+
+
+# -----------------------------
+# Bit packing
+# -----------------------------
+
+def packed_width(size: int = 60) -> int:
+    """Bytes per packed image: one bit per pixel, MSB first (np.packbits order)."""
+    return (size * size + 7) // 8
+
+def pack_images(X: np.ndarray) -> np.ndarray:
+    """(N, P) {0,1} (any dtype) -> (N, ceil(P/8)) uint8."""
+    return np.packbits(np.asarray(X) != 0, axis=1)
+
+def unpack_images(P: np.ndarray, size: int = 60, dtype=np.uint8) -> np.ndarray:
+    """(N, ceil(size*size/8)) uint8 -> (N, size*size) {0,1} of dtype."""
+    return np.unpackbits(P, axis=1, count=size * size).astype(dtype, copy=False)
+
+
+# -----------------------------
+# Dataset assembly
+# -----------------------------
+
+def fill_class(out: np.ndarray, label: int, size: int,
+               noise_flip: float, drop_on: float,
+               rng: np.random.Generator, chunk: int = DEFAULT_CHUNK) -> None:
+    """
+    Generate len(out) samples of one class into out, chunk by chunk.
+    out is (n, size*size) uint8 for raw pixels or (n, packed_width(size)) uint8 for packed.
+    """
+    gen = GENERATORS[label]
+    packed = out.shape[1] != size * size
+    for i in range(0, out.shape[0], chunk):
+        m = min(chunk, out.shape[0] - i)
+        img = apply_noise_batch(gen(m, size=size, rng=rng), drop_on, noise_flip, rng)
+        out[i:i + m] = np.packbits(img, axis=1) if packed else img
+
+def make_dataset_batched(n_per_class: int,
+                         size=60,
+                         noise_flip=0.01,
+                         drop_on=0.02,
+                         rng=None,
+                         chunk: int = DEFAULT_CHUNK,
+                         packed: bool = False):
+    """
+    Drop-in replacement for model.make_dataset built on the batched generators.
+    Returns:
+      X: (N, size*size) float32 in {0,1}, or (N, packed_width(size)) uint8 if packed
+      y: (N,) int64 in {0,1,2}  (0=circle,1=square,2=line)
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    n = 3 * n_per_class
+    X_u8 = np.empty((n, packed_width(size) if packed else size * size), dtype=np.uint8)
+    y = np.repeat(np.arange(3, dtype=np.int64), n_per_class)
+    for label in range(3):
+        lo = label * n_per_class
+        fill_class(X_u8[lo:lo + n_per_class], label, size, noise_flip, drop_on, rng, chunk)
+
+    # shuffle
+    idx = rng.permutation(n)
+    if packed:
+        return X_u8[idx], y[idx]
+    return X_u8[idx].astype(np.float32), y[idx]
+
+
+# -----------------------------
+# Sharded multiprocess generation
+# -----------------------------
+
+def _gen_shard(out: np.ndarray, y_shard: np.ndarray, lo: int,
+               seed: np.random.SeedSequence, size: int,
+               noise_flip: float, drop_on: float, chunk: int) -> None:
+    """Generate rows [lo, lo+len(y_shard)) of out; everything is drawn from the shard's own seed."""
+    rng = np.random.default_rng(seed)
+    for label in range(3):
+        rows = lo + np.flatnonzero(y_shard == label)
+        if rows.size == 0:
+            continue
+        tmp = np.empty((rows.size, out.shape[1]), dtype=np.uint8)
+        fill_class(tmp, label, size, noise_flip, drop_on, rng, chunk)
+        out[rows] = tmp
+
+def _gen_shard_shm(shm_name: str, shape: tuple, *args) -> None:
+    """Pool worker entry: attach to the parent's shared-memory array and fill one shard."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        _gen_shard(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf), *args)
+    finally:
+        shm.close()
+
+def make_dataset_sharded(n_per_class: int,
+                         size=60,
+                         noise_flip=0.01,
+                         drop_on=0.02,
+                         seed=None,
+                         shards: int = DEFAULT_SHARDS,
+                         workers: int | None = None,
+                         chunk: int = DEFAULT_CHUNK,
+                         packed: bool = False):
+    """
+    Parallel make_dataset. The shuffled label order is drawn first, then the rows
+    are split into `shards` contiguous shards, each generated by a process-pool
+    worker with its own child of SeedSequence(seed) and written straight into a
+    shared-memory array (no pickling of images back to the parent).
+
+    Output depends only on (seed, shards), never on `workers`.
+    seed: int or np.random.SeedSequence
+    Returns:
+      X: (N, size*size) float32 in {0,1}, or (N, packed_width(size)) uint8 if packed
+      y: (N,) int64 in {0,1,2}  (0=circle,1=square,2=line)
+    """
+    ss = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    label_seed, *shard_seeds = ss.spawn(shards + 1)
+
+    n = 3 * n_per_class
+    y = np.random.default_rng(label_seed).permutation(np.repeat(np.arange(3, dtype=np.int64), n_per_class))
+    bounds = np.linspace(0, n, shards + 1).astype(np.int64)
+    shape = (n, packed_width(size) if packed else size * size)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, shards))
+
+    shard_args = [(y[bounds[i]:bounds[i + 1]], int(bounds[i]), shard_seeds[i], size, noise_flip, drop_on, chunk)
+                  for i in range(shards)]
+
+    if workers == 1:
+        X_u8 = np.empty(shape, dtype=np.uint8)
+        for a in shard_args:
+            _gen_shard(X_u8, *a)
+        return (X_u8 if packed else X_u8.astype(np.float32)), y
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, shape[0] * shape[1]))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for f in [pool.submit(_gen_shard_shm, shm.name, shape, *a) for a in shard_args]:
+                f.result()
+        X = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf).astype(np.uint8 if packed else np.float32)
+    finally:
+        shm.close()
+        shm.unlink()
+    return X, y
+
+
+# -----------------------------
+# On-disk dataset cache
+# -----------------------------
+
+def source_fingerprint(*objs) -> str:
+    """sha256 over the source of modules/functions, so generator edits invalidate caches."""
+    h = hashlib.sha256()
+    for obj in objs:
+        h.update(inspect.getsource(obj).encode("utf-8"))
+    return h.hexdigest()
+
+def generator_fingerprint(sharded: bool = False) -> str:
+    """
+    source_fingerprint of just the code a batched (or sharded) dataset is built
+    from, plus LINE_ANGLES, so edits elsewhere in this module keep the cache.
+    """
+    assembly = (_gen_shard, make_dataset_sharded) if sharded else (make_dataset_batched,)
+    h = hashlib.sha256(source_fingerprint(
+        _grid, _circle_tables, gen_circle_batch, gen_square_batch, _dilate_square, _scatter_points,
+        gen_line_batch, apply_noise_batch, fill_class, pack_images, *assembly).encode("utf-8"))
+    h.update(LINE_ANGLES.tobytes())
+    return h.hexdigest()
+
+def cache_key(params: dict, fingerprint: str) -> str:
+    blob = json.dumps({"version": CACHE_VERSION, "params": params, "fingerprint": fingerprint},
+                      sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:24]
+
+def _read_meta(entry: str):
+    try:
+        with open(os.path.join(entry, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _open_entry(entry: str, meta: dict):
+    """Memory-map every array of a complete cache entry (copy-on-write, so torch.from_numpy is happy)."""
+    arrays = {}
+    for name, spec in meta["arrays"].items():
+        arr = np.load(os.path.join(entry, name + ".npy"), mmap_mode="c")
+        if list(arr.shape) != spec["shape"] or str(arr.dtype) != spec["dtype"]:
+            raise ValueError(f"cache entry {entry}: {name} does not match meta.json")
+        arrays[name] = arr
+    return arrays
+
+def _prune_stale(cache_dir: str, kind: str, fingerprint: str, keep: str) -> None:
+    """
+    Drop entries of the same kind written by other generator code, entries of
+    an older cache version, and half-written ones. Other kinds are left alone.
+    """
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if name == keep or not os.path.isdir(entry):
+            continue
+        meta = _read_meta(entry)
+        if (meta is None or meta.get("version") != CACHE_VERSION
+                or (meta.get("kind") == kind and meta.get("fingerprint") != fingerprint)):
+            shutil.rmtree(entry, ignore_errors=True)
+
+def cached_datasets(cache_dir: str, params: dict, fingerprint: str, generate, kind: str = ""):
+    """
+    Return the arrays produced by generate() (a dict name -> ndarray), caching
+    them under cache_dir/<hash(params, fingerprint)>/ as .npy files.
+    On a hit nothing is generated: every array is reopened with np.load(mmap_mode="c").
+    kind names the generator family (e.g. the --datagen mode); when a new entry
+    is written, entries of the same kind with a different fingerprint are removed.
+    Returns: (arrays, hit)
+    """
+    key = cache_key(params, fingerprint)
+    entry = os.path.join(cache_dir, key)
+
+    meta = _read_meta(entry)
+    if meta is not None and meta.get("params") == params and meta.get("fingerprint") == fingerprint:
+        try:
+            return _open_entry(entry, meta), True
+        except (OSError, ValueError):
+            pass
+    shutil.rmtree(entry, ignore_errors=True)
+
+    arrays = generate()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir)
+    try:
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), np.ascontiguousarray(arr))
+        meta = {
+            "version": CACHE_VERSION,
+            "kind": kind,
+            "params": params,
+            "fingerprint": fingerprint,
+            "arrays": {name: {"shape": list(arr.shape), "dtype": str(arr.dtype)} for name, arr in arrays.items()},
+        }
+        # meta.json last: an entry without it is incomplete
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2, sort_keys=True)
+        os.replace(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if _read_meta(entry) is None:
+            raise
+        # another process published the same entry first
+    _prune_stale(cache_dir, kind, fingerprint, keep=key)
+    return _open_entry(entry, meta), False
+
+
+# -----------------------------
+# Streaming mini-batches
+# -----------------------------
+
+def _stream_blocks(seed, block: int, batch_size: int, size: int, noise_flip: float, drop_on: float):
+    """
+    Endless (X_packed, y, gen_seconds) mini-batches. Samples are generated `block`
+    at a time (labels uniform over the 3 classes) and then cut into batches.
+    """
+    rng = np.random.default_rng(seed)
+    width = packed_width(size)
+    while True:
+        t0 = time.perf_counter()
+        y = rng.integers(0, 3, size=block)
+        X = np.empty((block, width), dtype=np.uint8)
+        for label in range(3):
+            rows = np.flatnonzero(y == label)
+            if rows.size:
+                tmp = np.empty((rows.size, width), dtype=np.uint8)
+                fill_class(tmp, label, size, noise_flip, drop_on, rng)
+                X[rows] = tmp
+        dt = (time.perf_counter() - t0) * batch_size / block
+        for i in range(0, block - batch_size + 1, batch_size):
+            yield X[i:i + batch_size], y[i:i + batch_size], dt
+
+def _put_until_stopped(q, item, stop) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+class _ProducerError:
+    """Queue item a failing producer leaves behind: the exception (if picklable) and its traceback."""
+
+    def __init__(self, exc: BaseException):
+        self.tb = traceback.format_exc()
+        try:
+            self.exc = pickle.loads(pickle.dumps(exc))
+        except Exception:
+            self.exc = None
+
+def _stream_worker(q, stop, seed, block, batch_size, size, noise_flip, drop_on) -> None:
+    """Thread / process producer loop: fill q until stop is set; a failure is queued as a _ProducerError."""
+    try:
+        for item in _stream_blocks(seed, block, batch_size, size, noise_flip, drop_on):
+            if not _put_until_stopped(q, item, stop):
+                break
+    except Exception as e:
+        _put_until_stopped(q, _ProducerError(e), stop)
+
+class StreamingBatches:
+    """
+    Endless iterator of fresh (X_packed (B, 450) uint8, y (B,) int64) mini-batches.
+
+    `workers` background producers (threads, or processes with mode="process")
+    each own a child of SeedSequence(seed) and feed a queue bounded at `prefetch`
+    batches, so memory stays constant no matter how long training runs. With
+    more than one worker the interleaving (not the content) of batches depends
+    on scheduling.
+
+    stats() reports producer and consumer throughput separately.
+
+    next() starts the producers if needed. A producer that raises is reported
+    by raising RuntimeError (chained to its exception) from next(); one that
+    dies without a report (killed, OOM) is noticed within STREAM_POLL_S.
+    Either way the stream is closed.
+    """
+
+    def __init__(self, batch_size: int, size=60, noise_flip=0.01, drop_on=0.02,
+                 seed=None, workers: int = 1, mode: str = "thread",
+                 prefetch: int = 16, block: int | None = None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"mode must be 'thread' or 'process', got {mode!r}")
+        self.batch_size = batch_size
+        self.mode = mode
+        self.workers = max(1, workers)
+        self._args = (max(batch_size, block or 8 * batch_size) // batch_size * batch_size,
+                      batch_size, size, noise_flip, drop_on)
+        ss = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self._seeds = ss.spawn(self.workers)
+        if mode == "process":
+            self._q = mp.Queue(maxsize=prefetch)
+            self._stop = mp.Event()
+        else:
+            self._q = queue.Queue(maxsize=prefetch)
+            self._stop = threading.Event()
+        self._procs = []
+        self._t_start = None
+        self.produce_s = 0.0
+        self.consumed = 0
+        self.wait_s = 0.0
+
+    def start(self):
+        if self._procs:
+            return self
+        for seed in self._seeds:
+            worker_args = (self._q, self._stop, seed) + self._args
+            if self.mode == "process":
+                p = mp.Process(target=_stream_worker, args=worker_args, daemon=True)
+            else:
+                p = threading.Thread(target=_stream_worker, args=worker_args, daemon=True)
+            p.start()
+            self._procs.append(p)
+        self._t_start = time.perf_counter()
+        return self
+
+    def __iter__(self):
+        return self.start()
+
+    def __next__(self):
+        if self._stop.is_set():
+            raise RuntimeError("StreamingBatches is closed")
+        self.start()
+        t0 = time.perf_counter()
+        while True:
+            try:
+                item = self._q.get(timeout=STREAM_POLL_S)
+                break
+            except queue.Empty:
+                self._check_producers()
+        self.wait_s += time.perf_counter() - t0
+        if isinstance(item, _ProducerError):
+            self.close()
+            raise RuntimeError(f"StreamingBatches producer failed:\n{item.tb}") from item.exc
+        X, y, gen_s = item
+        self.produce_s += gen_s
+        self.consumed += y.shape[0]
+        return X, y
+
+    def _check_producers(self) -> None:
+        dead = [p for p in self._procs if not p.is_alive()]
+        if dead:
+            how = ", ".join(f"exit code {p.exitcode}" for p in dead) if self.mode == "process" else "thread ended"
+            self.close()
+            raise RuntimeError(f"StreamingBatches: {len(dead)} of {self.workers} producer(s) died "
+                               f"without reporting an error ({how})")
+
+    def stats(self) -> dict:
+        """
+        producer_sps: samples/s of one producer while generating (x workers = capacity)
+        consumer_sps: samples/s the consumer processed, excluding time blocked on the queue
+        """
+        wall = time.perf_counter() - self._t_start if self._t_start else 0.0
+        per_worker = self.consumed / self.produce_s if self.produce_s > 0 else 0.0
+        busy = wall - self.wait_s
+        return {
+            "workers": self.workers,
+            "producer_sps": per_worker,
+            "producer_capacity_sps": per_worker * self.workers,
+            "consumer_sps": self.consumed / busy if busy > 0 else 0.0,
+            "consumed": self.consumed,
+            "wait_s": self.wait_s,
+            "wall_s": wall,
+        }
+
+    def reset_stats(self) -> None:
+        self.consumed = 0
+        self.produce_s = self.wait_s = 0.0
+        self._t_start = time.perf_counter()
+
+    def close(self) -> None:
+        self._stop.set()
+        # drain so blocked producers can see the stop flag
+        try:
+            while True:
+                self._q.get_nowait()
+        except queue.Empty:
+            pass
+        for p in self._procs:
+            p.join(timeout=5)
+        if self.mode == "process":
+            self._q.cancel_join_thread()
+        self._procs = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# -----------------------------
+# Benchmark vs per-sample path
+# -----------------------------
+
+def _class_stats(X: np.ndarray, y: np.ndarray) -> list[str]:
+    lines = []
+    for label, name in enumerate(("circle", "square", "line")):
+        on = X[y == label].sum(axis=1)
+        lines.append(f"    {name:6s}  n={on.size:7d}  on_px mean={on.mean():7.1f}  std={on.std():6.1f}")
+    return lines
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark per-sample vs batched vs sharded dataset generation.")
+    ap.add_argument("--seed", type=int, default=123)
+    ap.add_argument("--n_per_class", type=int, default=2000)
+    ap.add_argument("--noise_flip", type=float, default=0.012)
+    ap.add_argument("--drop_on", type=float, default=0.02)
+    ap.add_argument("--chunk", type=int, default=DEFAULT_CHUNK)
+    ap.add_argument("--shards", type=int, default=DEFAULT_SHARDS)
+    ap.add_argument("--workers", type=int, default=0, help="sharded-path process count (0 = skip, -1 = all cores)")
+    ap.add_argument("--skip_reference", action="store_true", help="do not time the per-sample path")
+    args = ap.parse_args()
+
+    results = []
+    if not args.skip_reference:
+        from model import make_dataset  # imports torch; only needed for the comparison
+
+        t0 = time.perf_counter()
+        X, y = make_dataset(args.n_per_class, noise_flip=args.noise_flip, drop_on=args.drop_on,
+                            rng=np.random.default_rng(args.seed))
+        results.append(("per-sample", time.perf_counter() - t0, X, y))
+
+    t0 = time.perf_counter()
+    X, y = make_dataset_batched(args.n_per_class, noise_flip=args.noise_flip, drop_on=args.drop_on,
+                                rng=np.random.default_rng(args.seed), chunk=args.chunk)
+    results.append(("batched", time.perf_counter() - t0, X, y))
+
+    if args.workers:
+        workers = None if args.workers < 0 else args.workers
+        t0 = time.perf_counter()
+        X, y = make_dataset_sharded(args.n_per_class, noise_flip=args.noise_flip, drop_on=args.drop_on,
+                                    seed=args.seed, shards=args.shards, workers=workers, chunk=args.chunk)
+        results.append(("sharded", time.perf_counter() - t0, X, y))
+
+    n = 3 * args.n_per_class
+    for name, dt, X, y in results:
+        print(f"{name:10s}: {dt:8.3f} s  ({n / dt:10.0f} samples/s)")
+        for ln in _class_stats(X, y):
+            print(ln)
+    for name, dt, _, _ in results[1:]:
+        print(f"speedup {name} vs {results[0][0]}: {results[0][1] / dt:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
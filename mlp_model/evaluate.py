@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Streaming evaluation of the float model and the integer emulator.
+
+EvalStats accumulates, one chunk at a time:
+  * float / int accuracy and the float-vs-int argmax match
+  * per-class confusion matrices (true x predicted) for both
+  * logit-margin histograms (top-1 minus top-2 logit), in power-of-two bins:
+    the int margin in int32 logit units, the float margin in float logit
+    units, plus the int margin of the samples where float and int disagree
+Memory is O(classes^2 + bins) however many samples are streamed.
+
+Test sets are streamed as packed (n, 450) uint8 chunks + labels:
+  array_chunks     : in-memory or memory-mapped (np.load(mmap_mode="r")) arrays
+  generated_chunks : fresh datagen.make_dataset_batched blocks, never held whole
+
+evaluate() drives both models over a chunk iterator. The models are callables
+packed uint8 -> (n, classes) logits (numpy or CPU torch), so the same harness
+serves model.py (float MLP2 + int_infer_batch) and this script (IntMLP).
+
+Only deps: numpy, standard library
+
+Run directly to validate an export against generated samples in constant memory:
+  python evaluate.py --weights_dir export_mlp_int --samples 3000000
+  python evaluate.py --memh weights.memh --samples 3000000   # the image that gets flashed
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+import datagen
+
+CLASS_NAMES = ("circle", "square", "line")
+
+
+# -----------------------------
+# Accumulator
+# -----------------------------
+
+class MarginHistogram:
+    """
+    Counts of non-negative margins in power-of-two bins: bin 0 holds exact ties
+    (margin 0), bin i >= 1 holds margins in [2^(i-1+lo), 2^(i+lo)). Margins below
+    2^lo land in bin 1, above 2^hi in the last bin.
+    """
+
+    def __init__(self, lo: int, hi: int):
+        self.lo, self.hi = lo, hi
+        self.counts = np.zeros(hi - lo + 2, dtype=np.int64)
+
+    def update(self, margin: np.ndarray) -> None:
+        m = np.asarray(margin, dtype=np.float64)
+        _, e = np.frexp(m)                       # m = f * 2^e, 0.5 <= f < 1
+        idx = np.where(m > 0, np.clip(e - self.lo, 1, len(self.counts) - 1), 0)
+        self.counts += np.bincount(idx, minlength=len(self.counts))
+
+    def lines(self, fmt: str = "{:g}") -> list[str]:
+        n = max(1, int(self.counts.sum()))
+        out = []
+        for i, c in enumerate(self.counts):
+            if not c:
+                continue
+            if i == 0:
+                label = "tie (0)"
+            else:
+                a, b = 2.0 ** (i - 1 + self.lo), 2.0 ** (i + self.lo)
+                label = f"[{fmt.format(a)}, {fmt.format(b)})"
+                if i == 1:
+                    label = f"(0, {fmt.format(b)})"
+                elif i == len(self.counts) - 1:
+                    label = f">= {fmt.format(a)}"
+            out.append(f"{label:>22s} {int(c):12d}  {100 * c / n:7.3f}%")
+        return out
+
+
+def logit_margin(logits: np.ndarray) -> np.ndarray:
+    """Top-1 minus top-2 logit per row."""
+    top2 = np.partition(np.asarray(logits), -2, axis=1)[:, -2:]
+    return top2[:, 1].astype(np.float64) - top2[:, 0]
+
+
+class EvalStats:
+    """Incremental float/int accuracy, argmax match, confusion matrices and margin histograms."""
+
+    def __init__(self, classes: int = 3):
+        self.classes = classes
+        self.n = 0
+        self.conf_float = np.zeros((classes, classes), dtype=np.int64)
+        self.conf_int = np.zeros((classes, classes), dtype=np.int64)
+        self.match = 0
+        self.margin_float = MarginHistogram(-10, 10)
+        self.margin_int = MarginHistogram(0, 31)
+        self.margin_int_mismatch = MarginHistogram(0, 31)
+
+    def _confusion(self, y: np.ndarray, pred: np.ndarray) -> np.ndarray:
+        k = self.classes
+        return np.bincount(y * k + pred, minlength=k * k).reshape(k, k)
+
+    def update(self, y: np.ndarray, logits_float=None, logits_int=None) -> None:
+        y = np.asarray(y, dtype=np.int64)
+        self.n += len(y)
+        if logits_float is not None:
+            logits_float = np.asarray(logits_float)
+            pred_f = logits_float.argmax(axis=1)
+            self.conf_float += self._confusion(y, pred_f)
+            self.margin_float.update(logit_margin(logits_float))
+        if logits_int is not None:
+            logits_int = np.asarray(logits_int)
+            pred_i = logits_int.argmax(axis=1)
+            self.conf_int += self._confusion(y, pred_i)
+            margin_i = logit_margin(logits_int)
+            self.margin_int.update(margin_i)
+        if logits_float is not None and logits_int is not None:
+            same = pred_f == pred_i
+            self.match += int(same.sum())
+            self.margin_int_mismatch.update(margin_i[~same])
+
+    @property
+    def float_acc(self) -> float:
+        return float(np.trace(self.conf_float)) / max(1, self.n)
+
+    @property
+    def int_acc(self) -> float:
+        return float(np.trace(self.conf_int)) / max(1, self.n)
+
+    @property
+    def match_rate(self) -> float:
+        return self.match / max(1, self.n)
+
+    def summary(self) -> dict:
+        return {"n": self.n, "float_acc": self.float_acc, "int_acc": self.int_acc,
+                "match": self.match_rate, "conf_float": self.conf_float.tolist(),
+                "conf_int": self.conf_int.tolist(), "margin_float": self.margin_float.counts.tolist(),
+                "margin_int": self.margin_int.counts.tolist(),
+                "margin_int_mismatch": self.margin_int_mismatch.counts.tolist()}
+
+    def report_lines(self, names=CLASS_NAMES) -> list[str]:
+        """Human-readable block for report.txt / stdout (only the parts that were measured)."""
+        has_f, has_i = self.conf_float.any(), self.conf_int.any()
+        out = [f"Samples: {self.n}"]
+        if has_f:
+            out.append(f"  float accuracy: {self.float_acc*100:.3f}%")
+        if has_i:
+            out.append(f"  int emu accuracy: {self.int_acc*100:.3f}%")
+        if has_f and has_i:
+            out.append(f"  argmax match (float vs int emu): {self.match_rate*100:.3f}%  "
+                       f"({self.n - self.match} mismatches)")
+        for name, conf, hist, fmt in (("float", self.conf_float, self.margin_float, "{:g}"),
+                                      ("int emu", self.conf_int, self.margin_int, "{:.0f}")):
+            if not conf.any():
+                continue
+            out.append(f"Confusion matrix, {name} (rows = true, cols = predicted):")
+            out.append("  " + " " * 8 + "".join(f"{n:>10s}" for n in names))
+            for n, row in zip(names, conf):
+                out.append(f"  {n:>8s}" + "".join(f"{v:10d}" for v in row))
+            out.append(f"Logit margin (top1 - top2), {name}:")
+            out.extend("  " + s for s in hist.lines(fmt))
+        if has_f and has_i and self.match < self.n:
+            out.append("Logit margin of the int emu on float/int mismatches:")
+            out.extend("  " + s for s in self.margin_int_mismatch.lines("{:.0f}"))
+        return out
+
+
+# -----------------------------
+# Chunk sources
+# -----------------------------
+
+def array_chunks(X: np.ndarray, y: np.ndarray, chunk: int = 65536):
+    """(X, y) slices of at most chunk rows; memory-mapped arrays are only read one chunk at a time."""
+    for i in range(0, len(y), chunk):
+        yield np.ascontiguousarray(X[i:i + chunk]), np.asarray(y[i:i + chunk])
+
+def generated_chunks(n: int, chunk: int = 65536, seed: int = 0, noise_flip: float = 0.01,
+                     drop_on: float = 0.02):
+    """n freshly generated packed samples (balanced per chunk), chunk rows at a time."""
+    per_chunk = max(1, chunk // 3)
+    blocks = -(-n // (3 * per_chunk))
+    left = n
+    for ss in np.random.SeedSequence(seed).spawn(blocks):
+        X, y = datagen.make_dataset_batched(per_chunk, noise_flip=noise_flip, drop_on=drop_on,
+                                            rng=np.random.default_rng(ss), packed=True)
+        yield X[:left], y[:left]
+        left -= len(y)
+
+
+def evaluate(chunks, float_fn=None, int_fn=None, classes: int = 3) -> EvalStats:
+    """Run float_fn / int_fn (packed uint8 -> logits) over every (X, y) chunk."""
+    stats = EvalStats(classes)
+    for X, y in chunks:
+        stats.update(y,
+                     None if float_fn is None else float_fn(X),
+                     None if int_fn is None else int_fn(X))
+    return stats
+
+
+# -----------------------------
+# Main
+# -----------------------------
+
+def main():
+    from int_engine import IntMLP, MappedIntMLP, MemhImage, load_txt_weights
+
+    ap = argparse.ArgumentParser(description="Streaming int-emulator evaluation of an export.")
+    ap.add_argument("--weights_dir", type=str, default=str(Path(__file__).resolve().parent))
+    ap.add_argument("--memh", type=str, default="",
+                    help="run off this memory-mapped weights.memh / .bin instead (SHIFT from --weights_dir)")
+    ap.add_argument("--samples", type=int, default=1_000_000, help="generated samples (ignored with --data)")
+    ap.add_argument("--data", type=str, default="",
+                    help="evaluate X.npy/y.npy-style pair 'X_PATH,Y_PATH' (memory-mapped) instead")
+    ap.add_argument("--chunk", type=int, default=65536)
+    ap.add_argument("--seed", type=int, default=2024)
+    ap.add_argument("--noise_flip", type=float, default=0.012)
+    ap.add_argument("--drop_on", type=float, default=0.02)
+    args = ap.parse_args()
+
+    if args.memh:
+        eng = MappedIntMLP(MemhImage(args.memh), load_txt_weights(args.weights_dir)[4])
+    else:
+        eng = IntMLP(*load_txt_weights(args.weights_dir))
+    if args.data:
+        x_path, y_path = args.data.split(",")
+        chunks = array_chunks(np.load(x_path, mmap_mode="r"), np.load(y_path, mmap_mode="r"), args.chunk)
+    else:
+        chunks = generated_chunks(args.samples, args.chunk, args.seed, args.noise_flip, args.drop_on)
+
+    t0 = time.perf_counter()
+    stats = evaluate(chunks, int_fn=lambda X: eng.infer_packed(X, "gemm")[0])
+    dt = time.perf_counter() - t0
+    print("\n".join(stats.report_lines()))
+    print(f"{stats.n} samples in {dt:.1f}s ({stats.n / dt:.0f} samples/s, chunk {args.chunk})")
+
+
+if __name__ == "__main__":
+    main()
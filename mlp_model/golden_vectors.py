@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Golden test vectors for the CPU + DPU + tensor-controller testbenches.
+
+N generated images (datagen.make_dataset_batched, the batched drop-in for
+model.make_dataset) are grouped into batches of 4, one per screen quadrant,
+and written in the formats the hardware sees them:
+
+  DPU wire format (src/dpu.sv SEND, read by the CPU at MMIO 0x4):
+    each 60x60 image is the 240x240 quadrant in 4x4 blocks, raster order
+    (left to right, then down); quadrants 1..4 = top-left, top-right,
+    bottom-left, bottom-right. 30 pixels per bus word, pixel 30*w + j at bit j,
+    bit 30 = valid, bit 31 = last word of the batch. 120 words per image.
+  dcache layout (what assembly/int_everything.asm's tensor feed loop reads):
+    image q at byte address 12 + 452*q, 113 words each: pixel 32*k + j at
+    word k bit j, the last word holding the remaining 16 pixels.
+  data.memh: the 1024-word data memory image (src/mshr.sv) of the first batch;
+    mmio.sv hands the dcache addr - 12, so CPU byte 12 + 4*i is word i.
+
+Expected results come from int_engine.IntMLP (bit-exact with
+model.int_infer_batch) on the same weights, plus the shape word the tensor
+controller returns (bit 31 valid, image i one-hot at bits 3i+2..3i,
+100 = circle) and the one the current RTL is expected to return
+(tc_model.rtl_infer_batch, which reproduces its layer-2 wiring).
+
+Note: int_everything.asm's DPU receive loop does not reset its bit buffer
+between quadrants, so today it stores quadrants 2..4 shifted against this
+layout; the vectors follow the layout the feed loop reads.
+
+Output (--out_dir):
+  dpu_bus.memh        480 words per batch
+  dcache_pixels.memh  452 words per batch (4 x 113, CPU byte 12 onwards)
+  data.memh           data memory image of batch 0
+  expected_shape.memh shape word per batch from the int emulator
+  rtl_shape.memh      shape word per batch from the current RTL's layer 2
+  expected.txt        per image: batch quadrant label class logits rtl_class
+
+Only deps: numpy, standard library
+
+  python golden_vectors.py --n 4000 --out_dir golden
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+import datagen
+from weight_to_memh import write_memh
+
+BASE_DIR = Path(__file__).resolve().parent
+
+ROW_DIM = 4                       # images per batch (screen quadrants / array columns)
+IMG_SIZE = 60
+N_PIX = IMG_SIZE * IMG_SIZE       # 3600
+BUS_PIXELS = 30
+BUS_WORDS = N_PIX // BUS_PIXELS   # 120 DPU words per image
+DCACHE_WORDS = -(-N_PIX // 32)    # 113 words per image
+DCACHE_BASE = 12                  # byte address of image 0
+DATA_DEPTH = 1024                 # data.memh words
+VALID_BIT = 1 << 30
+LAST_BIT = 1 << 31
+
+
+# -----------------------------
+# Formats
+# -----------------------------
+
+def _pack_lsb_first(bits: np.ndarray, width: int) -> np.ndarray:
+    """(..., n*width) 0/1 -> (..., n) uint32 words, element j of a group at bit j."""
+    g = bits.reshape(bits.shape[:-1] + (-1, width)).astype(np.uint64)
+    return (g << np.arange(width, dtype=np.uint64)).sum(axis=-1, dtype=np.uint64).astype(np.uint32)
+
+def dpu_bus_words(bits: np.ndarray) -> np.ndarray:
+    """(B, 4, 3600) 0/1 pixels -> (B, 480) DPU bus words (valid bit set, last bit on the final word)."""
+    words = _pack_lsb_first(bits, BUS_PIXELS).reshape(bits.shape[0], -1) | np.uint32(VALID_BIT)
+    words[:, -1] |= np.uint32(LAST_BIT)
+    return words
+
+def dcache_words(bits: np.ndarray) -> np.ndarray:
+    """(B, 4, 3600) 0/1 pixels -> (B, 4, 113) dcache words (last word zero-padded above 16 pixels)."""
+    pad = np.zeros(bits.shape[:-1] + (DCACHE_WORDS * 32 - N_PIX,), dtype=bits.dtype)
+    return _pack_lsb_first(np.concatenate([bits, pad], axis=-1), 32)
+
+def data_memory(dcache: np.ndarray, depth: int = DATA_DEPTH) -> np.ndarray:
+    """(4, 113) dcache words of one batch -> data.memh words (image 0 at CPU byte DCACHE_BASE = word 0)."""
+    mem = np.zeros(depth, dtype=np.uint32)
+    mem[:dcache.size] = dcache.reshape(-1)
+    return mem
+
+def tc_feed_words(dcache: np.ndarray) -> np.ndarray:
+    """
+    (4, 113) dcache words -> the 450 pixel words int_everything.asm sends to the
+    tensor controller: byte k of every image's word, image q in byte q.
+    """
+    b = dcache.astype("<u4").view(np.uint8).reshape(ROW_DIM, -1)[:, :N_PIX // 8]   # (4, 450)
+    return (b.astype(np.uint32) << (8 * np.arange(ROW_DIM, dtype=np.uint32))[:, None]).sum(
+        axis=0, dtype=np.uint32)
+
+def shape_words(pred: np.ndarray, classes: int = 3) -> np.ndarray:
+    """(B, 4) class indices -> tensor-controller shape words."""
+    onehot = np.uint32(1) << (classes - 1 - pred).astype(np.uint32)
+    pos = (classes * np.arange(pred.shape[1], dtype=np.uint32))
+    return (onehot << pos).sum(axis=1, dtype=np.uint32) | np.uint32(LAST_BIT)
+
+
+# -----------------------------
+# Main
+# -----------------------------
+
+def main():
+    import tc_model
+    from int_engine import IntMLP, load_txt_weights
+
+    ap = argparse.ArgumentParser(description="DPU/dcache golden vectors with expected logits and shapes.")
+    ap.add_argument("--n", type=int, default=4000, help="images (rounded up to a multiple of 4)")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--noise_flip", type=float, default=0.012)
+    ap.add_argument("--drop_on", type=float, default=0.02)
+    ap.add_argument("--weights_dir", type=str, default=str(BASE_DIR), help="text export (W1_int8.txt, ...)")
+    ap.add_argument("--out_dir", type=str, default="golden_vectors")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    n_batches = -(-args.n // ROW_DIM)
+    n = n_batches * ROW_DIM
+    P, y = datagen.make_dataset_batched(-(-n // 3), noise_flip=args.noise_flip, drop_on=args.drop_on,
+                                        rng=np.random.default_rng(args.seed), packed=True)
+    P, y = P[:n], y[:n]
+    bits = datagen.unpack_images(P).reshape(n_batches, ROW_DIM, N_PIX)
+
+    w1, b1, w2, b2, shift = load_txt_weights(args.weights_dir)
+    logits, pred = IntMLP(w1, b1, w2, b2, shift).infer_packed(P)
+    if isinstance(shift, np.ndarray):
+        rtl_pred = np.full(n, -1)  # the RTL has one SHIFT register
+        print("per-row SHIFT export: no RTL shape words (rtl_class = -1)")
+    else:
+        _, rtl_pred = tc_model.rtl_infer_batch(bits.reshape(n, N_PIX), w1, b1, w2, b2, shift, ROW_DIM)
+
+    bus = dpu_bus_words(bits)
+    dcache = dcache_words(bits)
+    for b in range(min(n_batches, 8)):  # the two layouts carry the same pixels to the array
+        assert tc_feed_words(dcache[b]).tolist() == tc_model.pixel_words(bits[b], ROW_DIM)
+
+    out = Path(args.out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    write_memh(out / "dpu_bus.memh", bus.reshape(-1))
+    write_memh(out / "dcache_pixels.memh", dcache.reshape(-1))
+    write_memh(out / "data.memh", data_memory(dcache[0]))
+    write_memh(out / "expected_shape.memh", shape_words(pred.reshape(n_batches, ROW_DIM)))
+    rtl_shapes = shape_words(np.maximum(rtl_pred, 0).reshape(n_batches, ROW_DIM))
+    write_memh(out / "rtl_shape.memh", rtl_shapes)
+    lines = [f"# {n} images, {n_batches} batches; weights {Path(args.weights_dir).resolve()}, SHIFT "
+             f"{'per-row' if isinstance(shift, np.ndarray) else shift}",
+             "# batch quadrant label class logit0 logit1 logit2 rtl_class"]
+    lines += [f"{i // ROW_DIM} {i % ROW_DIM + 1} {y[i]} {pred[i]} {logits[i, 0]} {logits[i, 1]} {logits[i, 2]} "
+              f"{rtl_pred[i]}" for i in range(n)]
+    (out / "expected.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    acc = (pred == y).mean()
+    rtl_diff = int((rtl_pred != pred).sum())
+    print(f"{n} images / {n_batches} batches -> {out.resolve()} in {time.perf_counter() - t0:.2f}s")
+    print(f"  dpu_bus.memh {bus.size} words, dcache_pixels.memh {dcache.size} words, data.memh {DATA_DEPTH} words")
+    print(f"  int emulator accuracy {acc*100:.2f}%; current RTL class differs on {rtl_diff} images")
+
+
+if __name__ == "__main__":
+    main()
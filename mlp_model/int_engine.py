@@ -0,0 +1,635 @@
+#!/usr/bin/env python3
+"""
+Fast integer-only inference for the 2-layer MLP (NumPy, no torch).
+
+Bit-exact with model.int_infer_batch:
+  a1  = relu(x @ W1^T + b1)                  int32
+  a1q = clamp(((a1 + (1<<(SHIFT-1))) >> SHIFT), 0..127)   (SHIFT may be per row)
+  z2  = a1q @ W2^T + b2                      int32
+  pred = argmax(z2)  (first max wins)
+
+Inputs are binary, so layer 1 is just a sum of W1 columns at the "on" pixels.
+Two kernels exploit that:
+  * gather : collect the int8 W1 columns of the on-pixels (index lists, or
+             nonzeros of bit-packed rows) and accumulate them in int32.
+             Used for index-list inputs; wins when images are very sparse.
+  * gemm   : unpack a chunk of packed rows to 0/1 float32 and use one BLAS
+             sgemm. Exact, because every partial sum is an integer bounded by
+             in_dim * 128 < 2**24 (float32 has a 24-bit mantissa).
+             Fastest on the noisy training distribution (~12% of pixels on)
+             at every batch size, so it is the default for packed input.
+Input columns whose W1 column is zero for every hidden unit (pruned border
+pixels) are dropped from both kernels.
+
+Only deps: numpy, standard library
+
+Run directly to check bit-exactness of every model.INT_BACKENDS backend against
+the reference int_infer_batch and report latency/throughput per backend:
+  python int_engine.py --sizes 1 64 1024 16384 100000
+With --sparse_memh it instead checks a weight_to_memh.py --sparse image against
+the text export and reports the projected memory and cycle savings; with
+--mapped it memory-maps weights.memh / .bin (MemhImage: zero-copy int8 views of
+the packed word layout) and checks inference run straight off it (MappedIntMLP);
+with --cold_start it times import + open_engine + one image in fresh
+interpreters (the torch-free path; torch must stay unimported).
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+DEFAULT_CHUNK = 4096
+W1_BLOCK = 256        # mapped W1 columns converted to float32 at a time (MappedIntMLP gemm)
+
+
+def requant_relu_np(a_int32: np.ndarray, shift) -> np.ndarray:
+    """
+    NumPy twin of model.requant_relu_int32_to_int8 (same rounding, clamp, int8 result).
+    shift: int, or (H,) per-row shifts broadcast over the last axis.
+    """
+    if np.ndim(shift):
+        sh = np.asarray(shift, dtype=np.int32)
+        if (sh < 0).any():
+            raise ValueError("shift must be >= 0")
+        rnd = np.where(sh > 0, np.left_shift(1, np.maximum(sh - 1, 0)), 0).astype(np.int32)
+        return np.clip((a_int32 + rnd) >> sh, 0, 127).astype(np.int8)
+    if shift < 0:
+        raise ValueError("shift must be >= 0")
+    if shift == 0:
+        y = a_int32
+    else:
+        y = (a_int32 + np.int32(1 << (shift - 1))) >> shift
+    return np.clip(y, 0, 127).astype(np.int8)
+
+
+class IntMLP:
+    """
+    Integer 2-layer MLP emulator with precomputed weight layouts.
+    w1_q: (H, P) int8, b1_q: (H,) int32, w2_q: (C, H) int8, b2_q: (C,) int32.
+    Accepts numpy arrays or CPU torch tensors. w2_q/b2_q may be None for a
+    layer-1-only engine (e.g. calibration). shift is an int or (H,) per-row shifts.
+    """
+
+    def __init__(self, w1_q, b1_q, w2_q=None, b2_q=None, shift=0):
+        self.w1 = np.asarray(w1_q, dtype=np.int8)
+        self.b1 = np.asarray(b1_q, dtype=np.int32)
+        self.shift = np.asarray(shift, dtype=np.int32) if np.ndim(shift) else int(shift)
+        self.hidden, self.in_dim = self.w1.shape
+        if self.in_dim * 128 >= 2 ** 24 or self.hidden * 127 * 128 >= 2 ** 24:
+            raise ValueError("layer too wide for exact float32 accumulation")
+
+        # (P, H) so one on-pixel is one contiguous row
+        self.w1t_i8 = np.ascontiguousarray(self.w1.T)
+        # the gemm only needs the columns some hidden unit still uses
+        self.active = np.flatnonzero(self.w1.any(axis=0))
+        if len(self.active) == self.in_dim:
+            self.active = None
+            self.w1t_f32 = self.w1t_i8.astype(np.float32)
+        else:
+            self.w1t_f32 = self.w1t_i8[self.active].astype(np.float32)
+        if w2_q is not None:
+            self.w2 = np.asarray(w2_q, dtype=np.int8)
+            self.b2 = np.asarray(b2_q, dtype=np.int32)
+            self.w2t_f32 = np.ascontiguousarray(self.w2.T.astype(np.float32))
+
+    # -------- layer 1 kernels (return int32 accumulators incl. bias, before ReLU) --------
+
+    def layer1_gather(self, indices: list) -> np.ndarray:
+        """indices: sequence of N int arrays with the on-pixel positions of each image."""
+        n = len(indices)
+        out = np.empty((n, self.hidden), dtype=np.int32)
+        for i, idx in enumerate(indices):
+            out[i] = self.w1t_i8[idx].sum(axis=0, dtype=np.int32)  # pruned columns add zero rows
+        out += self.b1
+        return out
+
+    def layer1_gemm_bits(self, x_bits: np.ndarray) -> np.ndarray:
+        """x_bits: (N, P) 0/1 of any dtype."""
+        if self.active is not None:
+            x_bits = x_bits[:, self.active]
+        acc = x_bits.astype(np.float32, copy=False) @ self.w1t_f32
+        return acc.astype(np.int32) + self.b1
+
+    def layer1(self, x: np.ndarray, method: str = "gemm") -> np.ndarray:
+        """Layer-1 accumulators for packed (N, ceil(P/8)) uint8 rows or (N, P) 0/1 rows."""
+        if x.dtype == np.uint8 and x.shape[1] != self.in_dim:
+            return self.layer1_packed(x, method)
+        out = np.empty((x.shape[0], self.hidden), dtype=np.int32)
+        for i in range(0, x.shape[0], DEFAULT_CHUNK):
+            out[i:i + DEFAULT_CHUNK] = self.layer1_gemm_bits(x[i:i + DEFAULT_CHUNK])
+        return out
+
+    def layer1_packed(self, x_packed: np.ndarray, method: str = "gemm",
+                      chunk: int = DEFAULT_CHUNK) -> np.ndarray:
+        """x_packed: (N, ceil(P/8)) uint8 rows in np.packbits order. method: "gemm" or "gather"."""
+        n = x_packed.shape[0]
+        if method == "gather":
+            bits = np.unpackbits(x_packed, axis=1, count=self.in_dim)
+            return self.layer1_gather([np.flatnonzero(r) for r in bits])
+        if method != "gemm":
+            raise ValueError(f"unknown layer-1 method {method!r}")
+        out = np.empty((n, self.hidden), dtype=np.int32)
+        for i in range(0, n, chunk):
+            bits = np.unpackbits(x_packed[i:i + chunk], axis=1, count=self.in_dim)
+            out[i:i + chunk] = self.layer1_gemm_bits(bits)
+        return out
+
+    # -------- rest of the network --------
+
+    def head(self, a1_i32: np.ndarray):
+        """ReLU + requant + layer 2 from layer-1 accumulators. Returns (logits int32, pred int64)."""
+        a1_q = requant_relu_np(np.maximum(a1_i32, 0), self.shift)
+        logits = (a1_q.astype(np.float32) @ self.w2t_f32).astype(np.int32) + self.b2
+        return logits, np.argmax(logits, axis=1)
+
+    def infer_packed(self, x_packed: np.ndarray, method: str = "gemm"):
+        return self.head(self.layer1_packed(x_packed, method))
+
+    def infer(self, x: np.ndarray, method: str = "gemm"):
+        """x: packed (N, ceil(P/8)) uint8 rows or (N, P) 0/1 rows (e.g. what model.int_infer_batch takes)."""
+        return self.head(self.layer1(x, method))
+
+    def infer_indices(self, indices: list):
+        return self.head(self.layer1_gather(indices))
+
+
+# -----------------------------
+# Weight loading
+# -----------------------------
+
+def load_txt_weights(base_dir=BASE_DIR):
+    """
+    (w1, b1, w2, b2, shift) from the W1_int8.txt / ... / SHIFT.txt export;
+    shift is an int, or an int32 array when SHIFT.txt has one shift per row.
+    """
+    base_dir = Path(base_dir)
+    w1 = np.loadtxt(base_dir / "W1_int8.txt", dtype=np.int64).astype(np.int8)
+    b1 = np.loadtxt(base_dir / "b1_int32.txt", dtype=np.int64).reshape(-1).astype(np.int32)
+    w2 = np.loadtxt(base_dir / "W2_int8.txt", dtype=np.int64).astype(np.int8)
+    b2 = np.loadtxt(base_dir / "b2_int32.txt", dtype=np.int64).reshape(-1).astype(np.int32)
+    return w1, b1, w2, b2, read_shift_txt(base_dir / "SHIFT.txt")
+
+def read_shift_txt(path):
+    """SHIFT.txt -> int, or an int32 array of per-row shifts."""
+    shift = np.array(Path(path).read_text(encoding="utf-8").split(), dtype=np.int32)
+    return int(shift[0]) if len(shift) == 1 else shift
+
+
+def _parse_memh(data: bytes) -> np.ndarray:
+    """$readmemh text -> uint32 words; one bytes.fromhex pass when every word has 8 digits."""
+    toks = data.split()
+    joined = b"".join(toks)
+    if len(joined) == 8 * len(toks):
+        try:
+            return np.frombuffer(bytes.fromhex(joined.decode("ascii")), dtype=">u4").astype(np.uint32)
+        except ValueError:
+            pass
+    return np.array([int(t, 16) for t in toks], dtype=np.uint32)
+
+def _read_memh(path) -> np.ndarray:
+    return _parse_memh(Path(path).read_bytes())
+
+def map_words(path, cache: bool = True) -> np.ndarray:
+    """
+    uint32 words of a weights image without copying them: a .bin is memory-mapped;
+    a .memh is hex-parsed once into the sibling .bin (what weight_to_memh.py --bin
+    writes, reused while it is not older than the .memh) and that is mapped.
+    Falls back to the parsed array when the cache cannot be written.
+    """
+    path = Path(path)
+    if path.suffix == ".bin":
+        return np.asarray(np.memmap(path, dtype="<u4", mode="r"))
+    if cache:
+        bin_path = path.with_suffix(".bin")
+        try:
+            if not bin_path.exists() or bin_path.stat().st_mtime < path.stat().st_mtime:
+                tmp = bin_path.with_name(f"{bin_path.name}.{os.getpid()}.tmp")
+                _read_memh(path).astype("<u4").tofile(tmp)
+                os.replace(tmp, bin_path)
+            return np.asarray(np.memmap(bin_path, dtype="<u4", mode="r"))
+        except OSError:
+            pass
+    return _read_memh(path)
+
+def unpack_w1_words(words: np.ndarray, w1_bits: int = 8, row_dim: int = 4) -> np.ndarray:
+    """(G, n) uint32 W1 words in weight_to_memh layout -> (G*row_dim, n*8/w1_bits) int8."""
+    G, n = words.shape
+    rows = words.astype("<u4").view(np.uint8).reshape(G, n, row_dim).transpose(0, 2, 1)  # (G, R, n)
+    if w1_bits == 8:
+        return np.ascontiguousarray(rows.view(np.int8)).reshape(G * row_dim, n)
+    per = 8 // w1_bits
+    f = (rows[..., None] >> (w1_bits * np.arange(per, dtype=np.uint8))) & ((1 << w1_bits) - 1)
+    f = f.astype(np.int8) - ((f >> (w1_bits - 1)) << w1_bits).astype(np.int8)   # sign-extend
+    return f.reshape(G * row_dim, n * per)
+
+def load_memh(path, w1_bits: int = 8, row_dim: int = 4, hidden: int = 64, in_dim: int = 3600,
+              classes: int = 3):
+    """
+    (w1, b1, w2, b2, shifts) from a dense weights.memh (w1_bits=8) or a packed
+    weights_int4.memh / weights_ternary.memh (4 / 2); shifts is the per-row table
+    or None.
+    """
+    words = _read_memh(path)
+    n_w1 = hidden // row_dim * in_dim * w1_bits // 8
+    n_tail = len(words) - n_w1
+    if n_tail not in (2 * hidden + classes, 3 * hidden + classes):
+        raise ValueError(f"{path}: expected {n_w1 + 2 * hidden + classes} words for {w1_bits}-bit W1 "
+                         f"(+{hidden} with a shift table), found {len(words)}")
+    w1 = unpack_w1_words(words[:n_w1].reshape(hidden // row_dim, -1), w1_bits, row_dim)
+    return (w1,) + _unpack_tail(words[n_w1:], row_dim, hidden, classes)
+
+def _unpack_tail(tail: np.ndarray, row_dim: int, hidden: int, classes: int):
+    """b1, W2, b2, shift table (or None) from the words after W1."""
+    b1 = tail[:hidden].view(np.int32).copy()
+    w2 = np.ascontiguousarray(tail[hidden:2 * hidden].astype("<u4").view(np.int8)
+                              .reshape(hidden, row_dim)[:, :classes].T)
+    b2 = tail[2 * hidden:2 * hidden + classes].view(np.int32).copy()
+    shifts = tail[2 * hidden + classes:].astype(np.int32) if len(tail) > 2 * hidden + classes else None
+    return b1, w2, b2, shifts
+
+def load_sparse_memh(path, row_dim: int = 4, hidden: int = 64, in_dim: int = 3600, classes: int = 3):
+    """
+    (w1, b1, w2, b2, keep, shifts) from a weight_to_memh.py --sparse image; w1 is
+    dense again (skipped words are zero), keep is the (hidden/row_dim, in_dim) bool
+    column bitmap and shifts the per-row shift table (None if the image has none).
+    """
+    words = _read_memh(path)
+    G, n_bm = hidden // row_dim, -(-in_dim // 32)
+    header = G * n_bm + G + 1
+    if len(words) < header:
+        raise ValueError(f"{path}: too short for a sparse image ({len(words)} words)")
+    bitmap = words[:G * n_bm].reshape(G, n_bm)
+    bases = words[G * n_bm:header].astype(np.int64)
+    keep = np.unpackbits(bitmap.astype("<u4").view(np.uint8), bitorder="little").reshape(G, -1)[:, :in_dim]
+    keep = keep.astype(bool)
+    if bases[0] != header or np.any(np.diff(bases) != keep.sum(axis=1)):
+        raise ValueError(f"{path}: group bases do not match the column bitmaps")
+    n_tail = len(words) - bases[-1]
+    if n_tail not in (2 * hidden + classes, 3 * hidden + classes):
+        raise ValueError(f"{path}: expected {bases[-1] + 2 * hidden + classes} words "
+                         f"(+{hidden} with a shift table), found {len(words)}")
+
+    packed = np.zeros((G, in_dim), dtype=np.uint32)
+    packed[keep] = words[header:bases[-1]]  # group-major, ascending column
+    w1 = unpack_w1_words(packed, 8, row_dim)
+    b1, w2, b2, shifts = _unpack_tail(words[bases[-1]:], row_dim, hidden, classes)
+    return w1, b1, w2, b2, keep, shifts
+
+
+class MemhImage:
+    """
+    Zero-copy views of a dense weights.memh / weights.bin (weight_to_memh.py layout):
+      words     (N,) uint32, memory-mapped (map_words)
+      w1_groups (G, R, P) int8: w1_groups[g, k] is W1 row g*R + k (byte k of the group's words)
+      w1_cols   (P, G, R) int8: w1_cols[c] is W1 column c as a G x R block
+      b1 (H,) int32, w2 (C, H) int8, b2 (C,) int32, shifts (H,) int32 or None
+    Every attribute is a strided view of `words`. W1 has no 2-D (H, P) view (the
+    rows of a group are interleaved byte by byte); w1() materializes one.
+    """
+
+    def __init__(self, path, row_dim: int = 4, hidden: int = 64, in_dim: int = 3600, classes: int = 3,
+                 cache: bool = True):
+        self.path = Path(path)
+        self.words = map_words(path, cache)
+        self.row_dim, self.hidden, self.in_dim, self.classes = row_dim, hidden, in_dim, classes
+        G, n_w1 = hidden // row_dim, hidden // row_dim * in_dim
+        n_tail = len(self.words) - n_w1
+        if n_tail not in (2 * hidden + classes, 3 * hidden + classes):
+            raise ValueError(f"{path}: expected {n_w1 + 2 * hidden + classes} words for an int8 W1 "
+                             f"(+{hidden} with a shift table), found {len(self.words)}")
+        w1_bytes = self.words[:n_w1].view(np.int8).reshape(G, in_dim, row_dim)
+        self.w1_groups = w1_bytes.transpose(0, 2, 1)
+        self.w1_cols = w1_bytes.transpose(1, 0, 2)
+        tail = self.words[n_w1:]
+        self.b1 = tail[:hidden].view(np.int32)
+        self.w2 = tail[hidden:2 * hidden].view(np.int8).reshape(hidden, row_dim)[:, :classes].T
+        self.b2 = tail[2 * hidden:2 * hidden + classes].view(np.int32)
+        self.shifts = tail[2 * hidden + classes:].view(np.int32) if n_tail > 2 * hidden + classes else None
+
+    def w1(self) -> np.ndarray:
+        """(H, P) int8 copy of W1."""
+        return self.w1_groups.reshape(self.hidden, self.in_dim)
+
+    def views(self) -> dict:
+        return {"w1_groups": self.w1_groups, "w1_cols": self.w1_cols, "b1": self.b1, "w2": self.w2,
+                "b2": self.b2} | ({} if self.shifts is None else {"shifts": self.shifts})
+
+
+class MappedIntMLP(IntMLP):
+    """
+    IntMLP running straight off a MemhImage; no copy of the weight set is kept.
+    gather sums mapped W1 columns in int32; gemm converts W1_BLOCK mapped
+    columns at a time to float32 inside the matmul (a transient block, not a
+    float32 W1). shift is needed when the image carries no shift table.
+    """
+
+    def __init__(self, image: MemhImage, shift=None):
+        shift = image.shifts if image.shifts is not None else shift
+        if shift is None:
+            raise ValueError(f"{image.path} has no shift table: pass shift")
+        self.image = image
+        self.shift = np.asarray(shift, dtype=np.int32) if np.ndim(shift) else int(shift)
+        self.hidden, self.in_dim = image.hidden, image.in_dim
+        if self.in_dim * 128 >= 2 ** 24 or self.hidden * 127 * 128 >= 2 ** 24:
+            raise ValueError("layer too wide for exact float32 accumulation")
+        self.active = None
+        self.b1, self.w2, self.b2 = image.b1, image.w2, image.b2
+        self.w2t_f32 = np.ascontiguousarray(self.w2.T.astype(np.float32))
+
+    def layer1_gather(self, indices: list) -> np.ndarray:
+        out = np.empty((len(indices), self.hidden), dtype=np.int32)
+        for i, idx in enumerate(indices):
+            out[i] = self.image.w1_cols[idx].sum(axis=0, dtype=np.int32).reshape(-1)
+        out += self.b1
+        return out
+
+    def layer1_gemm_bits(self, x_bits: np.ndarray) -> np.ndarray:
+        x = x_bits.astype(np.float32, copy=False)
+        w1 = self.image.w1_cols
+        acc = np.zeros((x.shape[0], self.hidden), dtype=np.float32)
+        for c in range(0, self.in_dim, W1_BLOCK):
+            blk = w1[c:c + W1_BLOCK].reshape(-1, self.hidden).astype(np.float32)
+            acc += x[:, c:c + W1_BLOCK] @ blk   # integer partial sums: exact in float32
+        return acc.astype(np.int32) + self.b1
+
+
+def open_engine(source=BASE_DIR, shift=None) -> IntMLP:
+    """
+    Ready-to-run engine without torch: IntMLP for a text-export directory, or
+    MappedIntMLP over a dense weights.memh / .bin. An image's per-row shift
+    table wins; otherwise SHIFT is `shift`, else SHIFT.txt next to the weights.
+    """
+    source = Path(source)
+    if source.is_dir():
+        w1, b1, w2, b2, s = load_txt_weights(source)
+        return IntMLP(w1, b1, w2, b2, s if shift is None else shift)
+    image = MemhImage(source)
+    if shift is None and image.shifts is None:
+        shift_txt = source.parent / "SHIFT.txt"
+        if not shift_txt.exists():
+            raise ValueError(f"{source} has no shift table; pass shift= (no {shift_txt})")
+        shift = read_shift_txt(shift_txt)
+    return MappedIntMLP(image, shift)
+
+
+# -----------------------------
+# Equivalence check + benchmark
+# -----------------------------
+
+def _time(fn, min_time=0.2):
+    fn()
+    reps, t0 = 0, time.perf_counter()
+    while True:
+        out = fn()
+        reps += 1
+        dt = time.perf_counter() - t0
+        if dt >= min_time:
+            return dt / reps, out
+
+def _sparse_check(path: str, weights_dir: str, n: int, seed: int) -> None:
+    """Sparse image == text export, bit-exact inference from it, projected savings."""
+    import tc_model
+    from datagen import make_dataset_sharded
+
+    w1, b1, w2, b2, keep, shifts = load_sparse_memh(path)
+    ref = load_txt_weights(weights_dir)
+    same = all(np.array_equal(a, b) for a, b in zip((w1, b1, w2, b2), ref[:4]))
+    if shifts is not None:
+        same = same and np.array_equal(shifts, ref[4])
+    print(f"{path}: weights == {weights_dir} text export: {same}")
+    if not same:
+        raise SystemExit("MISMATCH: sparse image and text export hold different weights")
+
+    P, _ = make_dataset_sharded(n // 3 + 1, seed=seed, workers=1, packed=True)
+    dense, sparse = IntMLP(*ref), IntMLP(w1, b1, w2, b2, ref[4])
+    dt_d, out_d = _time(lambda: dense.infer_packed(P, "gemm"))
+    dt_s, out_s = _time(lambda: sparse.infer_packed(P, "gemm"))
+    exact = all(np.array_equal(a, b) for a, b in zip(out_d, out_s))
+    print(f"inference on {len(P)} images: exact {exact}, gemm {dt_d*1e3:.1f}ms text export / "
+          f"{dt_s*1e3:.1f}ms sparse image ({0 if sparse.active is None else sparse.in_dim - len(sparse.active)} "
+          f"input columns unused by every hidden unit)")
+    if not exact:
+        raise SystemExit("MISMATCH: sparse vs dense inference")
+
+    pr = tc_model.sparse_projection(keep)
+    dm, sm = pr["dense_mem_words"], pr["sparse_mem_words"]
+    print(f"W1 words stored {pr['kept_cols']}/{keep.size}, pixel words sent "
+          f"{pr['kept_pixel_words']}/{pr['pixel_words']} per batch")
+    print(f"tensor memory: {sm} words vs {dm} dense ({100 * (dm - sm) / dm:+.1f}% saved)")
+    for name, dense_key in (("feed_bound", "dense_cycles"), ("mac_bound", "dense_mac_bound_cycles")):
+        c, dc = pr[f"{name}_cycles"], pr[dense_key]
+        print(f"cycles per batch of 4 ({name}): {c} vs {dc} dense ({100 * (dc - c) / dc:+.1f}% saved)")
+
+def _packed_check(path: str, w1_bits: int, weights_dir: str, n: int, seed: int) -> None:
+    """Packed int4/ternary image == text export, bit-exact inference from it, projected cost."""
+    import tc_model
+    from datagen import make_dataset_sharded
+
+    w1, b1, w2, b2, shifts = load_memh(path, w1_bits)
+    ref = load_txt_weights(weights_dir)
+    same = all(np.array_equal(a, b) for a, b in zip((w1, b1, w2, b2), ref[:4]))
+    if shifts is not None:
+        same = same and np.array_equal(shifts, ref[4])
+    print(f"{path}: {w1_bits}-bit W1 weights == {weights_dir} text export: {same}")
+    if not same:
+        raise SystemExit("MISMATCH: packed image and text export hold different weights")
+
+    P, _ = make_dataset_sharded(n // 3 + 1, seed=seed, workers=1, packed=True)
+    out_d = IntMLP(*ref).infer_packed(P, "gemm")
+    out_p = IntMLP(w1, b1, w2, b2, ref[4]).infer_packed(P, "gemm")
+    exact = all(np.array_equal(a, b) for a, b in zip(out_d, out_p))
+    print(f"inference on {len(P)} images from the packed image: exact {exact}")
+    if not exact:
+        raise SystemExit("MISMATCH: packed vs text-export inference")
+
+    dense, pr = tc_model.precision_projection(8), tc_model.precision_projection(w1_bits)
+    dm, pm = dense["mem_words"], pr["mem_words"]
+    print(f"tensor memory: {pm} words vs {dm} int8 ({100 * (dm - pm) / dm:+.1f}% saved, W1 fetches "
+          f"{pr['w1_fetches']}/{dense['w1_fetches']})")
+    for name in ("feed_bound", "mac_bound"):
+        c, dc = pr[f"{name}_cycles"], dense[f"{name}_cycles"]
+        print(f"cycles per batch of 4 ({name}): {c} vs {dc} int8 ({100 * (dc - c) / dc:+.1f}% saved)")
+
+def _mapped_check(path: str, weights_dir: str, n: int, seed: int) -> None:
+    """Mapped image == text export with zero-copy views, bit-exact inference straight off them."""
+    from datagen import make_dataset_sharded
+
+    t0 = time.perf_counter()
+    words = _read_memh(path) if Path(path).suffix != ".bin" else None
+    t_parse = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    img = MemhImage(path)
+    t_open = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    img = MemhImage(path)
+    t_reopen = time.perf_counter() - t0
+    mapped = isinstance(img.words.base, np.memmap) or isinstance(img.words, np.memmap)
+    zero_copy = all(np.shares_memory(v, img.words) for v in img.views().values())
+    print(f"{path}: {len(img.words)} words ({img.words.nbytes} B), "
+          f"{'memory-mapped' if mapped else 'in memory (cache not writable)'}; views share the buffer: {zero_copy}")
+    if words is not None:
+        print(f"  hex parse {t_parse*1e3:.1f}ms, first open {t_open*1e3:.1f}ms, cached open {t_reopen*1e3:.2f}ms")
+    else:
+        print(f"  open {t_open*1e3:.2f}ms")
+
+    ref = load_txt_weights(weights_dir)
+    same = all(np.array_equal(a, b) for a, b in zip((img.w1(), img.b1, img.w2, img.b2), ref[:4]))
+    if img.shifts is not None:
+        same = same and np.array_equal(img.shifts, ref[4])
+    print(f"  weights == {weights_dir} text export: {same}")
+    if not same or not zero_copy:
+        raise SystemExit("MISMATCH: mapped image and text export differ (or a view copied)")
+
+    P, _ = make_dataset_sharded(n // 3 + 1, seed=seed, workers=1, packed=True)
+    eng, mapped_eng = IntMLP(*ref), MappedIntMLP(img, ref[4])
+    dt_ref, out_ref = _time(lambda: eng.infer_packed(P, "gemm"))
+    for method in ("gemm", "gather"):
+        Pm = P if method == "gemm" else P[:min(len(P), 4096)]
+        want = out_ref if method == "gemm" else eng.infer_packed(Pm, "gemm")
+        dt, out = _time(lambda: mapped_eng.infer_packed(Pm, method))
+        exact = all(np.array_equal(a, b) for a, b in zip(want, out))
+        print(f"  {method:6s} off the mapped views, {len(Pm)} images: exact {exact}, {dt*1e3:.1f}ms "
+              f"({len(Pm)/dt:.0f} samples/s; IntMLP gemm {len(P)/dt_ref:.0f} samples/s)")
+        if not exact:
+            raise SystemExit(f"MISMATCH: mapped {method} vs text-export inference")
+
+    # no copy of W1 may outlive a call, and a call must not build one either
+    import tracemalloc
+
+    w1_size = img.hidden * img.in_dim
+    held = [k for k, v in vars(mapped_eng).items()
+            if isinstance(v, np.ndarray) and v.size >= w1_size and not np.shares_memory(v, img.words)]
+    tracemalloc.start()
+    mapped_eng.infer_packed(P[:1], "gemm")
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  W1 copies held by the engine: {held or 'none'}; batch-1 gemm peak {peak / 1024:.0f} KB "
+          f"(float32 W1 would be {w1_size * 4 / 1024:.0f} KB)")
+    if held or peak >= w1_size * 4:
+        raise SystemExit("MISMATCH: the mapped engine copies W1")
+
+_COLD_START = """
+import time
+t0 = time.perf_counter()
+import sys
+import numpy as np
+t1 = time.perf_counter()
+from int_engine import open_engine
+t2 = time.perf_counter()
+eng = open_engine(sys.argv[1])
+t3 = time.perf_counter()
+eng.infer_packed(np.zeros((1, 450), dtype=np.uint8))
+t4 = time.perf_counter()
+print(t1 - t0, t2 - t1, t3 - t2, t4 - t3, int("torch" in sys.modules))
+"""
+
+def _cold_start_check(source: str, runs: int) -> None:
+    """
+    Fresh interpreters: import numpy + int_engine, open_engine(source), classify
+    one image; torch must stay unimported. One `import model` run for contrast.
+    """
+    import statistics
+    import subprocess
+    import sys
+
+    def run(code, *argv):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", code, *argv], cwd=BASE_DIR, check=True,
+                             capture_output=True, text=True).stdout.split()
+        return time.perf_counter() - t0, out
+
+    run(_COLD_START, source)  # writes the .bin cache of a .memh, warms the page cache
+    bare = statistics.median(run("pass")[0] for _ in range(runs))
+    proc, steps, torch_loaded = [], [], False
+    for _ in range(runs):
+        dt, out = run(_COLD_START, source)
+        proc.append(dt)
+        steps.append([float(v) for v in out[:4]])
+        torch_loaded |= out[4] == "1"
+    numpy_s, engine_s, open_s, infer_s = (statistics.median(col) for col in zip(*steps))
+    total = statistics.median(sum(s) for s in steps)
+    via_model = run("import model")[0]
+    print(f"cold start, {source} ({runs} fresh interpreters, medians):")
+    print(f"  import numpy {numpy_s*1e3:.1f}ms + import int_engine {engine_s*1e3:.1f}ms + open {open_s*1e3:.1f}ms "
+          f"+ classify 1 image {infer_s*1e3:.1f}ms = {total*1e3:.1f}ms")
+    print(f"  process {statistics.median(proc)*1e3:.1f}ms (bare interpreter {bare*1e3:.1f}ms); "
+          f"`import model` (torch) process {via_model*1e3:.0f}ms")
+    print(f"  torch imported: {torch_loaded}")
+    if torch_loaded:
+        raise SystemExit("torch was imported on the inference path")
+
+def main():
+    ap = argparse.ArgumentParser(description="Bit-exactness check + benchmark of the integer emulator backends.")
+    ap.add_argument("--weights_dir", type=str, default=str(BASE_DIR))
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1, 16, 256, 4096, 100000])
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--sparse_memh", type=str, default="",
+                    help="check this weight_to_memh.py --sparse image and report its savings instead")
+    ap.add_argument("--packed_memh", type=str, default="",
+                    help="check this weight_to_memh.py --w1_bits image and report its savings instead")
+    ap.add_argument("--w1_bits", type=int, default=4, choices=[4, 2], help="W1 field width of --packed_memh")
+    ap.add_argument("--mapped", type=str, default="",
+                    help="memory-map this weights.memh / .bin, check it and run inference off its views instead")
+    ap.add_argument("--cold_start", type=str, default="",
+                    help="time import + open_engine(this dir / .memh / .bin) + one image in fresh interpreters instead")
+    ap.add_argument("--runs", type=int, default=7, help="fresh interpreters for --cold_start")
+    args = ap.parse_args()
+
+    if args.sparse_memh:
+        _sparse_check(args.sparse_memh, args.weights_dir, max(args.sizes), args.seed)
+        return
+    if args.packed_memh:
+        _packed_check(args.packed_memh, args.w1_bits, args.weights_dir, max(args.sizes), args.seed)
+        return
+    if args.mapped:
+        _mapped_check(args.mapped, args.weights_dir, max(args.sizes), args.seed)
+        return
+    if args.cold_start:
+        _cold_start_check(args.cold_start, args.runs)
+        return
+
+    import torch
+    from datagen import make_dataset_sharded, unpack_images
+    from model import available_int_backends, check_int_backends, int_infer_batch
+
+    backends = [b for b in available_int_backends() if b != "reference"]
+    check_int_backends(backends, args.seed)
+    print(f"random-weight equivalence: {', '.join(backends)} == reference for SHIFT 0..20 and per-row shifts")
+
+    w1, b1, w2, b2, shift = load_txt_weights(args.weights_dir)
+    eng = IntMLP(w1, b1, w2, b2, shift)
+    tw = [torch.from_numpy(a) for a in (w1, b1, w2, b2)]
+
+    n_max = max(args.sizes)
+    P, _ = make_dataset_sharded((n_max + 2) // 3, seed=args.seed, workers=1, packed=True)
+
+    print(f"{'batch':>7s}  {'backend':>10s}  {'latency':>12s}  {'samples/s':>12s}  {'speedup':>8s}  exact")
+    for n in args.sizes:
+        Pn = P[:n]
+        xf = torch.from_numpy(unpack_images(Pn, dtype=np.float32))
+        xp = torch.from_numpy(Pn)
+        # the reference takes the float rows it always did; the others take packed input
+        runs = [("reference", lambda: int_infer_batch(xf, *tw, shift, backend="reference"))]
+        runs += [(be, lambda be=be: int_infer_batch(xp, *tw, shift, backend=be)) for be in backends]
+        if n <= 4096:
+            runs.append(("gather", lambda: tuple(map(torch.from_numpy, eng.infer_packed(Pn, "gather")))))
+
+        t_ref = None
+        for name, fn in runs:
+            dt, (logits, pred) = _time(fn)
+            if t_ref is None:
+                t_ref, ref = dt, (logits, pred)
+            exact = torch.equal(ref[0], logits) and torch.equal(ref[1], pred)
+            print(f"{n:7d}  {name:>10s}  {dt*1e3:10.3f}ms  {n/dt:12.0f}  {t_ref/dt:7.1f}x  {exact}")
+            if not exact:
+                raise SystemExit(f"MISMATCH: {name} vs reference at batch {n}")
+
+
+if __name__ == "__main__":
+    main()
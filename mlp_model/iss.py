@@ -0,0 +1,913 @@
+#!/usr/bin/env python3
+"""
+Instruction-set simulator for the pipeline firmware (assembly/*.asm).
+
+Runs instruction_memory.memh (or an .asm file through the small assembler
+below) and data.memh against the CPU's memory map (src/mmio.sv):
+
+  0 .. 8        DPU (src/dpu.sv)   read 0x4 pixel bus word (bit 30 valid, bit 31 last),
+                                   write 0x4 init / ack, read 0x8 full_done,
+                                   write 0x8 shape (taken when bits 15:12 are all set)
+  9 .. 2060     dcache             word (addr - 12) >> 2 of data.memh
+  58768 ..      tensor controller  write 0xC SHIFT, write 0x4 start / shape ack,
+                                   write 0x8 pixel word, read 0x8 ready, read 0x4 shape
+
+The CPU is RV32I as decode.sv / execute.sv implement it: R/I-type ALU ops,
+lui, lw/sw (always a full word, funct3 ignored), branches, jal, jalr; no auipc,
+fence or system instructions. Straight-line code up to the next branch or jump
+is translated once into a Python function per basic block, so the simulator
+runs two to three million instructions per second: a full batch of
+int_tensor.asm (16 feed passes, 160k instructions) takes about 0.1 s, against
+minutes of RTL simulation.
+
+The devices are functional:
+  * DPU: streams golden_vectors.dpu_bus_words (480 words per batch of 4 images)
+    with no latency; after the last word of a batch, full_done goes high once
+    the CPU has sent a shape word with bits 15:12 set, and the next write to
+    0x4 starts the next batch
+  * tensor controller: collects the pixel words of HIDDEN/ROW_DIM feed passes
+    (450 words each, tc_model.pixel_words layout) and returns the shape word
+    of tc_model.rtl_infer_batch (what the current RTL computes) or, with
+    --tc exact, of the integer emulator. ready drops for --tc_word_cycles after
+    every pixel word and the shape appears --tc_tail_cycles after the last one
+    (default: the drain, layer-2 and class-out phases of tc_model.batch_report)
+
+Cycle estimate (the FeedTiming model of the 5-stage core): one cycle per
+instruction, +3 for a taken branch or jump (resolved in MEM), +1 for every
+MMIO access (MEM held for 2 cycles); dcache accesses are counted as hits.
+
+Report: instruction mix, loads/stores per region, MMIO polls (reads that found
+the device not ready) and the cycles spent in each polling loop, hot loops
+(back edges by count) with their disassembly, and the TC / DPU transactions.
+
+The run stops at a jump-to-self (the firmware's `done: jal x0, done`), a poll
+of a device that has nothing left to produce, an undecodable instruction or
+--max_instr.
+
+What it shows about the current firmware:
+  * intDPU.asm (instruction_memory.memh) sends its four shape words with the
+    quadrant in bits 6:3, so the DPU never sets full_done and the poll at
+    poll_full_done spins forever
+  * int_everything.asm does not assemble (lw x21, x10(x11) is not RV32I);
+    with the address add spelled out it feeds one pass of 450 words instead
+    of 16, so the shape never comes back (int_tensor.asm loops 16 times)
+
+Only deps: numpy, standard library
+
+  python iss.py                                      # repo instruction_memory.memh + data.memh
+  python iss.py --asm ../assembly/int_tensor.asm     # assemble and run the TC firmware
+  python iss.py --asm ../assembly/int_tensor.asm --tc exact --dpu_bus golden_vectors/dpu_bus.memh
+"""
+
+import argparse
+import re
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+
+BASE_DIR = Path(__file__).resolve().parent
+REPO_DIR = BASE_DIR.parent
+
+MASK32 = 0xFFFFFFFF
+SIGN32 = 0x80000000
+
+DPU_END = 8
+DCACHE_LO, DCACHE_HI, DCACHE_BASE = 9, 2060, 12
+TC_BASE = 58768
+DATA_DEPTH = 1024
+
+TAKEN_PENALTY = 3      # branch/jump resolved in MEM
+MMIO_EXTRA = 1         # NORMAL -> RECIEVE in mem.sv
+STUCK_POLLS = 16       # not-ready reads of an idle device before the run is stopped
+
+ROW_DIM = 4
+N_PIX = 3600
+TC_WORDS = N_PIX * ROW_DIM // 32   # 450 pixel words per feed pass
+
+
+class Halt(Exception):
+    """Stops the run; the message says why."""
+
+
+# -----------------------------
+# Decoder
+# -----------------------------
+
+R_OPS = {(0, 0): "add", (0, 0x20): "sub", (1, 0): "sll", (2, 0): "slt", (3, 0): "sltu",
+         (4, 0): "xor", (5, 0): "srl", (5, 0x20): "sra", (6, 0): "or", (7, 0): "and"}
+I_OPS = {0: "addi", 2: "slti", 3: "sltiu", 4: "xori", 6: "ori", 7: "andi"}
+SHIFT_OPS = {(1, 0): "slli", (5, 0): "srli", (5, 0x20): "srai"}
+BRANCH_OPS = {0: "beq", 1: "bne", 4: "blt", 5: "bge", 6: "bltu", 7: "bgeu"}
+
+KIND = {**{m: "alu" for m in R_OPS.values()}, **{m: "alu_imm" for m in I_OPS.values()},
+        **{m: "alu_imm" for m in SHIFT_OPS.values()}, **{m: "branch" for m in BRANCH_OPS.values()},
+        "lui": "lui", "lw": "load", "sw": "store", "jal": "jal", "jalr": "jalr"}
+
+
+def _sext(v: int, bits: int) -> int:
+    return v - ((v >> (bits - 1)) << bits)
+
+def decode(word: int) -> tuple:
+    """32-bit instruction -> (mnemonic, rd, rs1, rs2, imm); ValueError if decode.sv does not implement it."""
+    op = word & 0x7F
+    rd, f3, rs1, rs2, f7 = (word >> 7) & 31, (word >> 12) & 7, (word >> 15) & 31, (word >> 20) & 31, word >> 25
+    if op == 0x33 and (f3, f7) in R_OPS:
+        return R_OPS[f3, f7], rd, rs1, rs2, 0
+    if op == 0x13:
+        if f3 in I_OPS:
+            return I_OPS[f3], rd, rs1, 0, _sext(word >> 20, 12)
+        if (f3, f7) in SHIFT_OPS:
+            return SHIFT_OPS[f3, f7], rd, rs1, 0, rs2
+    if op == 0x37:
+        return "lui", rd, 0, 0, word & 0xFFFFF000
+    if op == 0x03:
+        return "lw", rd, rs1, 0, _sext(word >> 20, 12)
+    if op == 0x23:
+        return "sw", 0, rs1, rs2, _sext((f7 << 5) | rd, 12)
+    if op == 0x63 and f3 in BRANCH_OPS:
+        imm = ((word >> 31) << 12) | (((word >> 7) & 1) << 11) | (((word >> 25) & 0x3F) << 5) | (((word >> 8) & 0xF) << 1)
+        return BRANCH_OPS[f3], 0, rs1, rs2, _sext(imm, 13)
+    if op == 0x6F:
+        imm = ((word >> 31) << 20) | (((word >> 12) & 0xFF) << 12) | (((word >> 20) & 1) << 11) | (((word >> 21) & 0x3FF) << 1)
+        return "jal", rd, 0, 0, _sext(imm, 21)
+    if op == 0x67 and f3 == 0:
+        return "jalr", rd, rs1, 0, _sext(word >> 20, 12)
+    raise ValueError(f"unsupported instruction 0x{word:08x}")
+
+def disasm(ins: tuple, pc: int) -> str:
+    m, rd, rs1, rs2, imm = ins
+    kind = KIND[m]
+    if kind == "alu":
+        return f"{m} x{rd}, x{rs1}, x{rs2}"
+    if kind == "alu_imm":
+        return f"{m} x{rd}, x{rs1}, {imm}"
+    if m == "lui":
+        return f"lui x{rd}, 0x{imm >> 12:x}"
+    if m == "lw":
+        return f"lw x{rd}, {imm}(x{rs1})"
+    if m == "sw":
+        return f"sw x{rs2}, {imm}(x{rs1})"
+    if kind == "branch":
+        return f"{m} x{rs1}, x{rs2}, 0x{pc + imm:x}"
+    if m == "jal":
+        return f"jal x{rd}, 0x{pc + imm:x}"
+    return f"jalr x{rd}, {imm}(x{rs1})"
+
+
+# -----------------------------
+# Assembler
+# -----------------------------
+
+class AsmError(ValueError):
+    pass
+
+_R_CODES = {m: k for k, m in R_OPS.items()}
+_I_CODES = {m: k for k, m in I_OPS.items()}
+_SHIFT_CODES = {m: k for k, m in SHIFT_OPS.items()}
+_BRANCH_CODES = {m: k for k, m in BRANCH_OPS.items()}
+_MEM_RE = re.compile(r"^(-?\w+)\((\w+)\)$")
+
+
+def _reg(tok: str) -> int:
+    m = re.fullmatch(r"x(\d+)", tok)
+    if not m or int(m.group(1)) > 31:
+        raise AsmError(f"bad register '{tok}' (only x0..x31 are used in this repo)")
+    return int(m.group(1))
+
+def _int(tok: str) -> int:
+    try:
+        return int(tok, 0)
+    except ValueError:
+        raise AsmError(f"bad immediate '{tok}'") from None
+
+def _check(v: int, lo: int, hi: int, what: str) -> int:
+    if not lo <= v <= hi:
+        raise AsmError(f"{what} {v} out of range [{lo}, {hi}]")
+    return v
+
+def _li_parts(imm: int) -> list:
+    """li -> [("addi", lo)] or [("lui", hi20), ("addi", lo)] (lo dropped when 0)."""
+    v = _sext(imm & MASK32, 32)
+    if -2048 <= v < 2048:
+        return [("addi", v)]
+    lo = _sext(v & 0xFFF, 12)
+    hi = ((v - lo) >> 12) & 0xFFFFF
+    return [("lui", hi)] + ([("addi", lo)] if lo else [])
+
+def _enc_r(f7, rs2, rs1, f3, rd, op):
+    return (f7 << 25) | (rs2 << 20) | (rs1 << 15) | (f3 << 12) | (rd << 7) | op
+
+def _enc_i(imm, rs1, f3, rd, op):
+    return ((imm & 0xFFF) << 20) | (rs1 << 15) | (f3 << 12) | (rd << 7) | op
+
+def _enc_s(imm, rs2, rs1):
+    imm &= 0xFFF
+    return ((imm >> 5) << 25) | (rs2 << 20) | (rs1 << 15) | (2 << 12) | ((imm & 31) << 7) | 0x23
+
+def _enc_b(off, rs2, rs1, f3):
+    o = off & 0x1FFF
+    return (((o >> 12) & 1) << 31) | (((o >> 5) & 0x3F) << 25) | (rs2 << 20) | (rs1 << 15) | (f3 << 12) \
+        | (((o >> 1) & 0xF) << 8) | (((o >> 11) & 1) << 7) | 0x63
+
+def _enc_j(off, rd):
+    o = off & 0x1FFFFF
+    return (((o >> 20) & 1) << 31) | (((o >> 1) & 0x3FF) << 21) | (((o >> 11) & 1) << 20) \
+        | (((o >> 12) & 0xFF) << 12) | (rd << 7) | 0x6F
+
+def _mem_operand(tok: str) -> tuple:
+    m = _MEM_RE.match(tok)
+    if not m:
+        raise AsmError(f"bad memory operand '{tok}', expected imm(xN)")
+    if re.fullmatch(r"x\d+", m.group(1)):
+        raise AsmError(f"register offset in '{tok}': RV32I loads/stores only take imm(xN)")
+    return _check(_int(m.group(1)), -2048, 2047, "offset"), _reg(m.group(2))
+
+def _size(m: str, ops: list) -> int:
+    return len(_li_parts(_int(ops[1]))) if m == "li" else 1
+
+def _encode(m: str, ops: list, pc: int, labels: dict) -> list:
+    def want(n):
+        if len(ops) != n:
+            raise AsmError(f"{m} takes {n} operands, got {len(ops)}")
+
+    def target(tok):
+        if tok in labels:
+            return labels[tok] - pc
+        return _int(tok)
+
+    if m in _R_CODES:
+        want(3)
+        f3, f7 = _R_CODES[m]
+        return [_enc_r(f7, _reg(ops[2]), _reg(ops[1]), f3, _reg(ops[0]), 0x33)]
+    if m in _I_CODES:
+        want(3)
+        return [_enc_i(_check(_int(ops[2]), -2048, 2047, "immediate"), _reg(ops[1]), _I_CODES[m], _reg(ops[0]), 0x13)]
+    if m in _SHIFT_CODES:
+        want(3)
+        f3, f7 = _SHIFT_CODES[m]
+        return [_enc_r(f7, _check(_int(ops[2]), 0, 31, "shift"), _reg(ops[1]), f3, _reg(ops[0]), 0x13)]
+    if m == "lui":
+        want(2)
+        return [(_check(_int(ops[1]), 0, 0xFFFFF, "upper immediate") << 12) | (_reg(ops[0]) << 7) | 0x37]
+    if m == "lw":
+        want(2)
+        off, base = _mem_operand(ops[1])
+        return [_enc_i(off, base, 2, _reg(ops[0]), 0x03)]
+    if m == "sw":
+        want(2)
+        off, base = _mem_operand(ops[1])
+        return [_enc_s(off, _reg(ops[0]), base)]
+    if m in _BRANCH_CODES:
+        want(3)
+        off = _check(target(ops[2]), -4096, 4094, "branch offset")
+        return [_enc_b(off, _reg(ops[1]), _reg(ops[0]), _BRANCH_CODES[m])]
+    if m in ("jal", "j"):
+        rd, tok = (0, ops[0]) if len(ops) == 1 else (_reg(ops[0]), ops[1])
+        if len(ops) > 2 or (m == "j" and len(ops) != 1):
+            raise AsmError(f"bad operands for {m}")
+        return [_enc_j(_check(target(tok), -(1 << 20), (1 << 20) - 2, "jump offset"), rd)]
+    if m == "jalr":
+        if len(ops) == 2:
+            off, base = _mem_operand(ops[1])
+        else:
+            want(3)
+            off, base = _check(_int(ops[2]), -2048, 2047, "offset"), _reg(ops[1])
+        return [_enc_i(off, base, 0, _reg(ops[0]), 0x67)]
+    if m == "li":
+        want(2)
+        rd = _reg(ops[0])
+        out, src = [], 0
+        for kind, v in _li_parts(_int(ops[1])):
+            if kind == "lui":
+                out.append((v << 12) | (rd << 7) | 0x37)
+                src = rd
+            else:
+                out.append(_enc_i(v, src, 0, rd, 0x13))
+        return out
+    if m == "mv":
+        want(2)
+        return [_enc_i(0, _reg(ops[1]), 0, _reg(ops[0]), 0x13)]
+    if m == "nop":
+        want(0)
+        return [_enc_i(0, 0, 0, 0, 0x13)]
+    raise AsmError(f"unknown or unsupported instruction '{m}'")
+
+def _first_pass(text: str, name: str) -> tuple:
+    """(lines, labels): every instruction line with its pc, and label -> pc."""
+    lines = []
+    labels, pc = {}, 0
+    for no, raw in enumerate(text.splitlines(), 1):
+        s = raw.split("#", 1)[0].strip()
+        while (m := re.match(r"^([A-Za-z_.]\w*)\s*:\s*", s)):
+            if m.group(1) in labels:
+                raise AsmError(f"{name}:{no}: duplicate label '{m.group(1)}'")
+            labels[m.group(1)] = pc
+            s = s[m.end():]
+        if not s or s.startswith("."):
+            continue
+        parts = s.split(None, 1)
+        mnem = parts[0].lower()
+        ops = [t.strip() for t in parts[1].split(",")] if len(parts) > 1 else []
+        try:
+            n = _size(mnem, ops)
+        except AsmError as exc:
+            raise AsmError(f"{name}:{no}: {exc}") from None
+        lines.append((no, raw.strip(), mnem, ops, pc))
+        pc += 4 * n
+    return lines, labels
+
+def assemble(text: str, name: str = "<asm>") -> tuple:
+    """
+    Two-pass assembler for the RV32I subset the core decodes, plus li / mv / nop / j.
+    '#' comments, 'label:' (alone or before an instruction) and '.' directives
+    (ignored) as in assembly/*.asm. Returns (words, labels); errors are
+    AsmError("file:line: ...").
+    """
+    lines, labels = _first_pass(text, name)
+    words = []
+    for no, src, mnem, ops, pc in lines:
+        try:
+            words += _encode(mnem, ops, pc, labels)
+        except AsmError as exc:
+            raise AsmError(f"{name}:{no}: {exc}  [{src}]") from None
+    return words, labels
+
+
+# -----------------------------
+# Devices
+# -----------------------------
+
+class DPUModel:
+    """Pixel bus of src/dpu.sv: one 480-word batch at a time, no latency."""
+
+    def __init__(self, bus_words: np.ndarray, batch_words: int = ROW_DIM * N_PIX // 30):
+        self.words = [int(w) for w in bus_words]
+        self.batch_words = batch_words
+        self.pos = 0
+        self.started = False
+        self.streaming = False
+        self.full_done = 0
+        self.shapes = []          # every shape write
+        self.batches_done = 0
+        self.acks = 0
+
+    def read(self, off: int, cycle: int) -> tuple:
+        """(value, ready)"""
+        if off == 0x4:
+            if self.streaming and self.pos < len(self.words):
+                return self.words[self.pos], True
+            return 0, False
+        if off == 0x8:
+            return self.full_done, bool(self.full_done)
+        return 0, True
+
+    def write(self, off: int, value: int, cycle: int) -> None:
+        if off == 0x4:
+            if self.full_done or not self.started:
+                self.started, self.streaming, self.full_done = True, True, 0
+            elif self.streaming and self.pos < len(self.words):
+                self.acks += 1
+                last = self.words[self.pos] >> 31
+                self.pos += 1
+                if last or self.pos % self.batch_words == 0:
+                    self.streaming = False
+        elif off == 0x8:
+            self.shapes.append(value)
+            if value & 0xF000 == 0xF000 and self.started and not self.streaming:
+                self.full_done = 1
+                self.batches_done += 1
+
+    def idle(self, cycle: int) -> bool:
+        return True
+
+    def exhausted(self) -> bool:
+        return self.pos >= len(self.words)
+
+
+class TensorModel:
+    """Register interface of src/tensor_controller.sv with a functional datapath."""
+
+    def __init__(self, infer_fn, passes: int = 16, word_cycles: int = 0, tail_cycles: int = 0):
+        self.infer_fn = infer_fn      # ((ROW_DIM, N_PIX) 0/1, shift) -> shape word
+        self.passes = passes
+        self.word_cycles = word_cycles
+        self.tail_cycles = tail_cycles
+        self.shift = 0
+        self.running = False
+        self.words = []
+        self.ready_at = 0
+        self.shape = 0
+        self.shape_at = None
+        self.results = []             # (shape, images, notes) per batch
+        self.infer_time = 0.0
+        self.dropped = 0              # pixel words written while not running
+
+    def read(self, off: int, cycle: int) -> tuple:
+        if off == 0x8:
+            ok = self.running and self.shape_at is None and cycle >= self.ready_at
+            return int(ok), ok
+        if off == 0x4:
+            if self.shape_at is not None and cycle >= self.shape_at:
+                return self.shape, True
+            return 0, False
+        return 0, True
+
+    def write(self, off: int, value: int, cycle: int) -> None:
+        if off == 0xC:
+            self.shift = value & 0x1F
+        elif off == 0x4:
+            if self.shape_at is not None:
+                self.shape_at, self.shape, self.running = None, 0, False
+            elif not self.running:
+                self.running, self.words, self.ready_at = True, [], cycle
+        elif off == 0x8:
+            if not self.running or self.shape_at is not None:
+                self.dropped += 1
+                return
+            self.words.append(value)
+            self.ready_at = cycle + self.word_cycles
+            if len(self.words) == self.passes * TC_WORDS:
+                self._finish(cycle)
+
+    def _finish(self, cycle: int) -> None:
+        w = np.array(self.words, dtype=np.uint32).reshape(self.passes, TC_WORDS)
+        notes = []
+        bad = int((w != w[0]).any(axis=1).sum())
+        if bad:
+            notes.append(f"{bad} of {self.passes} feed passes differ from pass 0")
+        bits = ((w[0][:, None] >> np.arange(32, dtype=np.uint32)) & 1).astype(np.uint8)
+        images = bits.reshape(TC_WORDS, ROW_DIM, 8).transpose(1, 0, 2).reshape(ROW_DIM, N_PIX)
+        t0 = time.perf_counter()
+        self.shape = self.infer_fn(images, self.shift)
+        self.infer_time += time.perf_counter() - t0
+        self.shape_at = cycle + self.tail_cycles
+        self.results.append((self.shape, images, notes))
+
+    def idle(self, cycle: int) -> bool:
+        if self.shape_at is not None:
+            return cycle >= self.shape_at
+        return not self.running or cycle >= self.ready_at
+
+
+# -----------------------------
+# CPU
+# -----------------------------
+
+class Block:
+    """Translated basic block: pcs, static cost, taken target (None for jalr) and counters."""
+    __slots__ = ("pc", "end", "fn", "count", "taken", "cost", "pcs", "target", "cond", "mem")
+
+def _src(ins: tuple, pc: int) -> tuple:
+    """Python statement(s) for one instruction; the terminator returns the next pc."""
+    m, rd, rs1, rs2, imm = ins
+    a, b = f"r[{rs1}]", f"r[{rs2}]"
+    expr = {
+        "add": f"({a} + {b}) & {MASK32}", "sub": f"({a} - {b}) & {MASK32}",
+        "sll": f"({a} << ({b} & 31)) & {MASK32}", "srl": f"{a} >> ({b} & 31)",
+        "sra": f"((({a} ^ {SIGN32}) - {SIGN32}) >> ({b} & 31)) & {MASK32}",
+        "slt": f"int(({a} ^ {SIGN32}) < ({b} ^ {SIGN32}))", "sltu": f"int({a} < {b})",
+        "xor": f"{a} ^ {b}", "or": f"{a} | {b}", "and": f"{a} & {b}",
+        "addi": f"({a} + {imm}) & {MASK32}", "xori": f"{a} ^ {imm & MASK32}",
+        "ori": f"{a} | {imm & MASK32}", "andi": f"{a} & {imm & MASK32}",
+        "slti": f"int(({a} ^ {SIGN32}) < {(imm & MASK32) ^ SIGN32})", "sltiu": f"int({a} < {imm & MASK32})",
+        "slli": f"({a} << {imm}) & {MASK32}", "srli": f"{a} >> {imm}",
+        "srai": f"((({a} ^ {SIGN32}) - {SIGN32}) >> {imm}) & {MASK32}",
+        "lui": f"{imm}",
+    }
+    if m in expr:
+        return ([f"r[{rd}] = {expr[m]}"] if rd else []), False
+    addr = f"({a} + {imm}) & {MASK32}"
+    if m == "lw":
+        return [f"{'r[%d] = ' % rd if rd else ''}ld({addr}, {pc})"], False
+    if m == "sw":
+        return [f"st({addr}, {b}, {pc})"], False
+    cond = {"beq": f"{a} == {b}", "bne": f"{a} != {b}", "bltu": f"{a} < {b}", "bgeu": f"{a} >= {b}",
+            "blt": f"({a} ^ {SIGN32}) < ({b} ^ {SIGN32})", "bge": f"({a} ^ {SIGN32}) >= ({b} ^ {SIGN32})"}
+    link = [f"r[{rd}] = {pc + 4}"] if rd else []
+    if m in cond:
+        return [f"return {(pc + imm) & MASK32} if {cond[m]} else {pc + 4}"], True
+    if m == "jal":
+        return link + [f"return {(pc + imm) & MASK32}"], True
+    # jalr: target from rs1 before the link write
+    return [f"t = ({a} + {imm}) & {MASK32 - 1}"] + link + ["return t"], True
+
+
+class ISS:
+    """RV32I core + mmio.sv memory map; run() executes until a Halt."""
+
+    def __init__(self, program: list[int], data: np.ndarray, dpu: DPUModel, tc: TensorModel):
+        self.prog = list(program)
+        self.decoded = {}
+        self.mem = [int(v) for v in data] + [0] * max(0, DATA_DEPTH - len(data))
+        self.dpu, self.tc = dpu, tc
+        self.r = [0] * 32
+        self.pc = self.entry = 0
+        self.cycle = 0
+        self.blocks = {}
+        self.jalr_edges = Counter()
+        self.access = Counter()        # (region, "load"/"store") -> count
+        self.mmio = Counter()          # (device, off, "read"/"write"/"miss") -> count
+        self.poll_cycles = Counter()   # load pc -> cycles from first miss to the read that hit
+        self._poll_start = {}
+        self._stuck = (None, 0)
+        self.unmapped = Counter()
+        self.halt_reason = ""
+
+    # -------- memory map --------
+
+    def _device(self, addr: int):
+        if addr <= DPU_END:
+            return "dpu", self.dpu, addr
+        if addr >= TC_BASE:
+            return "tc", self.tc, addr - TC_BASE
+        return None, None, addr
+
+    def load(self, addr: int, pc: int) -> int:
+        if DCACHE_LO <= addr <= DCACHE_HI:
+            self.access["dcache", "load"] += 1
+            return self.mem[((addr - DCACHE_BASE) >> 2) % DATA_DEPTH]
+        name, dev, off = self._device(addr)
+        if dev is None:
+            self.unmapped[f"lw 0x{addr:x} @0x{pc:x}"] += 1
+            return 0
+        self.access[name, "load"] += 1
+        self.mmio[name, off, "read"] += 1
+        self.cycle += MMIO_EXTRA
+        value, ready = dev.read(off, self.cycle)
+        if ready:
+            start = self._poll_start.pop(pc, None)
+            if start is not None:
+                self.poll_cycles[pc] += self.cycle - start
+            self._stuck = (None, 0)
+            return value
+        self.mmio[name, off, "miss"] += 1
+        self._poll_start.setdefault(pc, self.cycle)
+        if dev.idle(self.cycle):
+            site, n = self._stuck
+            n = n + 1 if site == pc else 1
+            self._stuck = (pc, n)
+            if n >= STUCK_POLLS:
+                self.poll_cycles[pc] += self.cycle - self._poll_start.pop(pc)
+                raise Halt(f"pc 0x{pc:x} polls {name} 0x{off:x}, which has nothing left to produce")
+        return value
+
+    def store(self, addr: int, value: int, pc: int) -> None:
+        if DCACHE_LO <= addr <= DCACHE_HI:
+            self.access["dcache", "store"] += 1
+            self.mem[((addr - DCACHE_BASE) >> 2) % DATA_DEPTH] = value
+            return
+        name, dev, off = self._device(addr)
+        if dev is None:
+            self.unmapped[f"sw 0x{addr:x} @0x{pc:x}"] += 1
+            return
+        self.access[name, "store"] += 1
+        self.mmio[name, off, "write"] += 1
+        self.cycle += MMIO_EXTRA
+        self._stuck = (None, 0)
+        dev.write(off, value, self.cycle)
+
+    # -------- translation --------
+
+    def instr(self, pc: int) -> tuple:
+        ins = self.decoded.get(pc)
+        if ins is None:
+            i = pc >> 2
+            if pc & 3 or i >= len(self.prog):
+                raise Halt(f"pc 0x{pc:x} is outside the {len(self.prog)}-word program")
+            try:
+                ins = decode(self.prog[i])
+            except ValueError as exc:
+                raise Halt(f"pc 0x{pc:x}: {exc}") from None
+            self.decoded[pc] = ins
+        return ins
+
+    def _compile(self, pc: int) -> Block:
+        body, pcs, p = [], [], pc
+        while True:
+            try:
+                ins = self.instr(p)
+            except Halt:
+                if not pcs:
+                    raise
+                body.append(f"return {p}")   # fall into the bad pc; it halts when reached
+                break
+            stmts, term = _src(ins, p)
+            body += stmts
+            pcs.append(p)
+            p += 4
+            if term:
+                break
+        last = self.decoded[pcs[-1]]
+        if len(pcs) == 1 and last[0] == "jal" and last[4] == 0:
+            raise Halt(f"jump-to-self at pc 0x{pc:x}")
+        src = "def _b(r, ld, st):\n    " + "\n    ".join(body) + "\n"
+        ns = {}
+        exec(compile(src, f"<block 0x{pc:x}>", "exec"), ns)
+        blk = Block()
+        blk.pc, blk.end, blk.fn, blk.pcs = pc, p, ns["_b"], pcs
+        blk.count = blk.taken = 0
+        blk.cost = len(pcs)
+        blk.cond = KIND[last[0]] != "jal" and KIND[last[0]] != "jalr"   # may fall through
+        blk.target = (pcs[-1] + last[4]) & MASK32 if last[0] in BRANCH_OPS.values() or last[0] == "jal" else None
+        blk.mem = any(self.decoded[q][0] in ("lw", "sw") for q in pcs)
+        self.blocks[pc] = blk
+        return blk
+
+    def run(self, max_instr: int = 50_000_000) -> None:
+        r, ld, st = self.r, self.load, self.store
+        blocks, jalr = self.blocks, self.jalr_edges
+        pc = self.pc
+        cycle = self.cycle
+        executed = 0
+        try:
+            while executed < max_instr:
+                blk = blocks.get(pc) or self._compile(pc)
+                blk.count += 1
+                executed += blk.cost
+                cycle += blk.cost
+                if blk.mem:
+                    self.cycle = cycle
+                    npc = blk.fn(r, ld, st)
+                    cycle = self.cycle
+                else:
+                    npc = blk.fn(r, ld, st)
+                if npc != blk.end or not blk.cond:
+                    cycle += TAKEN_PENALTY
+                    blk.taken += 1
+                    if blk.target is None:
+                        jalr[pc, npc] += 1
+                pc = npc
+            self.halt_reason = f"--max_instr {max_instr} reached"
+        except Halt as exc:
+            self.halt_reason = str(exc)
+            if self.cycle > cycle:
+                cycle = self.cycle
+        self.cycle = cycle
+        self.pc = pc
+
+    # -------- statistics --------
+
+    def pc_counts(self) -> Counter:
+        counts = Counter()
+        for blk in self.blocks.values():
+            if blk.count:
+                for p in blk.pcs:
+                    counts[p] += blk.count
+        return counts
+
+    def flow(self) -> dict:
+        """Executed control flow per instruction: pc -> Counter(next pc)."""
+        succ = {}
+        for blk in self.blocks.values():
+            if not blk.count:
+                continue
+            for a, b in zip(blk.pcs, blk.pcs[1:]):
+                succ.setdefault(a, Counter())[b] += blk.count
+            out = succ.setdefault(blk.pcs[-1], Counter())
+            if blk.cond:
+                if blk.target is not None:
+                    out[blk.target] += blk.taken
+                out[blk.end] += blk.count - blk.taken
+            elif blk.target is not None:
+                out[blk.target] += blk.count
+        for (s, d), n in self.jalr_edges.items():
+            succ.setdefault(self.blocks[s].pcs[-1], Counter())[d] += n
+        executed = self.pc_counts()
+        return {a: Counter({b: n for b, n in c.items() if n and b in executed}) for a, c in succ.items()}
+
+    def hot_loops(self, top: int = 4) -> list[dict]:
+        """
+        Natural loops of the executed control flow: for each back edge
+        src -> head where head dominates src, the instructions that reach src
+        without passing through head. Loops sharing a head are merged.
+        """
+        counts = self.pc_counts()
+        total = max(1, sum(counts.values()))
+        succ = self.flow()
+        preds = {}
+        for a, c in succ.items():
+            for b in c:
+                preds.setdefault(b, []).append(a)
+        # reverse postorder from the entry, then Cooper-Harvey-Kennedy immediate dominators
+        order, seen, stack = [], {self.entry}, [(self.entry, iter(succ.get(self.entry, ())))]
+        while stack:
+            node, it = stack[-1]
+            nxt = next((b for b in it if b not in seen), None)
+            if nxt is None:
+                order.append(node)
+                stack.pop()
+            else:
+                seen.add(nxt)
+                stack.append((nxt, iter(succ.get(nxt, ()))))
+        order.reverse()
+        index = {n: i for i, n in enumerate(order)}
+        idom = {self.entry: self.entry}
+
+        def meet(a, b):
+            while a != b:
+                while index[a] > index[b]:
+                    a = idom[a]
+                while index[b] > index[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for n in order[1:]:
+                ps = [p for p in preds.get(n, ()) if p in idom]
+                new = ps[0]
+                for p in ps[1:]:
+                    new = meet(p, new)
+                if idom.get(n) != new:
+                    idom[n], changed = new, True
+
+        def dominates(d, n):
+            while n != d and n != self.entry:
+                n = idom[n]
+            return n == d
+
+        loops = {}
+        for s, c in succ.items():
+            for d, n in c.items():
+                if s not in index or not dominates(d, s):
+                    continue
+                body, todo = {d, s}, [s]
+                while todo:
+                    b = todo.pop()
+                    if b == d:
+                        continue
+                    for q in preds.get(b, ()):
+                        if q not in body:
+                            body.add(q)
+                            todo.append(q)
+                lp = loops.setdefault(d, {"iterations": 0, "pcs": set()})
+                lp["iterations"] += n
+                lp["pcs"] |= body
+        out = []
+        for head, lp in loops.items():
+            pcs = sorted(lp["pcs"])
+            instrs = sum(counts[p] for p in pcs)
+            out.append({"head": head, "iterations": lp["iterations"], "instructions": instrs,
+                        "share": instrs / total,
+                        "body": [(p, counts[p], disasm(self.decoded[p], p)) for p in pcs]})
+        out.sort(key=lambda d: -d["instructions"])
+        return out[:top]
+
+    def report(self, wall: float, labels: dict | None = None) -> list[str]:
+        """wall: seconds spent in run(), minus the tensor-engine model's inference."""
+        counts = self.pc_counts()
+        n = sum(counts.values())
+        names = {v: k for k, v in (labels or {}).items()}
+
+        def where(p):
+            return f"0x{p:x}" + (f" <{names[p]}>" if p in names else "")
+
+        kinds = Counter()
+        for p, c in counts.items():
+            kinds[KIND[self.decoded[p][0]]] += c
+        taken = sum(b.taken for b in self.blocks.values())
+        out = [f"Halted: {self.halt_reason}",
+               f"Instructions: {n}  estimated cycles: {self.cycle}  (CPI {self.cycle / max(1, n):.2f})",
+               f"Wall time {wall:.3f}s, {n / max(wall, 1e-9) / 1e6:.2f} M instr/s, "
+               f"{len(self.blocks)} basic blocks translated",
+               "Instruction mix:"]
+        out += [f"  {k:8s} {c:12d}  {100 * c / max(1, n):6.2f}%" for k, c in kinds.most_common()]
+        out.append(f"  taken branches/jumps {taken}")
+        out.append("Loads / stores:")
+        for region in ("dcache", "dpu", "tc"):
+            ld_, st_ = self.access[region, "load"], self.access[region, "store"]
+            if ld_ or st_:
+                out.append(f"  {region:6s} loads {ld_:10d}  stores {st_:10d}")
+        for k, c in self.unmapped.most_common(8):
+            out.append(f"  unmapped {k}: {c}")
+        if self.mmio:
+            out.append("MMIO registers (reads / not-ready reads / writes):")
+            for d, o in sorted({(d, o) for d, o, _ in self.mmio}):
+                out.append(f"  {d:3s} 0x{o:x}  {self.mmio[d, o, 'read']:9d} {self.mmio[d, o, 'miss']:9d} "
+                           f"{self.mmio[d, o, 'write']:9d}")
+        if self.poll_cycles:
+            out.append("Polling loops (cycles from the first not-ready read to the read that succeeded):")
+            for p, c in self.poll_cycles.most_common():
+                out.append(f"  {where(p):28s} {c:10d} cycles  {100 * c / max(1, self.cycle):6.2f}%  "
+                           f"{disasm(self.decoded[p], p)}")
+        loops = self.hot_loops()
+        if loops:
+            out.append("Hot loops:")
+            for lp in loops:
+                out.append(f"  {where(lp['head'])}: {lp['iterations']} iterations, {len(lp['body'])} instructions "
+                           f"long, {lp['instructions']} executed ({100 * lp['share']:.1f}%)")
+                for p, c, text in lp["body"][:16]:
+                    out.append(f"      {where(p):28s} {c:9d}  {text}")
+                if len(lp["body"]) > 16:
+                    out.append(f"      ... {len(lp['body']) - 16} more")
+        return out
+
+
+# -----------------------------
+# Loading
+# -----------------------------
+
+def read_memh(path) -> np.ndarray:
+    return np.array([int(t, 16) for t in Path(path).read_text(encoding="utf-8").split()], dtype=np.uint32)
+
+def make_shape_fn(weights_dir, mode: str):
+    """((ROW_DIM, N_PIX) 0/1 images, shift) -> shape word, from the RTL twin or the exact int emulator."""
+    import tc_model
+    from golden_vectors import shape_words
+    from int_engine import IntMLP, load_txt_weights
+
+    w1, b1, w2, b2, _ = load_txt_weights(weights_dir)
+
+    def fn(images, shift):
+        if mode == "rtl":
+            _, pred = tc_model.rtl_infer_batch(images, w1, b1, w2, b2, shift, ROW_DIM)
+        else:
+            _, pred = IntMLP(w1, b1, w2, b2, shift).infer(images)
+        return int(shape_words(np.asarray(pred).reshape(1, ROW_DIM))[0])
+    return fn
+
+def default_tail_cycles() -> int:
+    import tc_model
+    ph = tc_model.batch_report()["phases"]
+    return sum(ph[k] for k in ("l1_drain", "l1_post", "layer2", "class_out"))
+
+def generated_bus(batches: int, seed: int) -> np.ndarray:
+    import datagen
+    from golden_vectors import dpu_bus_words
+
+    n = batches * ROW_DIM
+    P, _ = datagen.make_dataset_batched(-(-n // 3), rng=np.random.default_rng(seed), packed=True)
+    bits = datagen.unpack_images(P[:n]).reshape(batches, ROW_DIM, N_PIX)
+    return dpu_bus_words(bits).reshape(-1)
+
+
+# -----------------------------
+# Main
+# -----------------------------
+
+def main():
+    ap = argparse.ArgumentParser(description="RV32I instruction-set simulator for the pipeline firmware.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--imem", type=str, default=str(REPO_DIR / "instruction_memory.memh"))
+    src.add_argument("--asm", type=str, default="", help="assemble this file instead of loading --imem")
+    ap.add_argument("--dump_memh", type=str, default="", help="write the assembled program here")
+    ap.add_argument("--data", type=str, default=str(REPO_DIR / "data.memh"), help="initial data memory")
+    ap.add_argument("--dpu_bus", type=str, default="", help="DPU bus words (golden_vectors.py dpu_bus.memh)")
+    ap.add_argument("--batches", type=int, default=1, help="generated DPU batches when --dpu_bus is not given")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--weights_dir", type=str, default=str(BASE_DIR))
+    ap.add_argument("--tc", choices=("rtl", "exact"), default="rtl",
+                    help="shape from the current RTL's layer 2 (tc_model) or the exact int emulator")
+    ap.add_argument("--tc_passes", type=int, default=16, help="feed passes per batch (HIDDEN / ROW_DIM)")
+    ap.add_argument("--tc_word_cycles", type=int, default=0)
+    ap.add_argument("--tc_tail_cycles", type=int, default=-1, help="-1: from tc_model.batch_report")
+    ap.add_argument("--max_instr", type=int, default=50_000_000)
+    args = ap.parse_args()
+
+    labels = None
+    if args.asm:
+        text = Path(args.asm).read_text(encoding="utf-8")
+        try:
+            program, labels = assemble(text, Path(args.asm).name)
+        except AsmError as exc:
+            raise SystemExit(f"assembler: {exc}")
+        print(f"assembled {args.asm}: {len(program)} words")
+        if args.dump_memh:
+            from weight_to_memh import write_memh
+            write_memh(args.dump_memh, np.array(program, dtype=np.uint32))
+    else:
+        program = read_memh(args.imem).tolist()
+        while program and program[-1] == 0:
+            program.pop()
+    data = read_memh(args.data) if args.data else np.zeros(DATA_DEPTH, dtype=np.uint32)
+    bus = read_memh(args.dpu_bus) if args.dpu_bus else generated_bus(args.batches, args.seed)
+    tail = default_tail_cycles() if args.tc_tail_cycles < 0 else args.tc_tail_cycles
+
+    dpu = DPUModel(bus)
+    tc = TensorModel(make_shape_fn(args.weights_dir, args.tc), args.tc_passes, args.tc_word_cycles, tail)
+    iss = ISS(program, data, dpu, tc)
+    t0 = time.perf_counter()
+    iss.run(args.max_instr)
+    wall = time.perf_counter() - t0 - tc.infer_time
+
+    print("\n".join(iss.report(wall, labels)))
+    from tc_model import decode_shape
+    print(f"DPU: {dpu.pos} of {len(dpu.words)} bus words acked, {dpu.batches_done} batches done, "
+          f"shape writes {[hex(s) for s in dpu.shapes][:8]}")
+    if tc.running or tc.results or tc.dropped:
+        got = len(tc.words)
+        print(f"TC: SHIFT {tc.shift}, {len(tc.results)} batches, {got} of {tc.passes * TC_WORDS} pixel words "
+              f"in the current batch, {tc.dropped} words written while not running")
+        for b, (shape, _, notes) in enumerate(tc.results):
+            print(f"  batch {b}: shape 0x{shape:08x} classes {decode_shape(shape)}"
+                  + (f"  ({'; '.join(notes)})" if notes else ""))
+    regs = {i: v for i, v in enumerate(iss.r) if v}
+    print("Registers: " + " ".join(f"x{i}=0x{v:x}" for i, v in regs.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,18 +12,43 @@ Goal:
 - Choose activation requant SHIFT for a1:
   a1_int32 (after ReLU) -> a1_q int8 via:
     a1_q = clamp( ((a1 + (1<<(SHIFT-1))) >> SHIFT), 0..127 )
+  (--per_channel: per-row W1 scales and one SHIFT per hidden unit)
+  (--w1_quant int4/ternary: sub-8-bit W1 with --qat_epochs of fake-quant
+   fine-tuning and a packed weights_<mode>.memh)
 - Integer-only inference emulation and match rate vs float model argmax
+- Export the tensor-memory image (weights.memh/.bin) and SHIFT.txt directly;
+  the int8/int32 text dumps are optional (--no_txt)
+- --profile trace.json: wall/CPU time, peak RSS and tracemalloc peak of every
+  stage and epoch as a Chrome trace (profiling.py; --torch_profile adds
+  torch.profiler traces of chosen stages)
+
+The integer side needs no torch: int_engine.py (inference), calibration.py
+(SHIFT, the ShiftHistogram used here) and weight_to_memh.py (packing) are
+NumPy-only, so emulating, calibrating or packing an export never imports this
+module.
 
 Only deps: torch, numpy, standard library
 """
 
 import argparse
+import copy
 import os
 import math
+import time
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils import parametrize
+
+import datagen
+from calibration import ShiftHistogram
+from int_engine import IntMLP
+from datagen import (DEFAULT_SHARDS, StreamingBatches, cached_datasets, generator_fingerprint,
+                     make_dataset_batched, make_dataset_sharded, pack_images, source_fingerprint)
+from evaluate import array_chunks, evaluate
+from profiling import StageProfiler
+from weight_to_memh import pack_sparse_weights, pack_weights, write_bin, write_ints_txt, write_memh
 
 
 # -----------------------------
@@ -220,7 +245,7 @@ def make_dataset(n_per_class: int,
         X_list.append(img.reshape(-1).astype(np.float32))
         y_list.append(2)
 
-    X = np.stack(X_list, axis=0)
+    X = np.stack(X_list, axis=0) if X_list else np.empty((0, size * size), dtype=np.float32)
     y = np.array(y_list, dtype=np.int64)
 
     # shuffle
@@ -228,6 +253,33 @@ def make_dataset(n_per_class: int,
     return X[idx], y[idx]
 
 
+# -----------------------------
+# Packed input helpers
+# -----------------------------
+
+_BIT_SHIFTS = {}
+
+def unpack_bits(x_packed: torch.Tensor, n_bits: int = 3600, dtype=torch.float32) -> torch.Tensor:
+    """
+    (N, ceil(n_bits/8)) uint8, np.packbits order (MSB first) -> (N, n_bits) 0/1 of dtype.
+    Runs on whatever device x_packed lives on.
+    """
+    if x_packed.device.type == "cpu":
+        bits = torch.from_numpy(np.unpackbits(x_packed.numpy(), axis=1, count=n_bits))
+        return bits if dtype == torch.uint8 else bits.to(dtype)
+    key = x_packed.device
+    if key not in _BIT_SHIFTS:
+        _BIT_SHIFTS[key] = torch.arange(7, -1, -1, dtype=torch.uint8, device=key)
+    bits = (x_packed.unsqueeze(-1) >> _BIT_SHIFTS[key]) & 1
+    return bits.reshape(x_packed.shape[0], -1)[:, :n_bits].to(dtype)
+
+def as_float_input(x: torch.Tensor, in_dim: int = 3600, dtype=torch.float32) -> torch.Tensor:
+    """Model input from either a float (N, in_dim) batch or a bit-packed uint8 batch."""
+    if x.dtype == torch.uint8 and x.shape[1] != in_dim:
+        return unpack_bits(x, in_dim, dtype)
+    return x.to(dtype)
+
+
 # -----------------------------
 # Model
 # -----------------------------
@@ -237,13 +289,56 @@ class MLP2(nn.Module):
         super().__init__()
         self.fc1 = nn.Linear(in_dim, hidden, bias=True)
         self.fc2 = nn.Linear(hidden, out_dim, bias=True)
+        self.qat = None  # set by enable_qat()
+
+    def enable_qat(self, shift, w1_quant: str = "int8", per_channel: bool = False):
+        """
+        Quantization-aware forward: weights and biases are quantized exactly as
+        quantize_model(shift=shift) quantizes them and the layer-1 accumulators go
+        through requant_relu_int32_to_int8, with straight-through gradients.
+        Logits are then s_w2 * the integer emulator's logits.
+        """
+        self.qat = {"shift": shift, "w1_quant": w1_quant, "per_channel": per_channel}
+
+    def disable_qat(self):
+        self.qat = None
 
     def forward(self, x):
+        if self.qat is not None:
+            return self._forward_qat(x)
         z1 = self.fc1(x)
         a1 = F.relu(z1)
         z2 = self.fc2(a1)
         return z2
 
+    def _forward_qat(self, x):
+        cfg = self.qat
+        w1, b1, w2, b2 = self.fc1.weight, self.fc1.bias, self.fc2.weight, self.fc2.bias
+        w1_q, s_w1 = quantize_weights(w1.detach(), cfg["w1_quant"], cfg["per_channel"])
+        s1 = torch.as_tensor(s_w1, dtype=torch.float64, device=w1.device)
+        b1_q = quantize_bias_to_int32(b1.detach(), s_w1)
+        shift = torch.as_tensor(cfg["shift"], device=w1.device)
+
+        # layer 1: integer accumulator (exact in float32) and its requant, STE to the float path
+        with torch.no_grad():
+            acc_q = F.linear(x, w1_q.to(x.dtype), b1_q.to(x.dtype))
+            a1_q = requant_relu_int32_to_int8(acc_q.to(torch.int32), cfg["shift"]).to(x.dtype)
+        s1f = s1.to(x.dtype)
+        acc = F.linear(x, _ste(w1 / s1f[..., None], w1_q.to(x.dtype)),
+                       _ste(b1 / s1f, b1_q.to(x.dtype)))
+        a1 = _ste(torch.clamp(acc / 2.0 ** shift.to(x.dtype), 0, 127), a1_q)
+
+        # layer 2: W2 folded with the a1_q scale s_w1 * 2^shift, as quantize_model() does
+        a1_scale = s1 * 2.0 ** shift.to(torch.float64)
+        w2_fold = w2 * a1_scale.to(x.dtype)
+        w2_q, s_w2 = quantize_int8_symmetric_per_tensor(w2.detach().to(torch.float64) * a1_scale)
+        b2_q = quantize_bias_to_int32(b2.detach(), s_w2)
+        return F.linear(a1, _ste(w2_fold, w2_q.to(x.dtype) * s_w2), _ste(b2, b2_q.to(x.dtype) * s_w2))
+
+def _ste(x: torch.Tensor, x_q: torch.Tensor) -> torch.Tensor:
+    """Straight-through estimator: forward value x_q, gradient of x."""
+    return x + (x_q - x).detach()
+
 
 # -----------------------------
 # Quantization helpers
@@ -268,24 +363,101 @@ def quantize_int8_symmetric_per_tensor(w_float: torch.Tensor):
         w_q = torch.round(w_float / scale).clamp(-128, 127).to(torch.int8)
         return w_q, float(scale)
 
-def quantize_bias_to_int32(b_float: torch.Tensor, weight_scale: float):
+def quantize_int8_symmetric_per_channel(w_float: torch.Tensor):
+    """
+    Symmetric per-output-channel (per-row) int8 quantization.
+    Returns:
+      w_q: torch.int8
+      scale: (rows,) float64 tensor (all-zero rows get scale 1.0)
+    """
+    with torch.no_grad():
+        max_abs = w_float.abs().amax(dim=1).to(torch.float64)
+        scale = torch.where((max_abs > 0) & torch.isfinite(max_abs), max_abs / 127.0, 1.0)
+        w_q = torch.round(w_float.to(torch.float64) / scale[:, None]).clamp(-128, 127).to(torch.int8)
+        return w_q, scale
+
+# W1 weight precisions; all are stored as int8 values, W1_BITS is the packed field width
+W1_QUANT_MODES = ("int8", "int4", "ternary")
+W1_BITS = {"int8": 8, "int4": 4, "ternary": 2}
+
+def quantize_weights(w_float: torch.Tensor, mode: str = "int8", per_channel: bool = False):
+    """
+    Symmetric weight quantization, values returned as torch.int8:
+      int8    : round(w / s) in -128..127, s = max|w| / 127
+      int4    : round(w / s) in -8..7,     s = max|w| / 7
+      ternary : {-1, 0, +1}, |w| <= 0.7*mean|w| -> 0, s = mean |w| of the rest
+    Returns (w_q, scale); scale is a float, or a (rows,) float64 tensor if per_channel.
+    """
+    if mode == "int8":
+        if per_channel:
+            return quantize_int8_symmetric_per_channel(w_float)
+        return quantize_int8_symmetric_per_tensor(w_float)
+    if mode not in W1_BITS:
+        raise ValueError(f"unknown weight precision {mode!r}; choose from {W1_QUANT_MODES}")
+
+    with torch.no_grad():
+        w = w_float.to(torch.float64)
+        w2d = w.reshape(w.shape[0], -1) if per_channel else w.reshape(1, -1)
+        absw = w2d.abs()
+        if mode == "int4":
+            scale = absw.amax(dim=1) / 7.0
+            scale = torch.where((scale > 0) & torch.isfinite(scale), scale, 1.0)
+            q = torch.round(w2d / scale[:, None]).clamp(-8, 7)
+        else:
+            keep = absw > 0.7 * absw.mean(dim=1, keepdim=True)
+            n_keep = keep.sum(dim=1)
+            scale = torch.where(n_keep > 0, (absw * keep).sum(dim=1) / n_keep.clamp(min=1), 1.0)
+            q = torch.sign(w2d) * keep
+        w_q = q.reshape(w.shape).to(torch.int8)
+        return (w_q, scale) if per_channel else (w_q, float(scale[0]))
+
+class FakeQuantWeight(nn.Module):
+    """
+    Straight-through fake-quant of a weight (torch parametrization): the forward
+    pass sees quantize_weights() dequantized, gradients flow to the float weight.
+    """
+
+    def __init__(self, mode: str = "int4", per_channel: bool = False):
+        super().__init__()
+        self.mode = mode
+        self.per_channel = per_channel
+
+    def forward(self, w: torch.Tensor) -> torch.Tensor:
+        w_q, scale = quantize_weights(w.detach(), self.mode, self.per_channel)
+        if self.per_channel:
+            scale = scale.to(w.dtype).to(w.device)[:, None]
+        return _ste(w, w_q.to(w.dtype) * scale)
+
+def quantize_bias_to_int32(b_float: torch.Tensor, weight_scale):
     """
     Bias int32 in "accumulator domain" for int8 MAC with input scale=1.
     We want: (acc_int32 + b_int32)*weight_scale ~ acc_float + b_float
     => b_int32 ~ b_float / weight_scale
+    weight_scale: float, or a per-row tensor from quantize_int8_symmetric_per_channel.
     """
     with torch.no_grad():
+        if torch.is_tensor(weight_scale):
+            weight_scale = torch.where((weight_scale != 0) & torch.isfinite(weight_scale), weight_scale, 1.0)
+            return torch.round(b_float.to(torch.float64) / weight_scale).clamp(-(2**31), 2**31 - 1).to(torch.int32)
         if weight_scale == 0.0 or not math.isfinite(weight_scale):
             weight_scale = 1.0
         b_q = torch.round(b_float / weight_scale).clamp(-(2**31), 2**31 - 1).to(torch.int32)
         return b_q
 
-def requant_relu_int32_to_int8(a_int32: torch.Tensor, shift: int):
+def requant_relu_int32_to_int8(a_int32: torch.Tensor, shift):
     """
     a_int32 is assumed >=0 (after ReLU).
     Rounding: add (1<<(shift-1)) then >> shift (arithmetic right shift is same as logical for nonneg)
     Clamp to [0,127] then cast to int8.
+    shift: int, or an (H,) int tensor of per-row shifts (broadcast over the last dim).
     """
+    if torch.is_tensor(shift):
+        if (shift < 0).any():
+            raise ValueError("shift must be >= 0")
+        with torch.no_grad():
+            sh = shift.to(a_int32.device, a_int32.dtype)
+            rnd = torch.where(sh > 0, torch.ones_like(sh) << (sh - 1).clamp(min=0), 0)
+            return torch.clamp((a_int32 + rnd) >> sh, 0, 127).to(torch.int8)
     if shift < 0:
         raise ValueError("shift must be >= 0")
 
@@ -305,81 +477,280 @@ def choose_shift(calib_a1_int32: torch.Tensor, shift_min=0, shift_max=20):
       - keeps saturation low
       - keeps outputs reasonably "alive" (not all zeros)
     Returns: best_shift, stats_dict_for_best, all_stats_list
+    (one histogram pass for every shift; see calibration.ShiftHistogram for streaming use)
     """
     # calib_a1_int32: (N, H), int32 >= 0
     assert calib_a1_int32.dtype == torch.int32
-    assert (calib_a1_int32 >= 0).all().item()
-
-    all_stats = []
-    best = None
-
-    for s in range(shift_min, shift_max + 1):
-        a_q = requant_relu_int32_to_int8(calib_a1_int32, s).to(torch.int16)  # safe for stats
-        sat = (a_q == 127).float().mean().item()
-        nz = (a_q > 0).float().mean().item()
-        mean = a_q.float().mean().item()
-        med = a_q.float().median().item()
+    hist = ShiftHistogram(shift_min, shift_max)
+    hist.update(calib_a1_int32.cpu())
+    return hist.choose()
 
-        # objective: lower is better
-        # - heavy penalty for saturation
-        # - penalty if too sparse (dead)
-        # - penalty if mean too tiny (all near 0) or too huge (likely to saturate later)
-        target_mean = 24.0
-        obj = (sat * 10.0) + (max(0.0, 0.20 - nz) * 3.0) + (abs(mean - target_mean) / target_mean)
 
-        stats = {
-            "shift": s,
-            "sat_pct": sat * 100.0,
-            "nonzero_pct": nz * 100.0,
-            "mean": mean,
-            "median": med,
-            "obj": obj,
-        }
-        all_stats.append(stats)
+# -----------------------------
+# Integer inference emulation
+# -----------------------------
 
-        if best is None or obj < best["obj"]:
-            best = stats
+# Backends for the integer emulator; all give identical results.
+#   reference : operands upcast to int32, torch int32 matmul (the golden path)
+#   int_mm    : int8 x int8 -> int32 GEMM via torch._int_mm, operands stay int8
+#   numpy     : int_engine.IntMLP (packed input, exact float32 BLAS accumulation), cached per weight tensors
+INT_BACKENDS = ("reference", "int_mm", "numpy")
 
-    return best["shift"], best, all_stats
+def default_int_backend() -> str:
+    return "int_mm" if hasattr(torch, "_int_mm") else "numpy"
 
+def _int8_mm(a_i8: torch.Tensor, b_i8: torch.Tensor) -> torch.Tensor:
+    """
+    (M,K) int8 @ (K,N) int8 -> (M,N) int32 with torch._int_mm.
+    K and N are zero-padded to multiples of 8 (and M past 16 on CUDA) to meet
+    the kernel's shape rules; padding does not change the sums.
+    """
+    m, k = a_i8.shape
+    n = b_i8.shape[1]
+    pk, pn = -k % 8, -n % 8
+    pm = max(0, 17 - m) if a_i8.is_cuda else 0
+    if pk or pm:
+        a_i8 = F.pad(a_i8, (0, pk, 0, pm))
+    if pk or pn:
+        b_i8 = F.pad(b_i8, (0, pn, 0, pk))
+    return torch._int_mm(a_i8.contiguous(), b_i8.contiguous())[:m, :n]
+
+_NUMPY_ENGINES = {}       # weight-tensor key -> (IntMLP, the tensors it was built from)
+_NUMPY_ENGINE_SLOTS = 4
+
+def _weight_key(t):
+    return None if t is None else (t.data_ptr(), t._version, tuple(t.shape), tuple(t.stride()), t.dtype, str(t.device))
+
+def _numpy_engine(w1_q, b1_q, w2_q=None, b2_q=None, shift=0) -> IntMLP:
+    """
+    IntMLP for these weight tensors, built once and reused until one of them is
+    modified in place (_version) or replaced. The entry holds on to the tensors,
+    so their storage -- and with it data_ptr() -- cannot be recycled while cached.
+    """
+    tensors = (w1_q, b1_q, w2_q, b2_q)
+    shift_key = tuple(torch.as_tensor(shift).view(-1).tolist()) if torch.is_tensor(shift) else int(shift)
+    key = tuple(_weight_key(t) for t in tensors) + (shift_key,)
+    hit = _NUMPY_ENGINES.pop(key, None)
+    if hit is None:
+        shift_np = shift.cpu() if torch.is_tensor(shift) else shift
+        hit = (IntMLP(*(None if t is None else t.cpu() for t in tensors), shift_np), tensors)
+        while len(_NUMPY_ENGINES) >= _NUMPY_ENGINE_SLOTS:
+            _NUMPY_ENGINES.pop(next(iter(_NUMPY_ENGINES)))
+    _NUMPY_ENGINES[key] = hit   # most recently used last
+    return hit[0]
 
-# -----------------------------
-# Integer inference emulation
-# -----------------------------
+@torch.no_grad()
+def int_layer1_acc(x_bin_float: torch.Tensor, w1_q: torch.Tensor, b1_q: torch.Tensor,
+                   backend: str = "reference") -> torch.Tensor:
+    """Layer-1 int32 accumulators x @ W1^T + b1 (before ReLU), (N,64) int32."""
+    if backend == "reference":
+        x_i32 = as_float_input(x_bin_float, w1_q.shape[1], torch.int32)  # values 0/1
+        return x_i32.matmul(w1_q.to(torch.int32).t()) + b1_q.view(1, -1)
+    if backend == "int_mm":
+        x_i8 = as_float_input(x_bin_float, w1_q.shape[1], torch.int8)
+        return _int8_mm(x_i8, w1_q.t()) + b1_q.view(1, -1)
+    if backend == "numpy":
+        acc = _numpy_engine(w1_q, b1_q).layer1(x_bin_float.cpu().numpy())
+        return torch.from_numpy(acc).to(x_bin_float.device)
+    raise ValueError(f"unknown integer backend {backend!r}; choose from {INT_BACKENDS}")
 
 @torch.no_grad()
 def int_infer_batch(x_bin_float: torch.Tensor,
                     w1_q: torch.Tensor, b1_q: torch.Tensor,
                     w2_q: torch.Tensor, b2_q: torch.Tensor,
-                    shift: int):
+                    shift,
+                    backend: str = "reference"):
     """
-    x_bin_float: (N, 3600) float32 in {0,1}. We will convert to int32 0/1.
+    x_bin_float: (N, 3600) float32 in {0,1}, or (N, 450) bit-packed uint8. We will convert to int32 0/1.
+    shift: int, or (64,) int tensor of per-row shifts (quantize_model(per_channel=True))
     w1_q: (64,3600) int8
     b1_q: (64,) int32
     w2_q: (3,64) int8
     b2_q: (3,) int32
+    backend: one of INT_BACKENDS; "reference" is the golden int32 path
     Returns:
       logits_int32: (N,3) int32
       pred: (N,) int64
     """
-    # Explicit signed conversions
-    x_i32 = x_bin_float.to(torch.int32)  # values 0/1
-    w1_i32 = w1_q.to(torch.int32)
-    w2_i32 = w2_q.to(torch.int32)
+    if backend == "numpy":
+        logits, pred = _numpy_engine(w1_q, b1_q, w2_q, b2_q, shift).infer(x_bin_float.cpu().numpy())
+        return torch.from_numpy(logits), torch.from_numpy(pred)
 
     # layer1: (N,64) = (N,3600) @ (3600,64)
     # w1 is (64,3600), so use transpose
-    a1_i32 = x_i32.matmul(w1_i32.t()) + b1_q.view(1, -1)  # int32
+    a1_i32 = int_layer1_acc(x_bin_float, w1_q, b1_q, backend)  # int32
     a1_i32 = torch.clamp(a1_i32, min=0)  # ReLU
 
     a1_q = requant_relu_int32_to_int8(a1_i32, shift)  # int8 in [0,127]
-    a1_q_i32 = a1_q.to(torch.int32)
 
     # layer2: (N,3) = (N,64) @ (64,3)
-    logits_i32 = a1_q_i32.matmul(w2_i32.t()) + b2_q.view(1, -1)
+    if backend == "int_mm":
+        logits_i32 = _int8_mm(a1_q, w2_q.t()) + b2_q.view(1, -1)
+    else:
+        # Explicit signed conversions
+        logits_i32 = a1_q.to(torch.int32).matmul(w2_q.to(torch.int32).t()) + b2_q.view(1, -1)
     pred = torch.argmax(logits_i32, dim=1)
     return logits_i32, pred
 
+def available_int_backends() -> tuple:
+    return tuple(b for b in INT_BACKENDS if b != "int_mm" or hasattr(torch, "_int_mm"))
+
+@torch.no_grad()
+def check_int_backends(backends=None, seed: int = 0, rows: int = 64) -> None:
+    """
+    Bit-exactness of every backend against "reference" on random int8 weights:
+    export-like and full-range weights, float and bit-packed input (incl. all-on
+    and all-off rows), int_layer1_acc, SHIFT 0..20 and per-row shifts, and a W1
+    edited in place between calls (the numpy backend's engine cache must notice).
+    Raises RuntimeError on the first mismatch.
+    """
+    backends = [b for b in (backends or available_int_backends()) if b != "reference"]
+    g = torch.Generator().manual_seed(seed)
+
+    def ints(lo, hi, shape, dtype):
+        return torch.randint(lo, hi, shape, generator=g).to(dtype)
+
+    x = (torch.rand(rows, 3600, generator=g) < torch.rand(rows, 1, generator=g)).float()
+    x[0], x[1] = 1.0, 0.0
+    inputs = {"float": x, "packed": torch.from_numpy(pack_images(x.numpy()))}
+    weight_sets = {
+        "export-like": (torch.clamp(torch.round(torch.randn(64, 3600, generator=g) * 24), -127, 127).to(torch.int8),
+                        ints(-4000, 4000, (64,), torch.int32),
+                        torch.clamp(torch.round(torch.randn(3, 64, generator=g) * 48), -127, 127).to(torch.int8),
+                        ints(-1000, 1000, (3,), torch.int32)),
+        "full-range": (ints(-128, 128, (64, 3600), torch.int8), ints(-2**20, 2**20, (64,), torch.int32),
+                       ints(-128, 128, (3, 64), torch.int8), ints(-2**20, 2**20, (3,), torch.int32)),
+    }
+    shifts = [*range(21), ints(0, 21, (64,), torch.int32)]
+
+    def expect(cond, what):
+        if not cond:
+            raise RuntimeError(f"integer backend mismatch: {what}")
+
+    for wname, (w1, b1, w2, b2) in weight_sets.items():
+        for xname, xin in inputs.items():
+            ref_acc = int_layer1_acc(x, w1, b1, "reference")
+            for be in backends:
+                expect(torch.equal(int_layer1_acc(xin, w1, b1, be), ref_acc), f"{be} int_layer1_acc, {wname} W, {xname} x")
+            for sh in shifts:
+                ref = int_infer_batch(x, w1, b1, w2, b2, sh, backend="reference")
+                desc = "per-row shifts" if torch.is_tensor(sh) else f"SHIFT={sh}"
+                for be in backends:
+                    got = int_infer_batch(xin, w1, b1, w2, b2, sh, backend=be)
+                    expect(all(torch.equal(r, o) for r, o in zip(ref, got)), f"{be}, {wname} W, {xname} x, {desc}")
+
+    w1, b1, w2, b2 = weight_sets["export-like"]
+    for be in backends:
+        int_infer_batch(x, w1, b1, w2, b2, 8, backend=be)
+    w1[:, ::2] = -w1[:, ::2]
+    ref = int_infer_batch(x, w1, b1, w2, b2, 8, backend="reference")
+    for be in backends:
+        got = int_infer_batch(x, w1, b1, w2, b2, 8, backend=be)
+        expect(all(torch.equal(r, o) for r, o in zip(ref, got)), f"{be} after W1 was edited in place")
+
+
+# -----------------------------
+# Post-training quantization
+# -----------------------------
+
+NO_PROFILE = StageProfiler(enabled=False)  # profiler default of quantize_model() / train()
+
+def quantize_model(model: nn.Module, calib_x: torch.Tensor, backend: str = "reference",
+                   shift_min: int = 0, shift_max: int = 20, calib_chunk: int = 8192,
+                   per_channel: bool = False, w1_quant: str = "int8", shift=None,
+                   profiler: StageProfiler | None = None) -> dict:
+    """
+    Per-tensor int8 weights, int32 biases and the requant SHIFT chosen on the
+    layer-1 activations of calib_x (float or bit-packed rows).
+    calib_x is consumed calib_chunk rows at a time into one ShiftHistogram, so it
+    can be a whole (memory-mapped) val set.
+
+    per_channel: W1 gets one scale per row and every hidden unit its own SHIFT
+    ((H,) int32 tensor). a1_q[h] then stands for a1_float[h] / (s_w1[h] * 2^shift[h]),
+    so that factor is folded into the W2 columns before W2 is quantized.
+
+    w1_quant: W1 precision (W1_QUANT_MODES). int4/ternary W1 are still int8 values,
+    so every integer path runs them unchanged; W2 is folded as above.
+
+    shift: use this SHIFT (int, or (H,) with per_channel) instead of calibrating
+    one, e.g. the one a model was trained with by train_qat(); calib_x then only
+    feeds the reported stats and W2 is folded as above, as in MLP2.enable_qat().
+
+    profiler: optional profiling.StageProfiler; the layer-1 calibration pass and
+    the SHIFT choice are the "calibrate" and "choose_shift" stages.
+
+    Returns a dict: w1_q, b1_q, w2_q, b2_q, s_w1, s_w2, shift, best_stats, all_stats.
+    """
+    with torch.no_grad():
+        w1_f = model.fc1.weight.detach().cpu()  # (64,3600)
+        b1_f = model.fc1.bias.detach().cpu()    # (64,)
+        w2_f = model.fc2.weight.detach().cpu()  # (3,64)
+        b2_f = model.fc2.bias.detach().cpu()    # (3,)
+
+    w1_q, s_w1 = quantize_weights(w1_f, w1_quant, per_channel)
+    b1_q = quantize_bias_to_int32(b1_f, s_w1)
+
+    if shift is not None:
+        shift = torch.as_tensor(shift, dtype=torch.int32)
+        if per_channel and shift.dim() == 0:
+            shift = shift.expand(w1_q.shape[0]).clone()
+        shift_min, shift_max = int(shift.min()), int(shift.max())
+    prof = profiler or NO_PROFILE
+    hist = ShiftHistogram(shift_min, shift_max, channels=w1_q.shape[0] if per_channel else 0)
+    with torch.no_grad(), prof.stage("calibrate", rows=calib_x.shape[0], backend=backend):
+        for i in range(0, calib_x.shape[0], calib_chunk):
+            # integer layer1 accumulator for calibration
+            a1_i32 = int_layer1_acc(calib_x[i:i + calib_chunk].cpu(), w1_q, b1_q, backend)  # (n,64) int32
+            hist.update(torch.clamp(a1_i32, min=0))
+
+    fold_w2 = per_channel or w1_quant != "int8" or shift is not None
+    with prof.stage("choose_shift", per_channel=per_channel, fixed=shift is not None):
+        if per_channel:
+            shift, best_stats, all_stats = hist.choose_per_channel(shift)
+            shift = torch.from_numpy(shift)
+        else:
+            shift, best_stats, all_stats = hist.choose(None if shift is None else int(shift))
+    if fold_w2:
+        a1_scale = torch.as_tensor(s_w1 * 2.0 ** shift, dtype=torch.float64)
+        w2_q, s_w2 = quantize_int8_symmetric_per_tensor(w2_f.to(torch.float64) * a1_scale)
+    else:
+        w2_q, s_w2 = quantize_int8_symmetric_per_tensor(w2_f)
+    b2_q = quantize_bias_to_int32(b2_f, s_w2)
+
+    # Check ranges explicitly (debug/assurance)
+    assert w1_q.dtype == torch.int8 and w2_q.dtype == torch.int8
+    assert b1_q.dtype == torch.int32 and b2_q.dtype == torch.int32
+
+    return {"w1_q": w1_q, "b1_q": b1_q, "w2_q": w2_q, "b2_q": b2_q, "s_w1": s_w1, "s_w2": s_w2,
+            "shift": shift, "best_stats": best_stats, "all_stats": all_stats}
+
+
+# -----------------------------
+# Structured pruning
+# -----------------------------
+
+def prune_w1_blocks(model: nn.Module, sparsity: float, row_dim: int = 4, block_cols: int = 8) -> torch.Tensor:
+    """
+    Magnitude pruning of fc1 in the blocks the hardware can skip: row_dim rows
+    (one tensor-memory word per column) x block_cols columns (block_cols=8 is one
+    pixel word). The `sparsity` fraction of blocks with the smallest L1 norm is
+    zeroed in place. Returns the (H, P) 0/1 mask for train(masks=...).
+    """
+    w = model.fc1.weight.data
+    H, P = w.shape
+    if H % row_dim or P % block_cols:
+        raise ValueError(f"fc1 {H}x{P} does not tile into {row_dim}x{block_cols} blocks")
+    if not 0.0 <= sparsity < 1.0:
+        raise ValueError("sparsity must be in [0, 1)")
+
+    norms = w.abs().reshape(H // row_dim, row_dim, P // block_cols, block_cols).sum(dim=(1, 3))
+    keep = torch.ones(norms.numel(), dtype=torch.bool, device=w.device)
+    keep[torch.argsort(norms.flatten())[: int(round(sparsity * norms.numel()))]] = False
+    mask = (keep.reshape(norms.shape)[:, None, :, None]
+            .expand(-1, row_dim, -1, block_cols).reshape(H, P).to(w.dtype))
+    w.mul_(mask)
+    return mask
+
 
 # -----------------------------
 # Training / evaluation
@@ -389,61 +760,189 @@ def int_infer_batch(x_bin_float: torch.Tensor,
 def eval_float(model: nn.Module, x: torch.Tensor, y: torch.Tensor, batch_size: int, device: str):
     model.eval()
     n = x.shape[0]
-    correct = 0
-    total = 0
+    correct = torch.zeros((), dtype=torch.int64, device=device)  # one sync at the end
     for i in range(0, n, batch_size):
-        xb = x[i:i+batch_size].to(device)
+        xb = as_float_input(x[i:i+batch_size].to(device))
         yb = y[i:i+batch_size].to(device)
         logits = model(xb)
         pred = torch.argmax(logits, dim=1)
-        correct += (pred == yb).sum().item()
-        total += yb.numel()
-    return correct / max(1, total)
+        correct += (pred == yb).sum()
+    return correct.item() / max(1, n)
+
+def _epoch_batches(x_train, y_train, batch_size: int, device: str, stream, steps_per_epoch):
+    """CPU (xb, yb) mini-batches for one epoch: a fresh permutation of x_train, or draws from stream."""
+    if stream is not None:
+        for _ in range(steps_per_epoch):
+            xb, yb = next(stream)
+            yield torch.from_numpy(xb), torch.from_numpy(yb)
+        return
+    n = x_train.shape[0]
+    perm = torch.randperm(n, device=device)
+    for i in range(0, n, batch_size):
+        idx = perm[i:i+batch_size].to(x_train.device)
+        yield x_train[idx], y_train[idx]
+
+def _to_device(t: torch.Tensor, device: str) -> torch.Tensor:
+    """Host -> device copy through pinned memory (asynchronous) when the device is a GPU."""
+    if torch.device(device).type == "cuda" and t.device.type == "cpu":
+        return t.pin_memory().to(device, non_blocking=True)
+    return t.to(device)
 
 def train(model: nn.Module, x_train: torch.Tensor, y_train: torch.Tensor,
           x_val: torch.Tensor, y_val: torch.Tensor,
-          epochs: int, lr: float, batch_size: int, device: str, weight_clip: float):
-    model.to(device)
-    opt = torch.optim.Adam(model.parameters(), lr=lr)
-    criterion = nn.CrossEntropyLoss()
-
-    n = x_train.shape[0]
+          epochs: int, lr: float, batch_size: int, device: str, weight_clip: float,
+          stream=None, steps_per_epoch: int | None = None, masks: dict | None = None,
+          qat_w1: nn.Module | None = None, fast: bool = False, compile_model: bool = False,
+          profiler: StageProfiler | None = None):
+    """
+    x_train / x_val may be float (N, 3600) or bit-packed uint8 (N, 450); packed
+    batches are unpacked on the device one mini-batch at a time.
+
+    masks: optional {parameter: 0/1 tensor}, re-applied after every step so
+    pruned weights stay zero while fine-tuning.
+
+    qat_w1: optional FakeQuantWeight; fc1 trains through it (quantization-aware
+    fine-tuning, accuracies printed are for the fake-quantized W1). It is removed
+    again at the end, leaving the float weights.
+
+    stream: optional datagen.StreamingBatches. Each epoch then runs steps_per_epoch
+    fresh generated batches instead of x_train (which may be None), and train_acc
+    is the running accuracy over those batches.
+
+    fast: the (packed) train/val sets are copied to the device once (streamed
+    batches go through pinned memory), clipping and masking are fused foreach
+    ops, loss and accuracy stay on the device until the end of the epoch, and
+    train_acc is the running accuracy of the training forward passes (no extra
+    sweep over x_train).
+    compile_model: run the training forward pass through torch.compile.
+    Every epoch prints its train/eval wall time and training samples/s.
+    profiler: optional profiling.StageProfiler; the work before the first epoch
+    is a "setup" stage, every epoch an "epoch N" stage (with its loss, accuracies
+    and train/eval split as args).
+    """
+    prof = profiler or NO_PROFILE
+    with prof.stage("setup"):  # optimizer construction, device copies, stream start
+        model.to(device)
+        if qat_w1 is not None:
+            parametrize.register_parametrization(model.fc1, "weight", qat_w1)
+        opt = torch.optim.Adam(model.parameters(), lr=lr)
+        criterion = nn.CrossEntropyLoss()
+        forward = torch.compile(model) if compile_model else model
+        weights = [p for p in model.parameters() if p.dim() >= 2]
+        if fast:
+            if x_train is not None:
+                x_train, y_train = _to_device(x_train, device), _to_device(y_train, device)
+            x_val, y_val = _to_device(x_val, device), _to_device(y_val, device)
+            mask_params, mask_values = list(masks or {}), [m.to(device) for m in (masks or {}).values()]
+
+        if stream is not None:
+            if steps_per_epoch is None:
+                raise ValueError("steps_per_epoch is required when streaming")
+            stream.start()
 
     for ep in range(1, epochs + 1):
-        model.train()
-        perm = torch.randperm(n, device=device)
-
-        total_loss = 0.0
-        total = 0
-
-        for i in range(0, n, batch_size):
-            idx = perm[i:i+batch_size]
-            xb = x_train[idx].to(device)
-            yb = y_train[idx].to(device)
-
-            opt.zero_grad(set_to_none=True)
-            logits = model(xb)
-            loss = criterion(logits, yb)
-            loss.backward()
-            opt.step()
-
-            # mild clipping to encourage int8-friendly weights
-            with torch.no_grad():
-                for p in model.parameters():
-                    if p.dim() >= 2:  # weights
-                        p.clamp_(-weight_clip, weight_clip)
-
-            total_loss += loss.item() * yb.numel()
-            total += yb.numel()
-
-        train_acc = eval_float(model, x_train, y_train, batch_size, device)
-        val_acc = eval_float(model, x_val, y_val, batch_size, device)
-        avg_loss = total_loss / max(1, total)
-
-        print(f"Epoch {ep:02d}/{epochs}  loss={avg_loss:.4f}  train_acc={train_acc*100:.2f}%  val_acc={val_acc*100:.2f}%")
-
+        with prof.stage(f"epoch {ep}", epoch=ep) as rec:
+            model.train()
+            if stream is not None:
+                stream.reset_stats()
+
+            total_loss = torch.zeros((), dtype=torch.float64, device=device) if fast else 0.0
+            total = 0
+            correct = torch.zeros((), dtype=torch.int64, device=device) if fast else 0
+            t_epoch = time.perf_counter()
+
+            for xb, yb in _epoch_batches(x_train, y_train, batch_size, device, stream, steps_per_epoch):
+                if fast:
+                    xb = as_float_input(_to_device(xb, device))
+                    yb = _to_device(yb, device)
+                else:
+                    xb = as_float_input(xb.to(device))
+                    yb = yb.to(device)
+
+                opt.zero_grad(set_to_none=True)
+                logits = forward(xb)
+                loss = criterion(logits, yb)
+                loss.backward()
+                opt.step()
+
+                # mild clipping to encourage int8-friendly weights
+                with torch.no_grad():
+                    if fast:
+                        torch._foreach_clamp_min_(weights, -weight_clip)
+                        torch._foreach_clamp_max_(weights, weight_clip)
+                        if mask_params:
+                            torch._foreach_mul_(mask_params, mask_values)
+                    else:
+                        for p in weights:
+                            p.clamp_(-weight_clip, weight_clip)
+                        if masks:
+                            for p, m in masks.items():
+                                p.mul_(m)
+
+                total += yb.numel()
+                if fast:
+                    total_loss += loss.detach() * yb.numel()
+                    correct += (logits.detach().argmax(dim=1) == yb).sum()
+                else:
+                    total_loss += loss.item() * yb.numel()
+                    if stream is not None:
+                        correct += (logits.argmax(dim=1) == yb).sum().item()
+
+            t_train = time.perf_counter() - t_epoch
+            if stream is not None or fast:
+                train_acc = int(correct) / max(1, total)
+            else:
+                train_acc = eval_float(model, x_train, y_train, batch_size, device)
+            val_acc = eval_float(model, x_val, y_val, batch_size, device)
+            avg_loss = float(total_loss) / max(1, total)
+            t_eval = time.perf_counter() - t_epoch - t_train
+            rec.update(loss=avg_loss, train_acc=train_acc, val_acc=val_acc, samples=total,
+                       train_s=t_train, eval_s=t_eval)
+
+            print(f"Epoch {ep:02d}/{epochs}  loss={avg_loss:.4f}  train_acc={train_acc*100:.2f}%  val_acc={val_acc*100:.2f}%  "
+                  f"[{t_train:.2f}s train + {t_eval:.2f}s eval, {total / max(t_train, 1e-9):.0f} samples/s]")
+            if stream is not None:
+                st = stream.stats()
+                print(f"  stream: producer={st['producer_sps']:.0f} samples/s/worker "
+                      f"(x{st['workers']} = {st['producer_capacity_sps']:.0f})  "
+                      f"consumer={st['consumer_sps']:.0f} samples/s  waited={st['wait_s']:.2f}s of {st['wall_s']:.2f}s")
+
+    if qat_w1 is not None:
+        parametrize.remove_parametrizations(model.fc1, "weight", leave_parametrized=False)
     return model
 
+def train_qat(model: MLP2, x_train, y_train, x_val, y_val, calib_x: torch.Tensor, shift=None,
+              w1_quant: str = "int8", per_channel: bool = False, backend: str = "reference",
+              shift_min: int = 0, shift_max: int = 20, calib_chunk: int = 8192, **train_kwargs):
+    """
+    Quantization-aware fine-tuning through MLP2.enable_qat(): train() (train_kwargs)
+    with the forward pass mirroring the integer path. shift=None calibrates SHIFT
+    on calib_x first, as quantize_model() would; it is held fixed while training.
+    Returns (model, shift); quantize_model(..., shift=shift) then exports exactly
+    the integer model that was trained.
+    """
+    if shift is None:
+        shift = quantize_model(model, calib_x, backend, shift_min, shift_max, calib_chunk,
+                               per_channel=per_channel, w1_quant=w1_quant)["shift"]
+    elif per_channel and not torch.is_tensor(shift):
+        shift = torch.full((model.fc1.out_features,), int(shift), dtype=torch.int32)
+    model.enable_qat(shift, w1_quant, per_channel)
+    try:
+        model = train(model, x_train, y_train, x_val, y_val, **train_kwargs)
+    finally:
+        model.disable_qat()
+    return model, shift
+
+def finetune_w1_quant(model: MLP2, x_train, y_train, x_val, y_val, w1_quant: str,
+                      per_channel: bool = False, **train_kwargs) -> MLP2:
+    """
+    Fake-quant fine-tuning of a sub-8-bit W1 (--w1_quant int4/ternary without
+    --qat): train() (train_kwargs) with W1 seen through FakeQuantWeight.
+    """
+    print(f"QAT: {train_kwargs.get('epochs')} epochs with fake-quant {w1_quant} W1")
+    return train(model, x_train, y_train, x_val, y_val,
+                 qat_w1=FakeQuantWeight(w1_quant, per_channel), **train_kwargs)
+
 
 # -----------------------------
 # Export helpers
@@ -453,12 +952,7 @@ def save_matrix_txt(path: str, arr: np.ndarray):
     """
     Saves 2D array as text, one row per line, space-separated integers.
     """
-    with open(path, "w", encoding="utf-8") as f:
-        if arr.ndim == 1:
-            f.write(" ".join(str(int(x)) for x in arr.tolist()) + "\n")
-        else:
-            for r in range(arr.shape[0]):
-                f.write(" ".join(str(int(x)) for x in arr[r].tolist()) + "\n")
+    write_ints_txt(path, arr)
 
 def write_report(path: str, lines: list[str]):
     with open(path, "w", encoding="utf-8") as f:
@@ -466,12 +960,115 @@ def write_report(path: str, lines: list[str]):
             f.write(ln.rstrip() + "\n")
 
 
+# -----------------------------
+# Dataset construction
+# -----------------------------
+
+def _empty_packed():
+    return np.empty((0, 450), dtype=np.uint8), np.empty(0, dtype=np.int64)
+
+def generate_datasets(args):
+    """
+    Train + val sets for the --datagen mode, always bit-packed.
+    train_per_class=0 (--stream) skips the train set: Xtr/ytr come back empty
+    ((0, 450) uint8, (0,) int64) and nothing is generated for them.
+    Returns: Xtr (N,450) uint8, ytr (N,) int64, Xva, yva
+    """
+    no_train = args.train_per_class == 0
+    np_rng = np.random.default_rng(args.seed)
+    if args.datagen == "sharded":
+        train_seed, val_seed = np.random.SeedSequence(args.seed).spawn(2)
+        Xtr_np, ytr_np = _empty_packed() if no_train else make_dataset_sharded(
+            n_per_class=args.train_per_class,
+            noise_flip=args.noise_flip,
+            drop_on=args.drop_on,
+            seed=train_seed,
+            shards=args.gen_shards,
+            workers=args.gen_workers,
+            packed=True
+        )
+        Xva_np, yva_np = make_dataset_sharded(
+            n_per_class=args.val_per_class,
+            noise_flip=args.noise_flip,
+            drop_on=args.drop_on,
+            seed=val_seed,
+            shards=args.gen_shards,
+            workers=args.gen_workers,
+            packed=True
+        )
+    elif args.datagen == "batched":
+        Xtr_np, ytr_np = _empty_packed() if no_train else make_dataset_batched(
+            n_per_class=args.train_per_class,
+            noise_flip=args.noise_flip,
+            drop_on=args.drop_on,
+            rng=np_rng,
+            packed=True
+        )
+        Xva_np, yva_np = make_dataset_batched(
+            n_per_class=args.val_per_class,
+            noise_flip=args.noise_flip,
+            drop_on=args.drop_on,
+            rng=np_rng,
+            packed=True
+        )
+    else:
+        Xtr_np, ytr_np = make_dataset(  # n_per_class=0 -> empty, nothing drawn
+            n_per_class=args.train_per_class,
+            noise_flip=args.noise_flip,
+            drop_on=args.drop_on,
+            rng=np_rng
+        )
+        Xva_np, yva_np = make_dataset(
+            n_per_class=args.val_per_class,
+            noise_flip=args.noise_flip,
+            drop_on=args.drop_on,
+            rng=np_rng
+        )
+        Xtr_np, Xva_np = pack_images(Xtr_np), pack_images(Xva_np)
+    return Xtr_np, ytr_np, Xva_np, yva_np
+
+def load_datasets(args):
+    """
+    generate_datasets() behind the on-disk cache in args.cache_dir (keyed by every
+    argument that affects the data plus the generator source). Cache hits are
+    memory-mapped and skip generation entirely.
+    """
+    if not args.cache_dir:
+        return generate_datasets(args)
+
+    params = {
+        "seed": args.seed,
+        "train_per_class": args.train_per_class,
+        "val_per_class": args.val_per_class,
+        "noise_flip": args.noise_flip,
+        "drop_on": args.drop_on,
+        "datagen": args.datagen,
+        "gen_shards": args.gen_shards if args.datagen == "sharded" else None,
+        "packed": True,
+    }
+    if args.datagen == "per_sample":
+        fingerprint = source_fingerprint(make_dataset, gen_circle, gen_square, gen_line,
+                                         _add_dropout, _add_salt_pepper, datagen.pack_images)
+    else:
+        fingerprint = generator_fingerprint(sharded=args.datagen == "sharded")
+
+    def generate():
+        Xtr, ytr, Xva, yva = generate_datasets(args)
+        return {"Xtr": Xtr, "ytr": ytr, "Xva": Xva, "yva": yva}
+
+    arrays, hit = cached_datasets(args.cache_dir, params, fingerprint, generate, kind=args.datagen)
+    print(f"Dataset cache {'hit' if hit else 'miss'}: {os.path.abspath(args.cache_dir)}")
+    return arrays["Xtr"], arrays["ytr"], arrays["Xva"], arrays["yva"]
+
+
 # -----------------------------
 # Main
 # -----------------------------
 
-def main():
-    ap = argparse.ArgumentParser(description="Train + quantize 2-layer MLP for 60x60 binary images (circle/square/line).")
+def build_arg_parser(add_help: bool = True) -> argparse.ArgumentParser:
+    """CLI of main(); also the parent parser of sweep.py."""
+    ap = argparse.ArgumentParser(description="Train + quantize 2-layer MLP for 60x60 binary images (circle/square/line).",
+                                 add_help=add_help)
     ap.add_argument("--seed", type=int, default=123)
     ap.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
     ap.add_argument("--epochs", type=int, default=20)
@@ -482,33 +1079,88 @@ def main():
     ap.add_argument("--val_per_class", type=int, default=600)
     ap.add_argument("--noise_flip", type=float, default=0.012, help="salt/pepper flip probability")
     ap.add_argument("--drop_on", type=float, default=0.02, help="dropout of 'on' pixels probability")
+    ap.add_argument("--datagen", type=str, default="batched", choices=["batched", "sharded", "per_sample"],
+                    help="batched NumPy generators (datagen.py), sharded multiprocess generation, or the original per-sample loop")
+    ap.add_argument("--gen_shards", type=int, default=DEFAULT_SHARDS, help="shard count for --datagen sharded (fixes the output)")
+    ap.add_argument("--gen_workers", type=int, default=None, help="process count for --datagen sharded (default: all cores)")
+    ap.add_argument("--cache_dir", type=str, default="dataset_cache", help="memory-mapped dataset cache ('' disables)")
+    ap.add_argument("--stream", action="store_true",
+                    help="train on fresh batches from background generators instead of a fixed train set")
+    ap.add_argument("--stream_workers", type=int, default=2)
+    ap.add_argument("--stream_mode", type=str, default="thread", choices=["thread", "process"])
+    ap.add_argument("--steps_per_epoch", type=int, default=None,
+                    help="batches per epoch with --stream (default: 3*train_per_class/batch_size)")
     ap.add_argument("--weight_clip", type=float, default=2.0)
+    ap.add_argument("--fast_train", action="store_true",
+                    help="data preloaded on the device, fused clipping, train acc from the training passes")
+    ap.add_argument("--compile", action="store_true", help="torch.compile the training forward pass")
+    ap.add_argument("--prune_sparsity", type=float, default=0.0,
+                    help="fraction of W1 blocks (4 rows x --prune_block_cols) to zero after training (0 = off)")
+    ap.add_argument("--prune_block_cols", type=int, default=8, help="pruning block width (8 = one pixel word)")
+    ap.add_argument("--finetune_epochs", type=int, default=3, help="epochs of masked fine-tuning after pruning")
+    ap.add_argument("--finetune_lr", type=float, default=3e-4)
     ap.add_argument("--shift_min", type=int, default=0)
     ap.add_argument("--shift_max", type=int, default=20)
+    ap.add_argument("--calib_rows", type=int, default=1024, help="val rows for SHIFT calibration (0 = the whole val set)")
+    ap.add_argument("--calib_chunk", type=int, default=8192, help="rows per calibration chunk")
+    ap.add_argument("--per_channel", action="store_true",
+                    help="per-row W1 scales and per-row requant shifts (adds a shift table to weights.memh)")
+    ap.add_argument("--w1_quant", type=str, default="int8", choices=W1_QUANT_MODES,
+                    help="W1 weight precision (int4/ternary are also written bit-packed)")
+    ap.add_argument("--qat_epochs", type=int, default=2,
+                    help="fake-quant fine-tuning epochs for --w1_quant int4/ternary or --qat (0 = PTQ only)")
+    ap.add_argument("--qat", action="store_true",
+                    help="QAT that mirrors the whole integer path (weights, biases, SHIFT requant); any --w1_quant")
+    ap.add_argument("--qat_shift", type=int, default=None,
+                    help="SHIFT to train and export with under --qat (default: calibrated before QAT)")
+    ap.add_argument("--eval_chunk", type=int, default=65536, help="rows per chunk of the streamed val evaluation")
     ap.add_argument("--export_dir", type=str, default="export_mlp_int")
-    args = ap.parse_args()
+    ap.add_argument("--no_txt", action="store_true",
+                    help="skip the W1_int8.txt/... text dumps (weights.memh/.bin and SHIFT.txt are always written)")
+    ap.add_argument("--int_backend", type=str, default=default_int_backend(), choices=INT_BACKENDS,
+                    help="integer emulator GEMM backend (reference = int32 golden path)")
+    ap.add_argument("--profile", type=str, default="",
+                    help="write a Chrome trace (JSON) of per-stage/per-epoch wall, CPU, peak RSS and "
+                         "tracemalloc peaks to this path and print a stage table")
+    ap.add_argument("--torch_profile", type=str, default="",
+                    help="comma-separated stages to also run under torch.profiler, e.g. "
+                         "'train,int_emulation' (data, train, prune, finetune, qat, epoch N, eval_float, "
+                         "quantize, calibrate, choose_shift, int_emulation, precision_table, export)")
+    return ap
+
+def main():
+    args = build_arg_parser().parse_args()
 
     # Repro
-    np_rng = np.random.default_rng(args.seed)
     torch.manual_seed(args.seed)
 
     os.makedirs(args.export_dir, exist_ok=True)
 
-    # Data
-    Xtr_np, ytr_np = make_dataset(
-        n_per_class=args.train_per_class,
-        noise_flip=args.noise_flip,
-        drop_on=args.drop_on,
-        rng=np_rng
-    )
-    Xva_np, yva_np = make_dataset(
-        n_per_class=args.val_per_class,
-        noise_flip=args.noise_flip,
-        drop_on=args.drop_on,
-        rng=np_rng
-    )
+    # --profile / --torch_profile: stages below are timed (train() adds one per epoch)
+    prof = StageProfiler(enabled=bool(args.profile or args.torch_profile),
+                         torch_stages=[t.strip() for t in args.torch_profile.split(",") if t.strip()],
+                         trace_path=args.profile)
+
+    # Data (packed uint8, memory-mapped from the dataset cache when possible)
+    stream = None
+    steps_per_epoch = None
+    with prof.stage("data", datagen=args.datagen, stream=args.stream):
+        if args.stream:
+            # only the val set is materialized; train batches come from the producers
+            Xtr_np, ytr_np, Xva_np, yva_np = load_datasets(argparse.Namespace(**{**vars(args), "train_per_class": 0}))
+            stream = StreamingBatches(
+                batch_size=args.batch_size,
+                noise_flip=args.noise_flip,
+                drop_on=args.drop_on,
+                seed=np.random.SeedSequence(args.seed).spawn(3)[2],
+                workers=args.stream_workers,
+                mode=args.stream_mode
+            )
+            steps_per_epoch = args.steps_per_epoch or max(1, 3 * args.train_per_class // args.batch_size)
+        else:
+            Xtr_np, ytr_np, Xva_np, yva_np = load_datasets(args)
 
-    x_train = torch.from_numpy(Xtr_np)  # float32 0/1
+    x_train = torch.from_numpy(Xtr_np)  # uint8, bit-packed (N, 450)
     y_train = torch.from_numpy(ytr_np)  # int64
     x_val = torch.from_numpy(Xva_np)
     y_val = torch.from_numpy(yva_np)
@@ -516,85 +1168,160 @@ def main():
     # Model
     model = MLP2(in_dim=3600, hidden=args.hidden, out_dim=3)
 
+    # Use a subset of val as calibration set (or all, streamed in chunks)
+    calib_x = x_val[: args.calib_rows or x_val.shape[0]]
+
     # Train
-    model = train(
-        model, x_train, y_train, x_val, y_val,
-        epochs=args.epochs,
-        lr=args.lr,
+    mask = None
+    ptq_model = None
+    qat_shift = None
+    train_kw = dict(
         batch_size=args.batch_size,
         device=args.device,
-        weight_clip=args.weight_clip
+        weight_clip=args.weight_clip,
+        stream=stream,
+        steps_per_epoch=steps_per_epoch,
+        fast=args.fast_train,
+        compile_model=args.compile,
+        profiler=prof
     )
-
-    float_val_acc = eval_float(model, x_val, y_val, args.batch_size, args.device)
+    try:
+        with prof.stage("train", epochs=args.epochs):
+            model = train(model, x_train, y_train, x_val, y_val, epochs=args.epochs, lr=args.lr, **train_kw)
+        if args.prune_sparsity > 0:
+            with prof.stage("prune", sparsity=args.prune_sparsity):
+                mask = prune_w1_blocks(model, args.prune_sparsity, block_cols=args.prune_block_cols)
+                pruned_acc = eval_float(model, x_val, y_val, args.batch_size, args.device)
+            print(f"Pruned {args.prune_sparsity*100:.1f}% of W1 4x{args.prune_block_cols} blocks "
+                  f"(val acc before fine-tune {pruned_acc*100:.2f}%)")
+            with prof.stage("finetune", epochs=args.finetune_epochs):
+                model = train(model, x_train, y_train, x_val, y_val, epochs=args.finetune_epochs,
+                              lr=args.finetune_lr, masks={model.fc1.weight: mask}, **train_kw)
+        if args.qat and args.qat_epochs > 0:
+            ptq_model = copy.deepcopy(model)  # pre-QAT float weights for the precision table
+            with prof.stage("qat", epochs=args.qat_epochs, w1_quant=args.w1_quant):
+                model, qat_shift = train_qat(
+                    model, x_train, y_train, x_val, y_val, calib_x,
+                    shift=args.qat_shift,
+                    w1_quant=args.w1_quant,
+                    per_channel=args.per_channel,
+                    backend=args.int_backend,
+                    shift_min=args.shift_min,
+                    shift_max=args.shift_max,
+                    calib_chunk=args.calib_chunk,
+                    epochs=args.qat_epochs,
+                    lr=args.finetune_lr,
+                    masks={model.fc1.weight: mask} if mask is not None else None,
+                    **train_kw
+                )
+        elif args.w1_quant != "int8" and args.qat_epochs > 0:
+            ptq_model = copy.deepcopy(model)  # pre-QAT float weights for the precision table
+            with prof.stage("qat", epochs=args.qat_epochs, w1_quant=args.w1_quant):
+                model = finetune_w1_quant(model, x_train, y_train, x_val, y_val, args.w1_quant, args.per_channel,
+                                          epochs=args.qat_epochs, lr=args.finetune_lr,
+                                          masks={model.fc1.weight: mask} if mask is not None else None, **train_kw)
+    finally:
+        if stream is not None:
+            stream.close()
+
+    with prof.stage("eval_float", rows=x_val.shape[0]):
+        float_val_acc = eval_float(model, x_val, y_val, args.batch_size, args.device)
     print(f"Float model val accuracy: {float_val_acc*100:.2f}%")
 
     # -----------------------------
-    # Post-training quantization
+    # Post-training quantization + SHIFT from calibration activations
     # -----------------------------
-    with torch.no_grad():
-        w1_f = model.fc1.weight.detach().cpu()  # (64,3600)
-        b1_f = model.fc1.bias.detach().cpu()    # (64,)
-        w2_f = model.fc2.weight.detach().cpu()  # (3,64)
-        b2_f = model.fc2.bias.detach().cpu()    # (3,)
-
-    w1_q, s_w1 = quantize_int8_symmetric_per_tensor(w1_f)
-    w2_q, s_w2 = quantize_int8_symmetric_per_tensor(w2_f)
-
-    b1_q = quantize_bias_to_int32(b1_f, s_w1)
-    b2_q = quantize_bias_to_int32(b2_f, s_w2)
-
-    # Check ranges explicitly (debug/assurance)
-    assert w1_q.dtype == torch.int8 and w2_q.dtype == torch.int8
-    assert b1_q.dtype == torch.int32 and b2_q.dtype == torch.int32
-
-    # -----------------------------
-    # Choose SHIFT using calibration activations
-    # -----------------------------
-    # Use a subset of val as calibration set (or all)
-    calib_x = x_val[: min(1024, x_val.shape[0])].cpu()
-
-    with torch.no_grad():
-        # integer layer1 accumulator for calibration
-        x_i32 = calib_x.to(torch.int32)        # 0/1
-        w1_i32 = w1_q.to(torch.int32)
-        a1_i32 = x_i32.matmul(w1_i32.t()) + b1_q.view(1, -1)  # (N,64) int32
-        a1_i32 = torch.clamp(a1_i32, min=0)
-
-    best_shift, best_stats, all_stats = choose_shift(a1_i32, args.shift_min, args.shift_max)
-
-    print("SHIFT search results (top 5 by objective):")
-    all_stats_sorted = sorted(all_stats, key=lambda d: d["obj"])
-    for s in all_stats_sorted[:5]:
-        print(f"  SHIFT={s['shift']:2d}  sat={s['sat_pct']:.2f}%  nonzero={s['nonzero_pct']:.2f}%  mean={s['mean']:.2f}  median={s['median']:.2f}")
+    with prof.stage("quantize", per_channel=args.per_channel, w1_quant=args.w1_quant):
+        q = quantize_model(model, calib_x, args.int_backend, args.shift_min, args.shift_max, args.calib_chunk,
+                           per_channel=args.per_channel, w1_quant=args.w1_quant, shift=qat_shift,
+                           profiler=prof)
+    if qat_shift is None:
+        print(f"Calibrated SHIFT on {calib_x.shape[0]} val rows ({calib_x.shape[0] * args.hidden} activations)")
+    else:
+        print(f"SHIFT fixed by QAT; stats on {calib_x.shape[0]} val rows")
+    w1_q, b1_q, w2_q, b2_q = q["w1_q"], q["b1_q"], q["w2_q"], q["b2_q"]
+    s_w1, s_w2 = q["s_w1"], q["s_w2"]
+    best_shift, best_stats, all_stats = q["shift"], q["best_stats"], q["all_stats"]
 
     SHIFT = best_shift
-    print(f"Chosen SHIFT = {SHIFT}  (sat={best_stats['sat_pct']:.2f}%, nonzero={best_stats['nonzero_pct']:.2f}%, mean={best_stats['mean']:.2f}, median={best_stats['median']:.2f})")
+    if args.per_channel:
+        # all_stats: each row's stats at its own shift
+        rows_per_shift = {s: c for s, c in enumerate(torch.bincount(SHIFT.long()).tolist()) if c}
+        print(f"Per-row SHIFT: min={int(SHIFT.min())} max={int(SHIFT.max())}  rows per shift {rows_per_shift}")
+        print(f"W1 per-row scales: {float(s_w1.min()):.4g} .. {float(s_w1.max()):.4g}")
+        shift_desc = "per-row"
+    else:
+        if qat_shift is None:
+            print("SHIFT search results (top 5 by objective):")
+            all_stats_sorted = sorted(all_stats, key=lambda d: d["obj"])
+            for s in all_stats_sorted[:5]:
+                print(f"  SHIFT={s['shift']:2d}  sat={s['sat_pct']:.2f}%  nonzero={s['nonzero_pct']:.2f}%  mean={s['mean']:.2f}  median={s['median']:.2f}")
+        shift_desc = str(SHIFT)
+
+    print(f"Chosen SHIFT = {shift_desc}  (sat={best_stats['sat_pct']:.2f}%, nonzero={best_stats['nonzero_pct']:.2f}%, mean={best_stats['mean']:.2f}, median={best_stats['median']:.2f})")
 
     # -----------------------------
     # Integer-only inference check
     # -----------------------------
-    with torch.no_grad():
-        # float predictions (original float model)
+    # streamed over the val set in --eval_chunk rows (see evaluate.py)
+    def val_chunks():
+        return array_chunks(Xva_np, yva_np, args.eval_chunk)
+
+    @torch.no_grad()
+    def float_logits(X):
+        # float predictions (original float model, or its QAT forward)
         model.eval()
-        logits_f = model(x_val.to(args.device)).cpu()
-        pred_f = torch.argmax(logits_f, dim=1)
+        return model(unpack_bits(torch.from_numpy(X).to(args.device))).cpu().numpy()
 
+    def int_logits_fn(q_w1, q_b1, q_w2, q_b2, shift):
         # integer predictions (emulation)
-        logits_i32, pred_i = int_infer_batch(
-            x_val.cpu(),
-            w1_q, b1_q,
-            w2_q, b2_q,
-            SHIFT
-        )
+        return lambda X: int_infer_batch(torch.from_numpy(X), q_w1, q_b1, q_w2, q_b2, shift,
+                                         backend=args.int_backend)[0].numpy()
+
+    int_logits = int_logits_fn(w1_q, b1_q, w2_q, b2_q, SHIFT)
+    with prof.stage("int_emulation", rows=len(yva_np), backend=args.int_backend):
+        ev = evaluate(val_chunks(), float_logits, int_logits)
+        match, int_acc, float_acc = ev.match_rate, ev.int_acc, ev.float_acc
 
-        match = (pred_f == pred_i).float().mean().item()
-        int_acc = (pred_i == y_val).float().mean().item()
-        float_acc = (pred_f == y_val).float().mean().item()
+        # the QAT forward pass should reproduce the integer path (up to exact logit ties)
+        qat_match = None
+        if qat_shift is not None:
+            model.enable_qat(qat_shift, args.w1_quant, args.per_channel)
+            qat_match = evaluate(val_chunks(), float_logits, int_logits).match_rate
+            model.disable_qat()
 
     print(f"Argmax match rate (float vs int emu): {match*100:.2f}%")
+    if qat_match is not None:
+        print(f"Argmax match rate (QAT forward vs int emu): {qat_match*100:.2f}%")
     print(f"Val acc: float={float_acc*100:.2f}%  int_emu={int_acc*100:.2f}%")
 
+    # -----------------------------
+    # W1 precision table: PTQ of the float model at every precision (+ the QAT result)
+    # -----------------------------
+    precision_rows = []
+    if args.w1_quant != "int8":
+        import tc_model
+
+        base = ptq_model if ptq_model is not None else model
+        trials = [(m, "PTQ", base) for m in W1_QUANT_MODES]
+        if ptq_model is not None:
+            trials.append((args.w1_quant, "QAT", None))
+        with prof.stage("precision_table", trials=len(trials)):
+            for mode, how, m in trials:
+                if m is None:
+                    acc = int_acc
+                else:
+                    qm = quantize_model(m, calib_x, args.int_backend, args.shift_min, args.shift_max,
+                                        args.calib_chunk, per_channel=args.per_channel, w1_quant=mode)
+                    acc = evaluate(val_chunks(), int_fn=int_logits_fn(qm["w1_q"], qm["b1_q"], qm["w2_q"], qm["b2_q"],
+                                                                      qm["shift"])).int_acc
+                proj = tc_model.precision_projection(W1_BITS[mode], hidden=args.hidden)
+                mem = proj["mem_words"] + (args.hidden if args.per_channel else 0)
+                precision_rows.append(f"  {mode:8s} {how:4s} int_acc={acc*100:6.2f}%  mem_words={mem:6d}  "
+                                      f"mac_bound={proj['mac_bound_cycles']:7d}  feed_bound={proj['feed_bound_cycles']:7d} cycles")
+        print("W1 precision (batch of 4, projected cycles):")
+        print("\n".join(precision_rows))
+
     # -----------------------------
     # Export
     # -----------------------------
@@ -605,53 +1332,114 @@ def main():
     b1_np = b1_q.numpy().astype(np.int32)        # (64,)
     W2_np = w2_q.numpy().astype(np.int8)         # (3,64)
     b2_np = b2_q.numpy().astype(np.int32)        # (3,)
-
-    # Save matrices as text
-    save_matrix_txt(os.path.join(export_dir, "W1_int8.txt"), W1_np)
-    save_matrix_txt(os.path.join(export_dir, "b1_int32.txt"), b1_np)
-    save_matrix_txt(os.path.join(export_dir, "W2_int8.txt"), W2_np)
-    save_matrix_txt(os.path.join(export_dir, "b2_int32.txt"), b2_np)
-    write_report(os.path.join(export_dir, "SHIFT.txt"), [str(int(SHIFT))])
-
-    # Report (includes scales so you know what float-domain these integers correspond to)
-    report_lines = []
-    report_lines.append("=== 2-layer MLP export report ===")
-    report_lines.append(f"Class mapping: 0=circle, 1=square, 2=line")
-    report_lines.append("")
-    report_lines.append("Shapes:")
-    report_lines.append(f"  W1: {tuple(W1_np.shape)} int8")
-    report_lines.append(f"  b1: {tuple(b1_np.shape)} int32")
-    report_lines.append(f"  W2: {tuple(W2_np.shape)} int8")
-    report_lines.append(f"  b2: {tuple(b2_np.shape)} int32")
-    report_lines.append("")
-    report_lines.append("Quantization:")
-    report_lines.append(f"  W1 symmetric per-tensor scale s_w1 = {s_w1:.8g}  (w_float ~= w_int8 * s_w1)")
-    report_lines.append(f"  W2 symmetric per-tensor scale s_w2 = {s_w2:.8g}  (w_float ~= w_int8 * s_w2)")
-    report_lines.append(f"  b1_int32 = round(b1_float / s_w1)")
-    report_lines.append(f"  b2_int32 = round(b2_float / s_w2)")
-    report_lines.append("")
-    report_lines.append("Activation requant (after ReLU):")
-    report_lines.append(f"  SHIFT = {SHIFT}")
-    report_lines.append(f"  a1_q = clamp( ((a1_int32 + (1<<(SHIFT-1))) >> SHIFT), 0..127 )  [SHIFT=0 => no rounding/shift]")
-    report_lines.append(f"  Chosen SHIFT stats: sat={best_stats['sat_pct']:.3f}%  nonzero={best_stats['nonzero_pct']:.3f}%  mean={best_stats['mean']:.3f}  median={best_stats['median']:.3f}")
-    report_lines.append("")
-    report_lines.append("Accuracy / consistency:")
-    report_lines.append(f"  Float val accuracy: {float_val_acc*100:.2f}%")
-    report_lines.append(f"  Integer emu val accuracy: {int_acc*100:.2f}%")
-    report_lines.append(f"  Argmax match (float preds vs int emu preds): {match*100:.2f}%")
-    report_lines.append("")
-    report_lines.append("Notes / assumptions (important for hardware matching):")
-    report_lines.append("  - Input x is treated as int32 0/1 (no input scaling).")
-    report_lines.append("  - MAC is emulated as int8->int32 accumulation using signed weights; input is nonnegative.")
-    report_lines.append("  - Biases are exported in the same int32 accumulator domain used by the MAC sums.")
-    report_lines.append("  - Layer2 uses a1_q (0..127) directly as int8 activations; its scale is implicit via SHIFT.")
-    report_lines.append("")
-    report_lines.append(f"Files written to: {os.path.abspath(export_dir)}")
-    report_lines.append("  - W1_int8.txt, b1_int32.txt, W2_int8.txt, b2_int32.txt, SHIFT.txt, report.txt")
-
-    write_report(os.path.join(export_dir, "report.txt"), report_lines)
-
-    print(f"Export complete -> {os.path.abspath(export_dir)}")
+    shift_np = SHIFT.numpy().astype(np.int32) if args.per_channel else None  # (64,) per-row table
+
+    # Tensor-memory image straight from the quantized arrays (same packer as weight_to_memh.py)
+    with prof.stage("export", txt=not args.no_txt):
+        t_export = time.perf_counter()
+        files = ["weights.memh", "weights.bin"]
+        words = pack_weights(W1_np, b1_np, W2_np, b2_np, shift_np)
+        write_memh(os.path.join(export_dir, "weights.memh"), words)
+        write_bin(os.path.join(export_dir, "weights.bin"), words)
+        if args.prune_sparsity > 0:
+            sparse_words, _ = pack_sparse_weights(W1_np, b1_np, W2_np, b2_np, shift_np)
+            write_memh(os.path.join(export_dir, "weights_sparse.memh"), sparse_words)
+            write_bin(os.path.join(export_dir, "weights_sparse.bin"), sparse_words)
+            files += ["weights_sparse.memh", "weights_sparse.bin"]
+        if args.w1_quant != "int8":
+            # same values bit-packed at the W1 precision (weights.memh above still runs on the int8 RTL)
+            packed_words = pack_weights(W1_np, b1_np, W2_np, b2_np, shift_np, w1_bits=W1_BITS[args.w1_quant])
+            write_memh(os.path.join(export_dir, f"weights_{args.w1_quant}.memh"), packed_words)
+            write_bin(os.path.join(export_dir, f"weights_{args.w1_quant}.bin"), packed_words)
+            files += [f"weights_{args.w1_quant}.memh", f"weights_{args.w1_quant}.bin"]
+        if args.per_channel:
+            write_ints_txt(os.path.join(export_dir, "SHIFT.txt"), shift_np)
+        else:
+            write_report(os.path.join(export_dir, "SHIFT.txt"), [str(int(SHIFT))])
+        files.append("SHIFT.txt")
+
+        # Save matrices as text (int_engine.load_txt_weights / weight_to_memh.py inputs)
+        if not args.no_txt:
+            save_matrix_txt(os.path.join(export_dir, "W1_int8.txt"), W1_np)
+            save_matrix_txt(os.path.join(export_dir, "b1_int32.txt"), b1_np)
+            save_matrix_txt(os.path.join(export_dir, "W2_int8.txt"), W2_np)
+            save_matrix_txt(os.path.join(export_dir, "b2_int32.txt"), b2_np)
+            files += ["W1_int8.txt", "b1_int32.txt", "W2_int8.txt", "b2_int32.txt"]
+        t_export = time.perf_counter() - t_export
+
+        # Report (includes scales so you know what float-domain these integers correspond to)
+        report_lines = []
+        report_lines.append("=== 2-layer MLP export report ===")
+        report_lines.append(f"Class mapping: 0=circle, 1=square, 2=line")
+        report_lines.append("")
+        report_lines.append("Shapes:")
+        report_lines.append(f"  W1: {tuple(W1_np.shape)} int8")
+        report_lines.append(f"  b1: {tuple(b1_np.shape)} int32")
+        report_lines.append(f"  W2: {tuple(W2_np.shape)} int8")
+        report_lines.append(f"  b2: {tuple(b2_np.shape)} int32")
+        if W1_np.shape[0] % 4 == 0:
+            zero_words = int((W1_np.reshape(-1, 4, W1_np.shape[1]) == 0).all(axis=1).sum())
+            report_lines.append(f"  W1 all-zero 4-row words: {zero_words} / {W1_np.size // 4}"
+                                f"  (pruning: sparsity={args.prune_sparsity}, block=4x{args.prune_block_cols})")
+        report_lines.append("")
+        report_lines.append("Quantization:")
+        if args.w1_quant != "int8":
+            bits = W1_BITS[args.w1_quant]
+            report_lines.append(f"  W1 precision: {args.w1_quant} ({bits}-bit fields, {8 // bits} per byte in "
+                                f"weights_{args.w1_quant}.memh; QAT epochs={args.qat_epochs if ptq_model is not None else 0})")
+        if args.per_channel:
+            report_lines.append(f"  W1 symmetric per-row scales s_w1[h] = {float(s_w1.min()):.8g} .. {float(s_w1.max()):.8g}  (w_float ~= w_int8 * s_w1[h])")
+            report_lines.append(f"  W2 symmetric per-tensor scale s_w2 = {s_w2:.8g}  (w_float * s_w1[h] * 2^SHIFT[h] ~= w_int8 * s_w2)")
+            report_lines.append(f"  b1_int32 = round(b1_float / s_w1[h])")
+        else:
+            report_lines.append(f"  W1 symmetric per-tensor scale s_w1 = {s_w1:.8g}  (w_float ~= w_int8 * s_w1)")
+            report_lines.append(f"  W2 symmetric per-tensor scale s_w2 = {s_w2:.8g}  (w_float ~= w_int8 * s_w2)")
+            report_lines.append(f"  b1_int32 = round(b1_float / s_w1)")
+        report_lines.append(f"  b2_int32 = round(b2_float / s_w2)")
+        report_lines.append("")
+        report_lines.append("Activation requant (after ReLU):")
+        if args.per_channel:
+            report_lines.append(f"  SHIFT[h] per row (SHIFT.txt, shift table after b2 in weights.memh): {shift_np.tolist()}")
+            report_lines.append(f"  a1_q[h] = clamp( ((a1_int32[h] + (1<<(SHIFT[h]-1))) >> SHIFT[h]), 0..127 )")
+        else:
+            report_lines.append(f"  SHIFT = {SHIFT}")
+            report_lines.append(f"  a1_q = clamp( ((a1_int32 + (1<<(SHIFT-1))) >> SHIFT), 0..127 )  [SHIFT=0 => no rounding/shift]")
+        report_lines.append(f"  Chosen SHIFT stats: sat={best_stats['sat_pct']:.3f}%  nonzero={best_stats['nonzero_pct']:.3f}%  mean={best_stats['mean']:.3f}  median={best_stats['median']:.3f}")
+        report_lines.append("")
+        report_lines.append("Accuracy / consistency:")
+        report_lines.append(f"  Float val accuracy: {float_val_acc*100:.2f}%")
+        report_lines.append(f"  Integer emu val accuracy: {int_acc*100:.2f}%")
+        report_lines.append(f"  Argmax match (float preds vs int emu preds): {match*100:.2f}%")
+        if qat_match is not None:
+            report_lines.append(f"  Argmax match (QAT forward vs int emu preds): {qat_match*100:.2f}%  "
+                                f"(QAT epochs={args.qat_epochs}, SHIFT held fixed)")
+        report_lines.append("")
+        if precision_rows:
+            report_lines.append("W1 precision (int accuracy, tensor memory words, projected cycles per batch of 4):")
+            report_lines.extend(precision_rows)
+            report_lines.append("")
+        report_lines.append("Val set evaluation:")
+        report_lines.extend("  " + s for s in ev.report_lines())
+        report_lines.append("")
+        report_lines.append("Notes / assumptions (important for hardware matching):")
+        report_lines.append("  - Input x is treated as int32 0/1 (no input scaling).")
+        report_lines.append("  - MAC is emulated as int8->int32 accumulation using signed weights; input is nonnegative.")
+        report_lines.append("  - Biases are exported in the same int32 accumulator domain used by the MAC sums.")
+        report_lines.append("  - Layer2 uses a1_q (0..127) directly as int8 activations; its scale is implicit via SHIFT.")
+        report_lines.append("")
+        report_lines.append(f"Files written to: {os.path.abspath(export_dir)}")
+        report_lines.append("  - " + ", ".join(files + ["report.txt"]))
+
+        write_report(os.path.join(export_dir, "report.txt"), report_lines)
+
+    print(f"Export complete -> {os.path.abspath(export_dir)}  ({t_export*1e3:.0f} ms: {', '.join(files)})")
+
+    if prof.enabled:
+        print("Profile (wall/CPU time, peak RSS and its growth, tracemalloc peak per stage):")
+        print("\n".join("  " + line for line in prof.summary_lines()))
+        if args.profile:
+            print(f"Chrome trace -> {os.path.abspath(prof.write_chrome_trace())}")
+        prof.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Stage-level profiling for the training / export pipeline (model.py --profile).
+
+StageProfiler.stage(name) is a context manager; every stage records
+  wall_s        time.perf_counter() duration
+  cpu_s         time.process_time() duration (all threads of the process)
+  maxrss_mb     peak RSS of the process at the end of the stage, and
+  maxrss_grow_mb how much the stage raised it (0 = it stayed under an earlier peak)
+  py_peak_mb    tracemalloc peak inside the stage, above the traced memory at its
+                start (NumPy buffers are traced, torch tensor storage is not)
+Stages nest (model.train() opens one per epoch inside "train"); a parent's
+tracemalloc peak includes its children's.
+
+write_chrome_trace() dumps the stages as Chrome trace "X" events (args = the
+metrics above plus whatever the caller stored in the yielded dict) and an RSS
+counter track; open it in chrome://tracing or https://ui.perfetto.dev.
+
+torch_stages: stages also run under torch.profiler; each writes its own Chrome
+trace next to the main one (<trace>.<stage>.torch.json) and prints its top ops.
+
+A disabled profiler (StageProfiler(enabled=False), the default in model.py)
+yields a throwaway dict and measures nothing.
+
+Only deps: standard library (torch for torch_stages)
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, peak RSS is reported as 0
+    resource = None
+
+
+def max_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MiB."""
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / 1024  # bytes on macOS, KiB elsewhere
+
+
+class StageProfiler:
+    def __init__(self, enabled: bool = True, torch_stages=(), trace_path: str = ""):
+        self.enabled = enabled
+        self.torch_stages = set(torch_stages)
+        self.trace_path = trace_path
+        self.events = []     # finished stages, in completion order
+        self._stack = []     # open stages: [name, tracemalloc peak of finished children]
+        self._t0 = time.perf_counter()
+        self._owns_tracemalloc = False
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+
+    @contextmanager
+    def stage(self, name: str, **args):
+        """Time and measure the body; the yielded dict is stored as the event's args."""
+        if not self.enabled:
+            yield dict(args)
+            return
+        if self._stack:  # the parent's peak so far, before the child resets it
+            self._stack[-1][1] = max(self._stack[-1][1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        py_start = tracemalloc.get_traced_memory()[0]
+        frame = [name, 0]
+        self._stack.append(frame)
+        rss_start = max_rss_mb()
+        torch_prof = self._torch_profile(name) if name in self.torch_stages else None
+        if torch_prof is not None:
+            torch_prof.__enter__()
+        t0, c0 = time.perf_counter(), time.process_time()
+        record = dict(args)
+        try:
+            yield record
+        finally:
+            wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+            if torch_prof is not None:
+                torch_prof.__exit__(None, None, None)
+                self._torch_export(name, torch_prof)
+            self._stack.pop()
+            py_peak = max(frame[1], tracemalloc.get_traced_memory()[1])
+            if self._stack:  # the parent carries on measuring from here
+                self._stack[-1][1] = max(self._stack[-1][1], py_peak)
+            tracemalloc.reset_peak()
+            rss = max_rss_mb()
+            record.update(wall_s=wall, cpu_s=cpu, maxrss_mb=rss, maxrss_grow_mb=rss - rss_start,
+                          py_peak_mb=(py_peak - py_start) / (1 << 20))
+            self.events.append({"name": name, "depth": len(self._stack), "start": t0 - self._t0,
+                                "tid": threading.get_ident(), "args": record})
+
+    # -----------------------------
+    # torch.profiler
+    # -----------------------------
+
+    def _torch_profile(self, name: str):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        return profile(activities=activities, record_shapes=False, profile_memory=True)
+
+    def torch_trace_path(self, name: str) -> str:
+        root, _ = os.path.splitext(self.trace_path or "profile.json")
+        return f"{root}.{name.replace(' ', '_')}.torch.json"
+
+    def _torch_export(self, name: str, prof) -> None:
+        path = self.torch_trace_path(name)
+        prof.export_chrome_trace(path)
+        print(f"torch.profiler [{name}] -> {path}")
+        print(prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=10))
+
+    # -----------------------------
+    # Output
+    # -----------------------------
+
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "model.py"}}]
+        for ev in sorted(self.events, key=lambda e: (e["start"], e["depth"])):
+            a = ev["args"]
+            ts = ev["start"] * 1e6
+            events.append({"name": ev["name"], "cat": "stage", "ph": "X", "pid": pid, "tid": ev["tid"],
+                           "ts": round(ts, 3), "dur": round(a["wall_s"] * 1e6, 3), "args": a})
+            events.append({"name": "maxrss_mb", "ph": "C", "pid": pid, "tid": ev["tid"],
+                           "ts": round(ts + a["wall_s"] * 1e6, 3), "args": {"maxrss_mb": a["maxrss_mb"]}})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"argv": sys.argv, "torch_stages": sorted(self.torch_stages)}}
+
+    def write_chrome_trace(self, path: str = "") -> str:
+        path = path or self.trace_path
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, default=float)
+        return path
+
+    def summary_lines(self) -> list[str]:
+        """One row per stage in start order, nested stages indented."""
+        out = [f"{'stage':28s} {'wall s':>9s} {'cpu s':>9s} {'cpu/wall':>8s} {'maxrss MB':>10s} "
+               f"{'+rss MB':>8s} {'py peak MB':>10s}"]
+        for ev in sorted(self.events, key=lambda e: (e["start"], e["depth"])):
+            a = ev["args"]
+            name = ("  " * ev["depth"] + ev["name"])[:28]
+            out.append(f"{name:28s} {a['wall_s']:9.3f} {a['cpu_s']:9.3f} {a['cpu_s'] / max(a['wall_s'], 1e-9):8.2f} "
+                       f"{a['maxrss_mb']:10.1f} {a['maxrss_grow_mb']:8.1f} {a['py_peak_mb']:10.2f}")
+        return out
+
+    def close(self) -> None:
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Long-lived micro-batching inference service around the integer emulator.
+
+InferenceService loads the int weights once (weights.memh or the text export)
+into an int_engine.IntMLP and serves single-image requests from any number of
+threads (submit / classify) or asyncio tasks (aclassify). A worker thread
+coalesces queued requests into micro-batches:
+  * a batch closes when it holds max_batch requests, or max_wait_ms after its
+    first request was submitted, whichever comes first
+  * requests already waiting when the deadline passes still join (up to
+    max_batch), so an overloaded service runs full batches
+Results are bit-exact with model.int_infer_batch: (logits int32 (C,), class).
+
+Images are packed (450,) uint8 rows (np.packbits order, as datagen packs them),
+(3600,) or (60, 60) 0/1 arrays.
+
+ServiceStats keeps the last `history` request latencies (submit -> result) and
+queue waits for percentiles, and a histogram of the batch sizes run.
+
+Only deps: numpy, standard library
+
+Run directly for the load generator: open-loop Poisson arrivals at each
+offered rate for each batching config, reporting throughput, latency
+percentiles and batch sizes:
+  python serve.py --rates 500 2000 8000 --configs 1:0 16:0.5 64:2
+  python serve.py --clients 1 4 16          # closed loop: each client waits for its answer
+"""
+
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+from int_engine import IntMLP, load_memh, load_txt_weights, read_shift_txt
+
+BASE_DIR = Path(__file__).resolve().parent
+
+IMG_SIZE = 60
+N_PIX = IMG_SIZE * IMG_SIZE
+PACKED = N_PIX // 8
+PERCENTILES = (50, 90, 99, 99.9)
+
+_STOP = object()
+
+
+# -----------------------------
+# Weights
+# -----------------------------
+
+def load_weights(source=BASE_DIR, shift=None):
+    """
+    (w1, b1, w2, b2, shift) from a text-export directory (W1_int8.txt, ...) or a
+    weights.memh image. A .memh has no SHIFT unless it carries a per-row table:
+    it comes from `shift`, else SHIFT.txt next to the file.
+    """
+    source = Path(source)
+    if source.is_dir():
+        w1, b1, w2, b2, s = load_txt_weights(source)
+        return w1, b1, w2, b2, s if shift is None else shift
+    w1, b1, w2, b2, table = load_memh(source)
+    if table is not None:
+        return w1, b1, w2, b2, table
+    if shift is None:
+        shift_txt = source.parent / "SHIFT.txt"
+        if not shift_txt.exists():
+            raise ValueError(f"{source} has no shift table; pass shift= (no {shift_txt})")
+        shift = read_shift_txt(shift_txt)
+    return w1, b1, w2, b2, shift
+
+def as_packed(image) -> np.ndarray:
+    """One image -> (450,) uint8 packed row."""
+    x = np.asarray(image)
+    if x.dtype == np.uint8 and x.shape == (PACKED,):
+        return x
+    if x.size != N_PIX:
+        raise ValueError(f"expected a packed ({PACKED},) uint8 row or {N_PIX} pixels, got shape {x.shape}")
+    return np.packbits(x.reshape(-1) != 0)
+
+
+# -----------------------------
+# Statistics
+# -----------------------------
+
+class ServiceStats:
+    """Latency / queue-wait ring buffers (seconds) and the batch-size histogram."""
+
+    def __init__(self, max_batch: int, history: int = 100_000):
+        self.history = history
+        self.latency = np.zeros(history)
+        self.wait = np.zeros(history)
+        self.batch_sizes = np.zeros(max_batch + 1, dtype=np.int64)
+        self.requests = 0
+        self.batches = 0
+        self.compute = 0.0          # seconds inside the engine
+        self.t_first = self.t_last = None
+
+    def record(self, t_submit: np.ndarray, t_start: float, t_done: float) -> None:
+        n = len(t_submit)
+        idx = (self.requests + np.arange(n)) % self.history
+        self.latency[idx] = t_done - t_submit
+        self.wait[idx] = t_start - t_submit
+        self.batch_sizes[n] += 1
+        self.requests += n
+        self.batches += 1
+        self.compute += t_done - t_start
+        if self.t_first is None:
+            self.t_first = float(t_submit.min())
+        self.t_last = t_done
+
+    def summary(self) -> dict:
+        k = min(self.requests, self.history)
+        lat, wait = self.latency[:k], self.wait[:k]
+        sizes = np.arange(len(self.batch_sizes))
+        span = (self.t_last - self.t_first) if self.requests else 0.0
+        out = {
+            "requests": self.requests,
+            "batches": self.batches,
+            "throughput": self.requests / span if span > 0 else 0.0,
+            "mean_batch": float((sizes * self.batch_sizes).sum() / max(1, self.batches)),
+            "engine_busy": self.compute / span if span > 0 else 0.0,
+            "batch_sizes": self.batch_sizes.tolist(),
+        }
+        for name, a in (("latency_ms", lat), ("wait_ms", wait)):
+            pct = np.percentile(a, PERCENTILES) * 1e3 if k else np.zeros(len(PERCENTILES))
+            out[name] = {f"p{p:g}": float(v) for p, v in zip(PERCENTILES, pct)}
+            out[name]["mean"] = float(a.mean() * 1e3) if k else 0.0
+        return out
+
+    def batch_lines(self) -> list[str]:
+        """Batch-size histogram in power-of-two bins."""
+        n = max(1, self.batches)
+        out, lo = [], 1
+        while lo < len(self.batch_sizes):
+            hi = min(2 * lo, len(self.batch_sizes))
+            c = int(self.batch_sizes[lo:hi].sum())
+            if c:
+                label = f"{lo}" if hi - lo == 1 else f"{lo}-{hi - 1}"
+                out.append(f"{label:>9s} {c:10d}  {100 * c / n:6.2f}%")
+            lo = hi
+        return out
+
+
+# -----------------------------
+# Service
+# -----------------------------
+
+class InferenceService:
+    """
+    Thread-safe micro-batching front end for IntMLP. Use as a context manager
+    or call close(); submit() after close() raises RuntimeError.
+    """
+
+    def __init__(self, weights=BASE_DIR, shift=None, max_batch: int = 32, max_wait_ms: float = 1.0,
+                 method: str = "gemm", history: int = 100_000):
+        if max_batch < 1:
+            raise ValueError("max_batch must be >= 1")
+        w1, b1, w2, b2, shift = weights if isinstance(weights, tuple) else load_weights(weights, shift)
+        self.engine = IntMLP(w1, b1, w2, b2, shift)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1e3
+        self.method = method
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._stats = ServiceStats(max_batch, history)
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="int-infer-batcher", daemon=True)
+        self._worker.start()
+
+    # -------- client API --------
+
+    def submit(self, image) -> Future:
+        """Queue one image; the Future resolves to (logits int32 (C,), class index)."""
+        x = as_packed(image)
+        fut = Future()
+        with self._lock:  # atomic with close(): nothing is queued behind _STOP
+            if self._closed:
+                raise RuntimeError("service is closed")
+            self._queue.put((x, time.perf_counter(), fut))
+        return fut
+
+    def classify(self, image, timeout: float | None = None):
+        return self.submit(image).result(timeout)
+
+    async def aclassify(self, image):
+        import asyncio  # ~40 ms of import; only async callers pay it
+
+        return await asyncio.wrap_future(self.submit(image))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return self._stats.summary()
+
+    def batch_histogram(self) -> list[str]:
+        with self._lock:
+            return self._stats.batch_lines()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = ServiceStats(self.max_batch, self._stats.history)
+
+    def close(self) -> None:
+        """Finish every queued request, then stop the worker."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._worker.join()
+        # the worker stops at _STOP; fail anything that still got behind it
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP and item[2].set_running_or_notify_cancel():
+                item[2].set_exception(RuntimeError("service is closed"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -------- worker --------
+
+    def _collect(self, first) -> tuple:
+        """Fill a batch behind `first` until max_batch or its deadline; returns (batch, stop)."""
+        batch = [first]
+        deadline = first[1] + self.max_wait
+        q = self._queue
+        while len(batch) < self.max_batch:
+            left = deadline - time.perf_counter()
+            try:
+                item = q.get(timeout=left) if left > 0 else q.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stop = self._collect(first)
+            batch = [b for b in batch if b[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            t_start = time.perf_counter()
+            try:
+                logits, pred = self.engine.infer_packed(np.stack([b[0] for b in batch]), self.method)
+            except Exception as exc:  # hand the failure to every caller in the batch
+                for b in batch:
+                    b[2].set_exception(exc)
+                continue
+            t_done = time.perf_counter()
+            for i, b in enumerate(batch):
+                b[2].set_result((logits[i], int(pred[i])))
+            with self._lock:
+                self._stats.record(np.array([b[1] for b in batch]), t_start, t_done)
+
+
+# -----------------------------
+# Load generator
+# -----------------------------
+
+def open_loop(svc: InferenceService, pool: np.ndarray, rate: float, duration: float, seed: int = 0) -> list:
+    """Poisson arrivals at `rate` req/s for `duration` s; returns (pool index, Future) pairs."""
+    rng = np.random.default_rng(seed)
+    n = max(1, int(rate * duration))
+    due = np.cumsum(rng.exponential(1.0 / rate, n))
+    idx = rng.integers(0, len(pool), n)
+    out = []
+    t0 = time.perf_counter()
+    i = 0
+    while i < n:
+        now = time.perf_counter() - t0
+        for k in range(i, int(np.searchsorted(due, now, side="right"))):
+            out.append((idx[k], svc.submit(pool[idx[k]])))
+        i = len(out)
+        if i < n:
+            time.sleep(min(max(0.0, due[i] - now), 0.002))
+    return out
+
+def closed_loop(svc: InferenceService, pool: np.ndarray, clients: int, duration: float) -> list:
+    """`clients` threads, each submitting its next image as soon as the previous answer arrives."""
+    out, lock = [], threading.Lock()
+    t_end = time.perf_counter() + duration
+
+    def client(c):
+        mine, k = [], c
+        while time.perf_counter() < t_end:
+            i = k % len(pool)
+            fut = svc.submit(pool[i])
+            fut.result()
+            mine.append((i, fut))
+            k += clients
+        with lock:
+            out.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return out
+
+def _check(results: list, ref_logits: np.ndarray) -> int:
+    """Mismatches of service results against one direct batch over the pool."""
+    bad = 0
+    for i, fut in results:
+        logits, pred = fut.result()
+        bad += int(not np.array_equal(logits, ref_logits[i]) or pred != int(np.argmax(ref_logits[i])))
+    return bad
+
+
+# -----------------------------
+# Main
+# -----------------------------
+
+def main():
+    import datagen
+
+    ap = argparse.ArgumentParser(description="Micro-batching int inference service: load-generator benchmark.")
+    ap.add_argument("--weights", type=str, default=str(BASE_DIR), help="text-export dir or weights.memh")
+    ap.add_argument("--shift", type=int, default=None, help="SHIFT for a .memh without SHIFT.txt next to it")
+    ap.add_argument("--configs", type=str, nargs="+", default=["1:0", "8:0.5", "32:1", "128:2"],
+                    help="max_batch:max_wait_ms pairs")
+    ap.add_argument("--rates", type=float, nargs="+", default=[1000, 4000, 16000],
+                    help="open-loop offered loads (requests/s)")
+    ap.add_argument("--clients", type=int, nargs="*", default=[],
+                    help="closed-loop client counts (instead of --rates)")
+    ap.add_argument("--duration", type=float, default=2.0, help="seconds per point")
+    ap.add_argument("--pool", type=int, default=4096, help="distinct request images")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--histogram", action="store_true", help="print the batch-size histogram of every point")
+    args = ap.parse_args()
+
+    weights = load_weights(args.weights, args.shift)
+    P, _ = datagen.make_dataset_batched(-(-args.pool // 3), rng=np.random.default_rng(args.seed), packed=True)
+    pool = np.ascontiguousarray(P[:args.pool])
+    ref_logits, _ = IntMLP(*weights).infer_packed(pool)
+
+    t0 = time.perf_counter()
+    IntMLP(*weights).infer_packed(pool[:1])
+    print(f"weights {args.weights}: single-image direct call {1e3 * (time.perf_counter() - t0):.2f}ms")
+    print(f"{'max_batch':>9s} {'wait_ms':>7s} {'load':>10s} {'req/s':>9s} {'mean_b':>7s} {'busy':>6s} "
+          f"{'p50_ms':>8s} {'p90_ms':>8s} {'p99_ms':>8s} {'p99.9_ms':>8s}  exact")
+    loads = [("clients", c) for c in args.clients] or [("rate", r) for r in args.rates]
+    for cfg in args.configs:
+        mb, mw = cfg.split(":")
+        for kind, val in loads:
+            with InferenceService(weights, max_batch=int(mb), max_wait_ms=float(mw)) as svc:
+                if kind == "rate":
+                    res = open_loop(svc, pool, val, args.duration, args.seed)
+                    label = f"{val:.0f}/s"
+                else:
+                    res = closed_loop(svc, pool, int(val), args.duration)
+                    label = f"{int(val)} cl"
+                for _, fut in res:
+                    fut.result()
+            st = svc.stats()
+            lat = st["latency_ms"]
+            bad = _check(res, ref_logits)
+            print(f"{int(mb):9d} {float(mw):7.2f} {label:>10s} {st['throughput']:9.0f} {st['mean_batch']:7.1f} "
+                  f"{100 * st['engine_busy']:5.1f}% {lat['p50']:8.3f} {lat['p90']:8.3f} {lat['p99']:8.3f} "
+                  f"{lat['p99.9']:8.3f}  {bad == 0}")
+            if args.histogram:
+                print("\n".join("    batch " + s for s in svc.batch_histogram()))
+            if bad:
+                raise SystemExit(f"MISMATCH: {bad} service results differ from the direct batch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Architecture sweep: hidden width x weight clip -> accuracy, accelerator
+cycles, weight memory.
+
+Every trial trains MLP2 with model.train(), then fine-tunes it as model.py
+does -- model.train_qat() with --qat, else model.finetune_w1_quant() for an
+int4/ternary --w1_quant (PTQ only with --qat_epochs 0) -- quantizes it with
+model.quantize_model() and runs the integer emulator on the val set.
+Hardware cost per hidden width:
+  cycles/img : tc_model.batch_report() for a 4x4 array (ROW_DIM=4) / 4 images
+  mem words  : tensor memory depth (weights.memh lines; W1 packed for
+               --w1_quant int4/ternary)
+The RTL and weight_to_memh.py are fixed at 64 hidden units today; other
+widths assume the row-block count and memory map are regenerated for them.
+
+Trials run in separate processes. The dataset is built once into the dataset
+cache and every trial memory-maps the same .npy files.
+
+Takes every model.py flag (data, epochs, lr, ...) except --stream and
+--prune_sparsity, which the trials do not implement, plus the grid:
+  python sweep.py --hiddens 16 32 64 --clips 0.5 1 2 --epochs 10 --workers 4
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing as mp
+
+import torch
+
+from model import (MLP2, W1_BITS, build_arg_parser, eval_float, finetune_w1_quant, int_infer_batch,
+                   load_datasets, quantize_model, train, train_qat)
+
+
+def run_trial(args_dict: dict, hidden: int, clip: float) -> dict:
+    """Train + quantize + int-evaluate one grid point (runs in a worker process)."""
+    args = argparse.Namespace(**args_dict)
+    torch.set_num_threads(args.threads_per_trial)
+    torch.manual_seed(args.seed)
+
+    t0 = time.perf_counter()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        x_train, y_train, x_val, y_val = (torch.from_numpy(a) for a in load_datasets(args))
+        model = MLP2(in_dim=3600, hidden=hidden, out_dim=3)
+        model = train(model, x_train, y_train, x_val, y_val,
+                      epochs=args.epochs, lr=args.lr, batch_size=args.batch_size,
+                      device=args.device, weight_clip=clip, fast=args.fast_train, compile_model=args.compile)
+        calib_x = x_val[: args.calib_rows or x_val.shape[0]]
+        qat_shift = None
+        if args.qat and args.qat_epochs > 0:
+            model, qat_shift = train_qat(model, x_train, y_train, x_val, y_val, calib_x, shift=args.qat_shift,
+                                         w1_quant=args.w1_quant, per_channel=args.per_channel,
+                                         backend=args.int_backend, shift_min=args.shift_min,
+                                         shift_max=args.shift_max, calib_chunk=args.calib_chunk,
+                                         epochs=args.qat_epochs, lr=args.finetune_lr,
+                                         batch_size=args.batch_size, device=args.device, weight_clip=clip,
+                                         fast=args.fast_train, compile_model=args.compile)
+            w1_training = "QAT"
+        elif args.w1_quant != "int8" and args.qat_epochs > 0:
+            model = finetune_w1_quant(model, x_train, y_train, x_val, y_val, args.w1_quant, args.per_channel,
+                                      epochs=args.qat_epochs, lr=args.finetune_lr, batch_size=args.batch_size,
+                                      device=args.device, weight_clip=clip, fast=args.fast_train,
+                                      compile_model=args.compile)
+            w1_training = "FQ W1"
+        else:
+            w1_training = "PTQ"
+        float_acc = eval_float(model, x_val, y_val, args.batch_size, args.device)
+
+        q = quantize_model(model, calib_x, args.int_backend, args.shift_min, args.shift_max, args.calib_chunk,
+                           per_channel=args.per_channel, w1_quant=args.w1_quant, shift=qat_shift)
+        _, pred_i = int_infer_batch(x_val, q["w1_q"], q["b1_q"], q["w2_q"], q["b2_q"], q["shift"],
+                                    backend=args.int_backend)
+        int_acc = (pred_i == y_val).float().mean().item()
+
+    return {
+        "hidden": hidden,
+        "clip": clip,
+        "float_acc": float_acc,
+        "int_acc": int_acc,
+        "shift": q["shift"].tolist() if args.per_channel else q["shift"],
+        "sat_pct": q["best_stats"]["sat_pct"],
+        "w1_training": w1_training,
+        "train_s": time.perf_counter() - t0,
+        "log_tail": log.getvalue().splitlines()[-3:],
+    }
+
+
+def hardware_cost(hidden: int, w1_bits: int = 8) -> dict:
+    """Cycles per image and memory words for a 4x4 array; None when the width does not map."""
+    import tc_model
+
+    try:
+        rep = tc_model.batch_report(row_dim=4, hidden=hidden)
+    except ValueError:
+        return {"cycles_per_img": None, "mem_words": None}
+    return {"cycles_per_img": rep["cycles"] / 4, "mem_words": tc_model.memory_words(4, hidden, w1_bits=w1_bits)}
+
+
+def pareto_front(rows: list[dict]) -> set[int]:
+    """Indices of rows not dominated on (int_acc max, cycles_per_img min, mem_words min)."""
+    pts = [(i, r["int_acc"], r["cycles_per_img"], r["mem_words"]) for i, r in enumerate(rows)
+           if r["cycles_per_img"] is not None]
+    front = set()
+    for i, acc, cyc, mem in pts:
+        dominated = any(a >= acc and c <= cyc and m <= mem and (a > acc or c < cyc or m < mem)
+                        for j, a, c, m in pts if j != i)
+        if not dominated:
+            front.add(i)
+    return front
+
+
+def main():
+    ap = argparse.ArgumentParser(parents=[build_arg_parser(add_help=False)],
+                                 description="Parallel hidden-width x clip sweep with a Pareto table.")
+    ap.add_argument("--hiddens", type=int, nargs="+", default=[16, 32, 48, 64, 96, 128])
+    ap.add_argument("--clips", type=float, nargs="+", default=[0.5, 1.0, 2.0])
+    ap.add_argument("--workers", type=int, default=None, help="trial processes (default: cores, at most one per trial)")
+    ap.add_argument("--threads_per_trial", type=int, default=None, help="torch threads per trial process")
+    ap.add_argument("--clock_mhz", type=float, default=0.0, help="also print latency in us at this clock")
+    ap.add_argument("--json_out", type=str, default="", help="write every trial to this JSON file")
+    ap.set_defaults(device="cpu")
+    args = ap.parse_args()
+    if not args.cache_dir:
+        ap.error("the sweep shares one dataset through the cache; --cache_dir must be set")
+    if args.stream:
+        ap.error("--stream is not supported: trials train on the cached train set")
+    if args.prune_sparsity > 0:
+        ap.error("--prune_sparsity is not supported: trials do not prune W1")
+
+    grid = [(h, c) for h in args.hiddens for c in args.clips]
+    cores = os.cpu_count() or 1
+    workers = args.workers or min(len(grid), cores)
+    args.threads_per_trial = args.threads_per_trial or max(1, cores // workers)
+
+    # build (or hit) the cache once so the trials only memory-map it
+    load_datasets(args)
+    print(f"{len(grid)} trials on {workers} processes x {args.threads_per_trial} threads")
+
+    t0 = time.perf_counter()
+    rows = []
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futs = [pool.submit(run_trial, vars(args), h, c) for h, c in grid]
+        costs = {h: hardware_cost(h, W1_BITS[args.w1_quant]) for h in sorted(set(args.hiddens))}
+        for fut in as_completed(futs):
+            r = fut.result()
+            r.update(costs[r["hidden"]])
+            if args.per_channel and r["mem_words"] is not None:
+                r["mem_words"] += r["hidden"]  # per-row shift table
+            rows.append(r)
+            print(f"  hidden={r['hidden']:4d} clip={r['clip']:<5g} int_acc={r['int_acc']*100:6.2f}%  "
+                  f"[{r['train_s']:.0f}s]")
+    print(f"sweep wall time {time.perf_counter() - t0:.0f}s")
+
+    rows.sort(key=lambda r: (r["hidden"], r["clip"]))
+    front = pareto_front(rows)
+    lat_hdr = f" {'latency':>10s}" if args.clock_mhz else ""
+    print(f"\n{'':1s} {'hidden':>6s} {'clip':>5s} {'float':>7s} {'int':>7s} {'SHIFT':>5s} "
+          f"{'cycles/img':>10s}{lat_hdr} {'mem words':>9s} {'RTL':>4s} {'W1 training':>11s}")
+    for i, r in enumerate(rows):
+        cyc = r["cycles_per_img"]
+        cyc_s = f"{cyc:10.0f}" if cyc is not None else f"{'n/a':>10s}"
+        mem_s = f"{r['mem_words']:9d}" if r["mem_words"] is not None else f"{'n/a':>9s}"
+        lat_s = ""
+        if args.clock_mhz:
+            lat_s = f" {cyc / args.clock_mhz:8.0f}us" if cyc is not None else f" {'n/a':>10s}"
+        print(f"{'*' if i in front else ' '} {r['hidden']:6d} {r['clip']:5g} {r['float_acc']*100:6.2f}% "
+              f"{r['int_acc']*100:6.2f}% {'row' if args.per_channel else r['shift']:>5} {cyc_s}{lat_s} {mem_s} "
+              f"{'yes' if r['hidden'] == 64 else 'no':>4s} {r['w1_training']:>11s}")
+    print("* = Pareto-optimal on (int acc, cycles/img, mem words); RTL = runs on the current 64-unit RTL")
+    print("W1 training: QAT = --qat, FQ W1 = fake-quant W1 fine-tuning (as model.py), PTQ = quantized after training only")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+        print(f"wrote {os.path.abspath(args.json_out)}")
+
+
+if __name__ == "__main__":
+    main()
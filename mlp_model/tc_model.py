@@ -0,0 +1,965 @@
+#!/usr/bin/env python3
+"""
+Cycle-level performance model of the tensor controller + systolic array.
+
+A clock-by-clock Python port of src/tensor_controller.sv (control and shift
+state machines), src/systolic_array.sv / src/mac.sv and src/wb_1cycle.sv,
+driven by a timing model of the firmware feed loop in assembly/int_tensor.asm
+(poll 0x8, store one pixel word, repeat for every row block, poll 0x4 for the
+shape, ack with a store to 0x4).
+
+Schedule for one batch of ROW_DIM images (one image per array column):
+  * HIDDEN/ROW_DIM row blocks, each WAIT_FILL_1 -> SHIFT_1 over the 3600 W1
+    columns, with LAG_1 / STALL_1 / COL_FILL bubbles whenever the CPU cannot
+    keep the pixel shifter full, then the LAST_1 drain and STORE_1
+  * BIAS_1 (one cycle per hidden unit), RELU, QUANT
+  * layer 2: WAIT_FILL_2 -> SHIFT_2 over the hidden units -> LAST_2 ->
+    STORE_2 -> BIAS_2
+  * CLASS_SEND, then RESET until the CPU acks the shape
+
+Two levels of detail:
+  * datapath=True  : bytes move through the shifters, MACs and tensor memory,
+                     so logits and the shape word come out of the ported RTL
+  * datapath=False : counters only. The schedule never depends on pixel or
+                     weight values, so one simulated batch gives the cycle
+                     count of every batch and rtl_infer_batch gives the
+                     results.
+
+What the port shows about the current RTL (and rtl_infer_batch reproduces):
+  * layer 1 is exactly x @ W1^T as long as the feed does not race the shifter
+    (RACE_EVENTS counts the cycles where it would)
+  * layer 2 is not exactly a1q @ W2^T: WAIT_FILL_2 drops its W2 read before
+    SHIFT_2 starts (hidden unit 0 is lost) and LAST_2 holds row_shift while the
+    array keeps accumulating (the last pairs repeat); see layer2_pairing
+
+ROW_DIM, hidden width, input width and class count are parameters, so other
+array shapes can be costed before touching RTL (register widths are assumed
+to grow with them). Only the cycle counts carry over: the layer-2 column
+shift/fill exists for ROW_DIM=4 alone, so the datapath (and everything that
+reports logits or the layer-2 wiring) refuses other ROW_DIM values. The CPU
+side is an estimate (FeedTiming); calibrate it with a tb_integratedTC log
+via --tb_log.
+
+Only deps: numpy, standard library
+"""
+
+import argparse
+import re
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+STATES_C = ("IDLE_C", "WAIT_FILL_1", "SHIFT_1", "LAG_1", "STALL_1", "COL_FILL",
+            "LAST_1", "STORE_1", "BIAS_1", "RELU", "QUANT", "WAIT_FILL_2",
+            "SHIFT_2", "LAST_2", "STORE_2", "BIAS_2", "CLASS_SEND", "RESET")
+(IDLE_C, WAIT_FILL_1, SHIFT_1, LAG_1, STALL_1, COL_FILL, LAST_1, STORE_1, BIAS_1,
+ RELU, QUANT, WAIT_FILL_2, SHIFT_2, LAST_2, STORE_2, BIAS_2, CLASS_SEND, RESET) = range(len(STATES_C))
+IDLE_S, REQ, WAIT, CLEAR, L2_FILL = range(5)
+
+# per-phase breakdown (stateC values)
+PHASES = (
+    ("setup", (IDLE_C,)),
+    ("l1_mac", (SHIFT_1, COL_FILL)),
+    ("l1_feed_wait", (WAIT_FILL_1, LAG_1, STALL_1)),
+    ("l1_drain", (LAST_1, STORE_1)),
+    ("l1_post", (BIAS_1, RELU, QUANT)),
+    ("layer2", (WAIT_FILL_2, SHIFT_2, LAST_2, STORE_2, BIAS_2)),
+    ("class_out", (CLASS_SEND, RESET)),
+)
+
+# feed races after which the datapath no longer computes x @ W1^T
+RACE_EVENTS = ("hazards", "double_counted", "dropped_columns")
+
+MASK32 = 0xFFFFFFFF
+
+# The layer-2 column handling (SHIFT_2 shifts col_shift[0..3], L2_FILL keeps
+# three live hidden entries) is written for the 4x4 array and has no RTL for
+# other sizes. The control schedule does not depend on it, so counter-only runs
+# cost any row_dim; layer-2 datapath results exist only for this one.
+RTL_ROW_DIM = 4
+L2_FILL_ENTRIES = 3
+
+
+def _s8(v: int) -> int:
+    v &= 0xFF
+    return v - 256 if v & 0x80 else v
+
+def _s32(v: int) -> int:
+    v &= MASK32
+    return v - (1 << 32) if v & 0x80000000 else v
+
+
+# -----------------------------
+# Memory image + pixel words
+# -----------------------------
+
+def build_tensor_mem(w1, b1, w2, b2, row_dim: int = 4) -> list:
+    """
+    wb_1cycle contents in weight_to_memh order, as the port reads them:
+    W1 words are tuples of row_dim int8 (byte k = row g*row_dim+k), b1/b2 are ints,
+    W2 words are tuples with the class bytes padded to row_dim.
+    """
+    w1 = np.asarray(w1, dtype=np.int64)
+    w2 = np.asarray(w2, dtype=np.int64)
+    H, _ = w1.shape
+    C = w2.shape[0]
+    mem = []
+    for g in range(H // row_dim):
+        mem.extend(map(tuple, w1[g * row_dim:(g + 1) * row_dim].T.tolist()))
+    mem.extend(int(v) for v in np.asarray(b1).reshape(-1))
+    w2p = np.zeros((H, row_dim), dtype=np.int64)
+    w2p[:, :C] = w2.T
+    mem.extend(map(tuple, w2p.tolist()))
+    mem.extend(int(v) for v in np.asarray(b2).reshape(-1))
+    return mem
+
+def mem_words_u32(mem: list) -> list[int]:
+    """32-bit words of a row_dim=4 memory image (what weights.memh holds)."""
+    out = []
+    for v in mem:
+        if isinstance(v, tuple):
+            out.append(sum((b & 0xFF) << (8 * k) for k, b in enumerate(v)))
+        else:
+            out.append(v & MASK32)
+    return out
+
+def pixel_words(x_bits: np.ndarray, row_dim: int = 4, bus_bits: int = 32) -> list[int]:
+    """
+    (row_dim, P) 0/1 images -> P/p bus words, p = bus_bits/row_dim pixels per image per word.
+    Image i pixel p*w+j sits at bit i*p+j (byte i bit j for the 4x4 array, as int_tensor.asm builds x1).
+    """
+    p = bus_bits // row_dim
+    R, P = x_bits.shape
+    bits = np.asarray(x_bits, dtype=np.uint64).reshape(R, P // p, p)
+    pos = (np.arange(R, dtype=np.uint64)[:, None, None] * np.uint64(p)
+           + np.arange(p, dtype=np.uint64)[None, None, :])
+    return (bits << pos).sum(axis=(0, 2), dtype=np.uint64).tolist()
+
+
+# -----------------------------
+# CPU feed model
+# -----------------------------
+
+class FeedTiming:
+    """
+    Cycle estimates for the int_tensor.asm loops on the 5-stage core: every
+    MMIO access holds MEM for 2 cycles (NORMAL -> RECIEVE in mem.sv) and taken
+    branches/jumps flush 3 cycles (resolved in MEM).
+      prep_first   : cycles from the previous store to the next poll when a new
+                     word is fetched (get_tc_pixel: 4 lw + byte 0 pack, ~26 instr)
+      prep_next    : same for bytes 1..3 (fill_second/third/fourth, ~16 instr)
+      poll_retry   : lw 8(x30) + taken beq, per failed poll
+      poll_to_store: lw issue -> sw issue after a successful poll
+      pass_setup   : inference_loop header between row blocks
+      shape_ack    : shape poll hit -> ack store
+    """
+
+    def __init__(self, prep_first=36, prep_next=24, poll_retry=6, poll_to_store=3,
+                 pass_setup=24, shape_ack=3):
+        self.prep_first = prep_first
+        self.prep_next = prep_next
+        self.poll_retry = poll_retry
+        self.poll_to_store = poll_to_store
+        self.pass_setup = pass_setup
+        self.shape_ack = shape_ack
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def _idle(n: int):
+    for _ in range(n):
+        yield None
+
+def firmware_feed(words: list[int], passes: int, shift: int, t: FeedTiming, stats: Counter):
+    """
+    One MMIO request per cycle (None, or (lw, tc_addr, data)); .send() delivers
+    the TC's registered read data, i.e. the answer to the previous cycle's request.
+    Returns the shape word.
+    """
+    yield (False, 0xC, shift)
+    yield None
+    yield (False, 0x4, 0)
+    yield None
+    for _ in range(passes):
+        yield from _idle(t.pass_setup)
+        for k, w in enumerate(words):
+            yield from _idle(t.prep_first if k % 4 == 0 else t.prep_next)
+            while True:
+                stats["polls"] += 1
+                status = yield (True, 0x8, 0)
+                if status & 1:
+                    break
+                stats["poll_misses"] += 1
+                yield from _idle(t.poll_retry - 1)
+            yield from _idle(t.poll_to_store - 1)
+            stats["pixel_stores"] += 1
+            yield (False, 0x8, w)
+            yield None
+    while True:
+        stats["shape_polls"] += 1
+        shape = yield (True, 0x4, 0)
+        if shape >> 31:
+            break
+        yield from _idle(t.poll_retry - 1)
+    yield from _idle(t.shape_ack)
+    yield (False, 0x4, 0)
+    return shape
+
+
+# -----------------------------
+# RTL port
+# -----------------------------
+
+class TensorControllerSim:
+    """
+    tensor_controller + systolic_array + wb_1cycle, one step() per clock.
+    mem=None runs the counters only (no datapath).
+    """
+
+    def __init__(self, row_dim: int = 4, hidden: int = 64, in_dim: int = 3600,
+                 classes: int = 3, bus_bits: int = 32, mem: list | None = None):
+        if row_dim < 2 or bus_bits % row_dim:
+            raise ValueError("row_dim must be >= 2 and divide the bus width")
+        self.R = row_dim
+        self.p = bus_bits // row_dim
+        if in_dim % self.p or hidden % row_dim or not 2 <= classes <= row_dim or hidden < 3:
+            raise ValueError("in_dim must be a multiple of the pixels per word, hidden a multiple "
+                             "of row_dim, and 2 <= classes <= row_dim")
+        self.H, self.P, self.C = hidden, in_dim, classes
+        self.depth = 2 * self.p
+        self.uv_mask = (1 << self.depth.bit_length()) - 1
+        self.blocks = hidden // row_dim
+        self.B1 = self.blocks * in_dim
+        self.W2 = self.B1 + hidden
+        self.B2 = self.W2 + hidden
+        self.mem = mem
+        self.datapath = mem is not None
+        if mem is not None and len(mem) != self.B2 + classes:
+            raise ValueError(f"memory image has {len(mem)} words, expected {self.B2 + classes}")
+        if mem is not None and row_dim != RTL_ROW_DIM:
+            raise ValueError(f"the layer-2 datapath is only ported for ROW_DIM={RTL_ROW_DIM}; "
+                             f"row_dim={row_dim} runs counters only (mem=None)")
+        self._zero = (0,) * row_dim
+        self.reset()
+
+    def reset(self) -> None:
+        """Power-on reset: registers and statistics."""
+        self.cycle = 0
+        self.state_cycles = Counter()
+        self.state_entries = Counter()
+        self.events = Counter()
+        self.shift = 0
+        self._clear_regs()
+
+    def _clear_regs(self) -> None:
+        R = self.R
+        self.stateS, self.stateC = IDLE_S, IDLE_C
+        self.col_shift = [self._zero] * self.depth
+        self.row_shift = [self._zero] * R
+        self.unvalid = 0
+        self.en = self.clear = 0
+        self.layer1 = [[0] * self.H for _ in range(R)]
+        self.layer2 = [[0] * self.C for _ in range(R)]
+        self.col_ct = self.row_ct = self.ct2 = 0
+        self.mmio_ack = self.mmio_data_read = 0
+        self.pixel_data = 0
+        self.req_status = 0
+        self.shape = 0
+        self.lag_ct = 0
+        self.rdata = 0
+        self.acc = [[0] * R for _ in range(R)]    # [column/image][row]
+        self.skew = [[0] * R for _ in range(R)]   # column inputs delayed per row (index 0 unused)
+
+    # -------- helpers mirroring the SV bit slicing --------
+
+    def _word(self, rdata):
+        return rdata if isinstance(rdata, tuple) else self._zero
+
+    def _load_rows(self, rdata, limit: int):
+        """row_shift[k] = {0.., rdata byte k, 0..} for k < limit, zero above."""
+        w = self._word(rdata)
+        return [tuple(w[j] if j == k else 0 for j in range(self.R)) if k < limit else self._zero
+                for k in range(self.R)]
+
+    def _shift_rows(self, row, rdata, limit: int):
+        """SHIFT_1/SHIFT_2: row k takes the bytes above k from row k+1 and byte k from rdata."""
+        w = self._word(rdata)
+        R = self.R
+        out = []
+        for k in range(R):
+            if k >= limit:
+                out.append(row[k])
+                continue
+            up = row[k + 1] if k + 1 < R else self._zero
+            out.append(tuple(0 if j < k or j >= limit else (w[j] if j == k else up[j]) for j in range(R)))
+        return out
+
+    def _decode(self, word: int) -> list:
+        R, p = self.R, self.p
+        return [tuple((word >> (i * p + j)) & 1 for i in range(R)) for j in range(p)]
+
+    def _hidden_entry(self, h: int):
+        if h >= self.H:
+            return self._zero
+        return tuple(_s8(self.layer1[i][h]) for i in range(self.R))
+
+    def _count_races(self, sC: int, unvalid: int, col_shifted: bool) -> None:
+        """Pixel words that land on a cycle where the RTL mis-handles them."""
+        if unvalid == 0 or not col_shifted:
+            self.events["hazards"] += 1          # written over a valid entry / off the end
+        elif sC == SHIFT_1 and unvalid == 1:
+            # refill on the cycle the shifter runs dry: LAG_1 multiplies the new
+            # column 0 and COL_FILL feeds it again, so it is counted twice
+            self.events["double_counted"] += 1
+
+    # -------- one clock --------
+
+    def step(self, req=None) -> None:
+        R, P, H, C, p = self.R, self.P, self.H, self.C, self.p
+        dp = self.datapath
+        if req is None:
+            mreq, lw, addr, wdata = False, False, 0, 0
+        else:
+            mreq = True
+            lw, addr, wdata = req
+
+        sS, sC = self.stateS, self.stateC
+        unvalid, col_ct, row_ct = self.unvalid, self.col_ct, self.row_ct
+        col, row, rdata = self.col_shift, self.row_shift, self.rdata
+        self.state_cycles[sC] += 1
+        if self.en:
+            self.events["en_cycles"] += 1
+
+        n_sS, n_sC = sS, sC
+        n_col, n_row = col, row
+        n_unvalid = unvalid
+        n_en, n_clear = self.en, 0
+        n_col_ct, n_row_ct, n_ct2 = col_ct, row_ct, self.ct2
+        n_ack, n_read = 0, 0
+        n_pixel, n_req_status = self.pixel_data, self.req_status
+        n_shift, n_shape = self.shift, self.shape
+        n_lag = 0
+        ren, raddr = False, 0
+        col_shifted = False
+
+        # cpu interface
+        if mreq:
+            n_ack = 1
+            if addr == 0x8 and not lw:
+                n_pixel = wdata
+            elif addr == 0x8 and lw:
+                n_read = self.req_status
+            elif addr == 0xC and not lw:
+                n_shift = wdata & 0x1F
+            elif addr == 0x4 and lw:
+                n_read = self.shape
+
+        # control state machine
+        if sC == IDLE_C:
+            if mreq and addr == 0x4 and not lw:
+                n_sS, n_req_status, n_sC = REQ, 1, WAIT_FILL_1
+                n_clear = 1
+                ren, raddr = True, 0
+        elif sC == WAIT_FILL_1:
+            ren, raddr = True, row_ct * P
+            if unvalid != 0:
+                n_sC = SHIFT_1
+                raddr = row_ct * P + 1
+                n_en, n_col_ct = 1, 1
+                if dp:
+                    n_row = self._load_rows(rdata, R)
+        elif sC == SHIFT_1:
+            if dp:
+                n_row = self._shift_rows(row, rdata, R)
+            n_col = col[1:] + [self._zero]
+            col_shifted = True
+            n_unvalid = (unvalid - 1) & self.uv_mask
+            if unvalid >= 2:
+                n_en = 1
+                if col_ct >= P - 1:
+                    n_sC, n_col_ct = LAST_1, 0
+                else:
+                    ren, raddr = True, row_ct * P + col_ct + 1
+                    n_col_ct = col_ct + 1
+            else:
+                n_sC = LAG_1
+                n_col_ct = col_ct - 1
+        elif sC == LAG_1:
+            if self.lag_ct == R - 2:
+                n_en, n_sC = 0, STALL_1
+                n_row = [self._zero] * R
+            else:
+                n_lag = self.lag_ct + 1
+                if dp:
+                    n_row = self._shift_rows(row, 0, R)
+        elif sC == STALL_1:
+            if unvalid != 0:
+                n_en = 0
+                if col_ct == P - 1:
+                    n_sC, n_col_ct = LAST_1, 0
+                else:
+                    n_sC = COL_FILL
+                    ren, raddr = True, row_ct * P + col_ct + 1
+                    n_col_ct = col_ct + 1
+        elif sC == COL_FILL:
+            n_en, n_sC = 1, SHIFT_1
+            ren, raddr = True, row_ct * P + col_ct + 1
+            n_col_ct = col_ct + 1
+            if dp:
+                n_row = self._load_rows(rdata, R)
+        elif sC == LAST_1:
+            if col_ct >= R - 1:
+                n_en, n_sC = 0, STORE_1
+                n_row = [self._zero] * R
+            else:
+                n_en = 1
+                n_col_ct = col_ct + 1
+                n_row = row[1:] + [self._zero]
+                if unvalid != 0:
+                    # the first shift brings in the block's last column; any later
+                    # one discards a column the CPU already sent for the next block
+                    n_col = col[1:] + [self._zero]
+                    col_shifted = True
+                    n_unvalid = unvalid - 1
+                    if col_ct:
+                        self.events["dropped_columns"] += 1
+        elif sC == STORE_1:
+            if dp:
+                for i in range(R):
+                    for k in range(R):
+                        self.layer1[i][row_ct * R + k] = self.acc[i][k] & MASK32
+            n_clear = 1
+            n_row_ct, n_col_ct = row_ct + 1, 0
+            ren = True
+            if row_ct == self.blocks - 1:
+                n_row_ct, n_sC, n_sS = 0, BIAS_1, CLEAR
+                raddr = self.B1
+            else:
+                raddr = row_ct * P + P
+                n_sC = WAIT_FILL_1
+        elif sC == BIAS_1:
+            if dp:
+                for i in range(R):
+                    self.layer1[i][col_ct] = (self.layer1[i][col_ct] + rdata) & MASK32
+            if col_ct < H - 1:
+                ren, raddr = True, self.B1 + col_ct + 1
+                n_col_ct = col_ct + 1
+            else:
+                n_sC, n_col_ct = RELU, 0
+        elif sC == RELU:
+            if dp:
+                for a in self.layer1:
+                    a[:] = [0 if v & 0x80000000 else v for v in a]
+            n_sC = QUANT
+        elif sC == QUANT:
+            if dp:
+                s = self.shift
+                rnd = (1 << (s - 1)) if s > 0 else 0
+                for a in self.layer1:
+                    a[:] = [min(((v + rnd) & MASK32) >> s, 127) for v in a]
+            n_sS, n_sC = L2_FILL, WAIT_FILL_2
+            ren, raddr = True, self.W2
+        elif sC == WAIT_FILL_2:
+            if dp:
+                n_row = self._load_rows(rdata, C)
+            if unvalid != 0:
+                n_sC = SHIFT_2
+                ren, raddr = True, self.W2 + 1
+                n_col_ct, n_en = 1, 1
+        elif sC == SHIFT_2:
+            if dp:
+                n_row = self._shift_rows(row, rdata, C)
+            n_col = col[1:RTL_ROW_DIM] + [self._zero] + col[RTL_ROW_DIM:]
+            col_shifted = True
+            n_unvalid = (unvalid - 1) & self.uv_mask
+            n_en = 1
+            if col_ct >= H - 1:
+                n_sC, n_col_ct = LAST_2, 0
+            else:
+                ren, raddr = True, self.W2 + col_ct + 1
+                n_col_ct = col_ct + 1
+        elif sC == LAST_2:
+            if col_ct >= C - 1:
+                n_en, n_sC, n_col_ct = 0, STORE_2, 0
+            else:
+                n_en, n_col_ct = 1, col_ct + 1
+        elif sC == STORE_2:
+            if dp:
+                for i in range(R):
+                    self.layer2[i] = [self.acc[i][c] & MASK32 for c in range(C)]
+            n_clear = 1
+            n_sC, n_sS = BIAS_2, CLEAR
+            ren, raddr = True, self.B2
+        elif sC == BIAS_2:
+            if dp:
+                for i in range(R):
+                    self.layer2[i][col_ct] = (self.layer2[i][col_ct] + rdata) & MASK32
+            if col_ct < C - 1:
+                ren, raddr = True, self.B2 + col_ct + 1
+                n_col_ct = col_ct + 1
+            else:
+                n_sC = CLASS_SEND
+        elif sC == CLASS_SEND:
+            n_shape = 1 << 31
+            if dp:
+                for i in range(R):
+                    z = [_s32(v) for v in self.layer2[i]]
+                    n_shape |= 1 << (C - 1 - z.index(max(z))) << (C * i)
+            n_sC = RESET
+        elif sC == RESET:
+            if addr == 0x4 and not lw:
+                # everything but the shift register returns to its reset value
+                self._clear_regs()
+                self.state_entries[IDLE_C] += 1
+                self.cycle += 1
+                return
+
+        # shift state machine (overrides the control block)
+        if sS == REQ:
+            if mreq and addr == 0x8 and not lw:
+                if unvalid == 0:
+                    n_col = self._decode(wdata) + n_col[p:]
+                    n_unvalid, n_req_status = p, 1
+                    self.events["pixel_words"] += 1
+                elif unvalid <= p + 1:
+                    n_col = list(n_col)
+                    n_col[unvalid - 1:unvalid - 1 + p] = self._decode(wdata)
+                    n_unvalid, n_req_status = unvalid + p - 1, 1
+                    self.events["pixel_words"] += 1
+                    self._count_races(sC, unvalid, col_shifted)
+                else:
+                    n_req_status, n_sS = 0, WAIT
+                    self.events["shifter_full"] += 1
+            else:
+                n_req_status = 1
+        elif sS == WAIT:
+            if unvalid <= p + 1:
+                n_col = list(n_col)
+                for j, e in enumerate(self._decode(self.pixel_data)):
+                    if unvalid - 1 + j >= 0:
+                        n_col[unvalid - 1 + j] = e
+                n_unvalid, n_req_status, n_sS = (unvalid + p - 1) & self.uv_mask, 1, REQ
+                self.events["pixel_words"] += 1
+                self._count_races(sC, unvalid, col_shifted)
+        elif sS == CLEAR:
+            n_col = [self._zero] * self.depth
+            n_req_status, n_unvalid = 0, 0
+        elif sS == L2_FILL:
+            ct2 = self.ct2
+            if ct2 < H:
+                if unvalid == 0:
+                    n_col = list(n_col)
+                    n_col[0:L2_FILL_ENTRIES] = [self._hidden_entry(ct2 + j) for j in range(L2_FILL_ENTRIES)]
+                    n_ct2, n_unvalid = ct2 + L2_FILL_ENTRIES, L2_FILL_ENTRIES
+                elif unvalid == 2:
+                    n_col = list(n_col)
+                    n_col[1] = self._hidden_entry(ct2)
+                    n_ct2, n_unvalid = ct2 + 1, 2
+
+        # systolic array (uses the registered en/clear/row/col values)
+        if dp:
+            if self.clear:
+                self.acc = [[0] * R for _ in range(R)]
+                self.skew = [[0] * R for _ in range(R)]
+            elif self.en:
+                c0, rin = col[0], row[0]
+                for i in range(R):
+                    a, s = self.acc[i], self.skew[i]
+                    cin = [c0[i]] + s[1:]
+                    for r in range(R):
+                        a[r] += rin[r] * cin[r]
+                    s[1:] = cin[:-1]
+
+        # wb_1cycle
+        if ren:
+            self.events["mem_reads"] += 1
+        if dp:
+            self.rdata = self.mem[raddr] if ren else 0
+
+        if n_sC != sC:
+            self.state_entries[n_sC] += 1
+        self.stateS, self.stateC = n_sS, n_sC
+        self.col_shift, self.row_shift = n_col, n_row
+        self.unvalid = n_unvalid
+        self.en, self.clear = n_en, n_clear
+        self.col_ct, self.row_ct, self.ct2 = n_col_ct, n_row_ct, n_ct2
+        self.mmio_ack, self.mmio_data_read = n_ack, n_read
+        self.pixel_data, self.req_status = n_pixel, n_req_status
+        self.shift, self.shape = n_shift, n_shape
+        self.lag_ct = n_lag
+        self.cycle += 1
+
+    # -------- one firmware run (ROW_DIM images) --------
+
+    def run_batch(self, words: list[int], shift: int, timing: FeedTiming,
+                  max_cycles: int = 50_000_000) -> dict:
+        """Start, feed every row block, read the shape and ack it. Returns a report dict."""
+        if np.ndim(shift):
+            raise ValueError("the controller has one SHIFT register (0xC); per-row shift tables "
+                             "are not in the RTL yet")
+        self.reset()
+        cpu = Counter()
+        feed = firmware_feed(words, self.blocks, shift, timing, cpu)
+        req = next(feed)
+        layer2 = None
+        while True:
+            if self.stateC == CLASS_SEND:
+                layer2 = [[_s32(v) for v in z] for z in self.layer2]
+            self.step(req)
+            try:
+                req = feed.send(self.mmio_data_read)
+            except StopIteration as stop:
+                shape = stop.value
+                break
+            if self.cycle > max_cycles or (self.stateC == STALL_1 and cpu["shape_polls"]):
+                races = ", ".join(f"{k} {self.events[k]}" for k in RACE_EVENTS)
+                raise RuntimeError(f"controller hung in {STATES_C[self.stateC]} after {self.cycle} cycles "
+                                   f"({races}): the feed timing outruns the controller")
+        return {
+            "cycles": self.cycle,
+            "shape": shape,
+            "layer2": layer2,
+            "state_cycles": {STATES_C[s]: n for s, n in sorted(self.state_cycles.items())},
+            "state_entries": {STATES_C[s]: n for s, n in sorted(self.state_entries.items())},
+            "phases": phase_breakdown(self.state_cycles),
+            "events": dict(self.events) | dict(cpu),
+        }
+
+
+def phase_breakdown(state_cycles: Counter) -> dict:
+    return {name: sum(state_cycles.get(s, 0) for s in states) for name, states in PHASES}
+
+
+# -----------------------------
+# Results + cycle prediction
+# -----------------------------
+
+_PAIRING_CACHE: dict = {}
+
+def layer2_pairing(row_dim: int = 4, hidden: int = 64, classes: int = 3) -> np.ndarray:
+    """
+    Effective layer-2 wiring of the ported RTL: count[c, k, w, h] = how often
+    row c of the array accumulates W2[k, w] * a1q[h] in one SHIFT_2/LAST_2 pass.
+    Found by running only the layer-2 phase with one-hot marker values
+    (each product lands in its own base-256 digit of a Python int).
+    """
+    key = (row_dim, hidden, classes)
+    if key in _PAIRING_CACHE:
+        return _PAIRING_CACHE[key]
+    R, H, C = row_dim, hidden, classes
+    n_w = C * H
+    stride = n_w + 1
+    p = 32 // R
+    w2_markers = [tuple((1 << 8 * (C * h + c)) if c < C else 0 for c in range(R)) for h in range(H)]
+    mem = [(0,) * R] * (H // R * p) + [0] * H + w2_markers + [0] * C
+    sim = TensorControllerSim(R, H, p, C, mem=mem)
+    sim._hidden_entry = lambda h: (tuple(1 << 8 * stride * (h + 1) for _ in range(R))
+                                   if h < H else sim._zero)
+    sim.stateC, sim.stateS = WAIT_FILL_2, L2_FILL
+    sim.rdata = sim.mem[sim.W2]    # what QUANT requested
+    while sim.stateC != STORE_2:
+        sim.step()
+        if sim.cycle > 16 * H + 64:
+            raise RuntimeError("layer-2 pass did not reach STORE_2")
+    count = np.zeros((C, C, H, H), dtype=np.int64)
+    for c in range(C):
+        v, pos = sim.acc[0][c], 0
+        while v:
+            d = v & 0xFF
+            if d:
+                wid, hh = pos % stride, pos // stride - 1
+                count[c, wid % C, wid // C, hh] += d
+            v >>= 8
+            pos += 1
+    _PAIRING_CACHE[key] = count
+    return count
+
+def rtl_infer_batch(x_bits: np.ndarray, w1, b1, w2, b2, shift: int, row_dim: int = 4):
+    """
+    NumPy twin of what the ported datapath computes: int_engine layer 1 +
+    requant, layer 2 through the RTL's effective wiring (layer2_pairing),
+    first-max argmax (CLASS_SEND's circle > square > line priority).
+    Returns (logits int32, pred int64).
+    """
+    from int_engine import IntMLP, requant_relu_np
+
+    eng = IntMLP(w1, b1, w2, b2, shift)
+    a1q = requant_relu_np(np.maximum(eng.layer1(np.asarray(x_bits, dtype=np.uint8)), 0), shift)
+    count = layer2_pairing(row_dim, eng.hidden, eng.w2.shape[0])
+    eff = np.einsum("ckwh,kw->ch", count, eng.w2.astype(np.int64))
+    logits = (a1q.astype(np.int64) @ eff.T + eng.b2).astype(np.int32)
+    return logits, np.argmax(logits, axis=1)
+
+def decode_shape(shape: int, row_dim: int = 4, classes: int = 3) -> list[int]:
+    """Class index per array column from the one-hot shape word (100 = class 0)."""
+    out = []
+    for i in range(row_dim):
+        f = (shape >> (classes * i)) & ((1 << classes) - 1)
+        out.append(classes - f.bit_length() if f else -1)
+    return out
+
+_BATCH_CACHE: dict = {}
+
+def batch_report(row_dim=4, hidden=64, in_dim=3600, classes=3, bus_bits=32,
+                 timing: FeedTiming | None = None) -> dict:
+    """
+    Cycle report of one batch (counters only; the schedule is data-independent).
+    rep["layer2_ported"] is False for row_dim != RTL_ROW_DIM: cycles only, no
+    layer-2 datapath behind them.
+    """
+    timing = timing or FeedTiming()
+    key = (row_dim, hidden, in_dim, classes, bus_bits, tuple(sorted(timing.as_dict().items())))
+    if key not in _BATCH_CACHE:
+        sim = TensorControllerSim(row_dim, hidden, in_dim, classes, bus_bits)
+        words = [0] * (in_dim // sim.p)
+        _BATCH_CACHE[key] = sim.run_batch(words, 0, timing)
+        _BATCH_CACHE[key]["layer2_ported"] = row_dim == RTL_ROW_DIM
+    return _BATCH_CACHE[key]
+
+def tc_infer_batch(x_bits: np.ndarray, w1, b1, w2, b2, shift: int, row_dim: int = 4,
+                   timing: FeedTiming | None = None, datapath: bool = False):
+    """
+    (logits int32 (N, C), pred (N,), report) for N images of 0/1 pixels.
+    Images go through the array row_dim at a time (the last batch is zero-padded).
+    datapath=True takes logits/pred from the ported RTL instead of rtl_infer_batch
+    (forced when the feed timing drops or overwrites pixel columns).
+    """
+    x_bits = np.asarray(x_bits, dtype=np.uint8)
+    w1 = np.asarray(w1)
+    n = x_bits.shape[0]
+    H, P = w1.shape
+    C = np.asarray(w2).shape[0]
+    rep = batch_report(row_dim, H, P, C, timing=timing)
+    n_batches = -(-n // row_dim)
+    report = {
+        "batches": n_batches,
+        "cycles_per_batch": rep["cycles"],
+        "cycles": rep["cycles"] * n_batches,
+        "cycles_per_image": rep["cycles"] * n_batches / max(n, 1),
+        "phases": {k: v * n_batches for k, v in rep["phases"].items()},
+    }
+    ev = rep["events"]
+    if not datapath and not any(ev.get(k) for k in RACE_EVENTS):
+        logits, pred = rtl_infer_batch(x_bits, w1, b1, w2, b2, shift, row_dim)
+        return logits, pred, report
+
+    sim = TensorControllerSim(row_dim, H, P, C, mem=build_tensor_mem(w1, b1, w2, b2, row_dim))
+    xp = np.zeros((n_batches * row_dim, P), dtype=np.uint8)
+    xp[:n] = x_bits
+    logits = np.empty((n_batches * row_dim, C), dtype=np.int32)
+    pred = np.empty(n_batches * row_dim, dtype=np.int64)
+    for b in range(n_batches):
+        blk = xp[b * row_dim:(b + 1) * row_dim]
+        out = sim.run_batch(pixel_words(blk, row_dim), shift, timing or FeedTiming())
+        if out["cycles"] != rep["cycles"]:
+            raise RuntimeError("datapath and counter-only runs disagree on the cycle count")
+        logits[b * row_dim:(b + 1) * row_dim] = out["layer2"]
+        pred[b * row_dim:(b + 1) * row_dim] = decode_shape(out["shape"], row_dim, C)
+    return logits[:n], pred[:n], report
+
+def memory_words(row_dim=4, hidden=64, in_dim=3600, classes=3, w1_bits: int = 8) -> int:
+    """Tensor memory depth (weights.memh lines) for a configuration; w1_bits < 8 = packed W1."""
+    return hidden // row_dim * in_dim * w1_bits // 8 + 2 * hidden + classes
+
+def precision_projection(w1_bits: int, row_dim=4, hidden=64, in_dim=3600, classes=3,
+                         bus_bits=32, timing: FeedTiming | None = None) -> dict:
+    """
+    Projected cost of W1 packed at w1_bits (weight_to_memh.py --w1_bits): every
+    W1 fetch carries 8/w1_bits columns per row.
+      feed_bound : unchanged -- the CPU pixel feed, not the weight stream, sets the pace
+      mac_bound  : SHIFT_1 cycles divided by 8/w1_bits, i.e. an array that consumes
+                   a whole fetched word per cycle, as if the feed kept up
+    Cycles only; layer2_ported as in batch_report.
+    """
+    rep = batch_report(row_dim, hidden, in_dim, classes, bus_bits, timing)
+    ph = rep["phases"]
+    other = rep["cycles"] - ph["l1_mac"] - ph["l1_feed_wait"]
+    w1_reads = hidden // row_dim * in_dim
+    return {
+        "mem_words": memory_words(row_dim, hidden, in_dim, classes, w1_bits),
+        "w1_fetches": w1_reads * w1_bits // 8,
+        "feed_bound_cycles": rep["cycles"],
+        "mac_bound_cycles": other + ph["l1_mac"] * w1_bits // 8,
+        "layer2_ported": rep["layer2_ported"],
+    }
+
+def sparse_projection(keep: np.ndarray, row_dim: int = 4, classes: int = 3, bus_bits: int = 32,
+                      timing: FeedTiming | None = None) -> dict:
+    """
+    Projected words/cycles if the controller and firmware skip pruned W1 columns
+    (weight_to_memh.py --sparse layout). keep: (hidden/row_dim, in_dim) bool,
+    True where the row block's W1 word is stored.
+
+    Per row block the firmware only sends pixel words with at least one kept
+    column. Both layer-1 phases are scaled from the dense batch_report:
+      feed_bound : every sent word costs what it costs today (the CPU feed,
+                   not the array, sets the pace)
+      mac_bound  : one SHIFT_1 per kept column plus the per-word overhead, as
+                   if the feed kept up
+    """
+    keep = np.asarray(keep, dtype=bool)
+    G, P = keep.shape
+    hidden = G * row_dim
+    p = bus_bits // row_dim
+    rep = batch_report(row_dim, hidden, P, classes, bus_bits, timing)
+    ph, n_words = rep["phases"], rep["events"]["pixel_words"]
+    l1 = ph["l1_mac"] + ph["l1_feed_wait"]
+    other = rep["cycles"] - l1
+
+    kept_cols = int(keep.sum())
+    kept_words = int(keep.reshape(G, P // p, p).any(axis=2).sum())
+    feed_bound = other + kept_words * l1 / n_words
+    mac_bound = other + kept_cols + kept_words * (ph["l1_mac"] / n_words - p)
+    dense_mem = memory_words(row_dim, hidden, P, classes)
+    sparse_mem = G * -(-P // 32) + G + 1 + kept_cols + 2 * hidden + classes
+    return {
+        "kept_cols": kept_cols, "kept_pixel_words": kept_words, "pixel_words": n_words,
+        "dense_cycles": rep["cycles"], "feed_bound_cycles": int(round(feed_bound)),
+        "dense_mac_bound_cycles": other + ph["l1_mac"], "mac_bound_cycles": int(round(mac_bound)),
+        "dense_mem_words": dense_mem, "sparse_mem_words": sparse_mem,
+    }
+
+
+# -----------------------------
+# Testbench log comparison
+# -----------------------------
+
+_TB_TRANSITION = re.compile(r"stateC transition from\s+(\d+) to\s+(\d+)")
+
+def parse_tb_log(path: str) -> dict:
+    """
+    Counts from a tb_integratedTC run log: '1k cycles passed' ticks (cycle count
+    to 1000-cycle resolution), TC loads/stores and stateC transitions.
+    """
+    ticks, loads, stores = 0, 0, 0
+    trans = Counter()
+    for line in Path(path).read_text(encoding="utf-8", errors="replace").splitlines():
+        if "1k cycles passed" in line:
+            ticks += 1
+        elif "Load from tc addr" in line:
+            loads += 1
+        elif "Store to tc addr" in line:
+            stores += 1
+        else:
+            m = _TB_TRANSITION.search(line)
+            if m:
+                trans[(int(m.group(1)), int(m.group(2)))] += 1
+    entries = Counter()
+    for (_, dst), k in trans.items():
+        entries[STATES_C[dst] if dst < len(STATES_C) else str(dst)] += k
+    return {"cycles_min": ticks * 1000, "cycles_max": ticks * 1000 + 999,
+            "tc_loads": loads, "tc_stores": stores, "state_entries": dict(entries)}
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+
+def _print_report(rep: dict, row_dim: int) -> None:
+    cyc = rep["cycles"]
+    print(f"cycles per batch of {row_dim} images: {cyc}  ({cyc / row_dim:.0f} per image)")
+    for name, n in rep["phases"].items():
+        print(f"  {name:13s} {n:9d}  {100 * n / cyc:5.1f}%")
+    ev = rep["events"]
+    print(f"  MAC-enabled cycles {ev.get('en_cycles', 0)} ({100 * ev.get('en_cycles', 0) / cyc:.1f}%), "
+          f"pixel words {ev.get('pixel_words', 0)}, polls {ev.get('polls', 0)} "
+          f"({ev.get('poll_misses', 0)} missed), tensor-mem reads {ev.get('mem_reads', 0)}, "
+          f"shifter-full stores {ev.get('shifter_full', 0)}")
+    print("  feed races: " + ", ".join(f"{k} {ev.get(k, 0)}" for k in RACE_EVENTS))
+
+def main():
+    ap = argparse.ArgumentParser(description="Cycle model of tensor_controller + systolic_array.")
+    ap.add_argument("--weights_dir", type=str, default=str(BASE_DIR))
+    ap.add_argument("--check", type=int, default=8,
+                    help="images to push through the full datapath port and compare with int_engine (0 = skip)")
+    ap.add_argument("--compare", type=int, default=30000,
+                    help="images for the RTL-vs-int_engine agreement numbers")
+    ap.add_argument("--row_dims", type=int, nargs="+", default=[4, 8, 16],
+                    help="ROW_DIM values for the exploration table")
+    ap.add_argument("--hiddens", type=int, nargs="+", default=[32, 64, 128])
+    ap.add_argument("--tb_log", type=str, default="", help="tb_integratedTC output to compare against")
+    ap.add_argument("--seed", type=int, default=0)
+    for k, v in FeedTiming().as_dict().items():
+        ap.add_argument(f"--{k}", type=int, default=v, help="firmware timing estimate (cycles)")
+    args = ap.parse_args()
+    timing = FeedTiming(**{k: getattr(args, k) for k in FeedTiming().as_dict()})
+
+    from int_engine import load_txt_weights
+    w1, b1, w2, b2, shift = load_txt_weights(args.weights_dir)
+
+    # the port's memory image must be the file the RTL loads
+    memh = BASE_DIR / "weights.memh"
+    if memh.exists():
+        want = [int(t, 16) for t in memh.read_text(encoding="utf-8").split()]
+        got = mem_words_u32(build_tensor_mem(w1, b1, w2, b2))
+        print(f"memory image == {memh.name}: {got == want[:len(got)] and len(want) >= len(got)}")
+
+    t0 = time.perf_counter()
+    rep = batch_report(timing=timing)
+    print(f"\nRTL configuration (ROW_DIM=4, hidden=64, 3600 inputs), counters only "
+          f"[{time.perf_counter() - t0:.2f}s]")
+    _print_report(rep, 4)
+
+    if args.check:
+        from datagen import make_dataset_sharded, unpack_images
+        from int_engine import IntMLP
+
+        P, y = make_dataset_sharded(max(args.check, args.compare) // 3 + 1, seed=args.seed,
+                                    workers=1, packed=True)
+        x = unpack_images(P[:args.check])
+        t0 = time.perf_counter()
+        logits, pred, _ = tc_infer_batch(x, w1, b1, w2, b2, shift, timing=timing, datapath=True)
+        rtl_logits, rtl_pred = rtl_infer_batch(x, w1, b1, w2, b2, shift)
+        print(f"\ndatapath port on {len(x)} images [{time.perf_counter() - t0:.1f}s]: "
+              f"logits == rtl_infer_batch {np.array_equal(logits, rtl_logits)}, "
+              f"shape word == argmax {np.array_equal(pred, rtl_pred)}")
+
+        x = unpack_images(P[:args.compare])
+        rtl_logits, rtl_pred = rtl_infer_batch(x, w1, b1, w2, b2, shift)
+        ref_logits, ref_pred = IntMLP(w1, b1, w2, b2, shift).infer(x)
+        y = y[:args.compare]
+        print(f"RTL vs int_engine on {len(x)} images: logits equal {np.mean(np.all(rtl_logits == ref_logits, 1)):.2%}, "
+              f"pred equal {np.mean(rtl_pred == ref_pred):.2%}, "
+              f"acc RTL {np.mean(rtl_pred == y):.2%} / int_engine {np.mean(ref_pred == y):.2%}")
+        count = layer2_pairing()
+        ideal = np.zeros_like(count)
+        for c in range(count.shape[0]):
+            ideal[c, c] = np.eye(count.shape[2], dtype=np.int64)
+        print(f"layer-2 products that differ from W2 @ a1q: {int(np.abs(count - ideal).sum())}")
+
+    print(f"\n{'ROW_DIM':>7s} {'hidden':>6s} {'cycles/batch':>12s} {'cycles/img':>10s} "
+          f"{'MAC util':>8s} {'mem words':>9s}  layer 2")
+    for R in args.row_dims:
+        for H in args.hiddens:
+            try:
+                r = batch_report(R, H, timing=timing)
+            except ValueError as exc:
+                print(f"{R:7d} {H:6d}  skipped: {exc}")
+                continue
+            util = r["events"].get("en_cycles", 0) / r["cycles"]
+            print(f"{R:7d} {H:6d} {r['cycles']:12d} {r['cycles'] / R:10.0f} "
+                  f"{100 * util:7.1f}% {memory_words(R, H):9d}  {'ported' if r['layer2_ported'] else 'cycles only'}")
+    print(f"layer 2 'cycles only': no RTL for the ROW_DIM != {RTL_ROW_DIM} layer-2 column fill; the cycle "
+          f"count assumes the same schedule, results are not modelled")
+
+    if args.tb_log:
+        tb = parse_tb_log(args.tb_log)
+        print(f"\ntestbench log {args.tb_log}:")
+        print(f"  cycles {tb['cycles_min']}..{tb['cycles_max']} (model {rep['cycles']} from the start "
+              f"store; the log also covers the firmware's image load)")
+        print(f"  TC stores {tb['tc_stores']} (model {rep['events'].get('pixel_stores', 0) + 3}), "
+              f"TC loads {tb['tc_loads']} (model {rep['events'].get('polls', 0) + rep['events'].get('shape_polls', 0)})")
+        for name in STATES_C:
+            if name in tb["state_entries"] or name in rep["state_entries"]:
+                print(f"  entries into {name:12s} {tb['state_entries'].get(name, 0):7d} "
+                      f"(model {rep['state_entries'].get(name, 0)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Equivalence and round-trip checks for the integer pipeline:
+  * every integer backend matches the "reference" backend (model.check_int_backends)
+  * pack_weights / memh_bytes give the same text as the original per-word
+    build_memh_lines exporter (kept below as the oracle)
+  * MemhImage / load_memh read back what write_memh wrote, incl. weights.memh
+  * ShiftHistogram picks the same SHIFT as the original torch choose_shift
+  * int4 / ternary W1 packing round-trips through load_memh
+  * the ported RTL datapath (tc_model) matches rtl_infer_batch
+
+Run from mlp_model/:  python -m pytest -q
+
+Only deps: numpy, torch, pytest
+"""
+
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+
+import model
+from calibration import ShiftHistogram, choose_shift
+from int_engine import MemhImage, load_memh
+from tc_model import rtl_infer_batch, tc_infer_batch
+from weight_to_memh import memh_bytes, pack_weights, write_memh
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+# -----------------------------
+# Original implementations (oracles)
+# -----------------------------
+
+def old_build_memh_lines(w1, w2, b1, b2) -> list[str]:
+    """weight_to_memh.build_memh_lines before the vectorized exporter (64x3600 net)."""
+    lines = []
+    for row_base in range(0, 64, 4):
+        for col in range(3600):
+            word = 0
+            for k in range(4):
+                word |= (int(w1[row_base + k][col]) & 0xFF) << (8 * k)
+            lines.append(f"{word:08x}")
+    lines += [f"{int(v) & 0xFFFFFFFF:08x}" for v in b1]
+    for col in range(64):
+        word = 0
+        for k in range(3):
+            word |= (int(w2[k][col]) & 0xFF) << (8 * k)
+        lines.append(f"{word:08x}")
+    lines += [f"{int(v) & 0xFFFFFFFF:08x}" for v in b2]
+    return lines
+
+
+def old_choose_shift(calib_a1_int32: torch.Tensor, shift_min=0, shift_max=20):
+    """model.choose_shift before ShiftHistogram: one torch pass per candidate SHIFT."""
+    best = None
+    for s in range(shift_min, shift_max + 1):
+        a_q = model.requant_relu_int32_to_int8(calib_a1_int32, s).to(torch.int16)
+        sat = (a_q == 127).float().mean().item()
+        nz = (a_q > 0).float().mean().item()
+        mean = a_q.float().mean().item()
+        target_mean = 24.0
+        obj = (sat * 10.0) + (max(0.0, 0.20 - nz) * 3.0) + (abs(mean - target_mean) / target_mean)
+        if best is None or obj < best[1]:
+            best = (s, obj)
+    return best[0]
+
+
+# -----------------------------
+# Fixtures
+# -----------------------------
+
+def random_weights(seed: int, hidden: int = 64, in_dim: int = 3600, classes: int = 3):
+    rng = np.random.default_rng(seed)
+    w1 = rng.integers(-128, 128, (hidden, in_dim), dtype=np.int8)
+    b1 = rng.integers(-2**31, 2**31, hidden, dtype=np.int64).astype(np.int32)
+    w2 = rng.integers(-128, 128, (classes, hidden), dtype=np.int8)
+    b2 = rng.integers(-2**31, 2**31, classes, dtype=np.int64).astype(np.int32)
+    return w1, b1, w2, b2
+
+
+def random_images(seed: int, n: int, in_dim: int = 3600) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return (rng.random((n, in_dim)) < rng.random((n, 1))).astype(np.uint8)
+
+
+# -----------------------------
+# Tests
+# -----------------------------
+
+def test_int_backends_match_reference():
+    model.check_int_backends(rows=16)
+
+
+def test_pack_weights_matches_build_memh_lines():
+    w1, b1, w2, b2 = random_weights(0)
+    old = "".join(line + "\n" for line in old_build_memh_lines(w1, w2, b1, b2))
+    assert memh_bytes(pack_weights(w1, b1, w2, b2)) == old.encode("ascii")
+
+
+@pytest.mark.parametrize("with_shifts", [False, True])
+def test_memh_image_round_trip(tmp_path, with_shifts):
+    w1, b1, w2, b2 = random_weights(1)
+    shifts = np.random.default_rng(1).integers(0, 21, 64) if with_shifts else None
+    path = tmp_path / "weights.memh"
+    write_memh(path, pack_weights(w1, b1, w2, b2, shifts))
+
+    img = MemhImage(path)
+    assert np.array_equal(img.w1(), w1)
+    assert np.array_equal(img.b1, b1) and np.array_equal(img.w2, w2) and np.array_equal(img.b2, b2)
+    for i, a in enumerate(load_memh(path)[:4]):
+        assert np.array_equal(a, (w1, b1, w2, b2)[i])
+    if with_shifts:
+        assert np.array_equal(img.shifts, shifts)
+    else:
+        assert img.shifts is None
+
+
+def test_repo_weights_memh_round_trip(tmp_path):
+    src = BASE_DIR / "weights.memh"
+    if not src.exists():
+        pytest.skip("no weights.memh export")
+    path = tmp_path / src.name                 # keep the weights.bin cache out of the tree
+    shutil.copy(src, path)
+    img = MemhImage(path)
+    words = pack_weights(img.w1(), img.b1, img.w2, img.b2, img.shifts)
+    assert memh_bytes(words) == src.read_bytes()
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_shift_histogram_matches_torch_choose_shift(seed):
+    g = torch.Generator().manual_seed(seed)
+    scale = 2 ** (4 + 3 * seed)
+    a1 = torch.relu(torch.randn(256, 64, generator=g) * scale).round().to(torch.int32)
+    assert choose_shift(a1.numpy())[0] == old_choose_shift(a1)
+
+    hist = ShiftHistogram()
+    for chunk in a1.split(100):
+        hist.update(chunk)
+    assert hist.choose()[0] == old_choose_shift(a1)
+
+
+@pytest.mark.parametrize("w1_bits", [4, 2])
+def test_low_bit_w1_round_trip(tmp_path, w1_bits):
+    w1, b1, w2, b2 = random_weights(2)
+    lo = -(1 << (w1_bits - 1))
+    w1 = np.clip(w1, lo, -lo - 1) if w1_bits == 4 else np.sign(w1).astype(np.int8)
+    path = tmp_path / "weights_packed.memh"
+    write_memh(path, pack_weights(w1, b1, w2, b2, w1_bits=w1_bits))
+
+    got = load_memh(path, w1_bits=w1_bits)
+    for a, b in zip(got[:4], (w1, b1, w2, b2)):
+        assert np.array_equal(a, b)
+    assert got[4] is None
+
+
+@pytest.mark.parametrize("seed", [0, 1, 3])   # predicts class 2, 1, 0
+def test_rtl_datapath_matches_rtl_infer_batch(seed):
+    w1, b1, w2, b2 = random_weights(seed, hidden=16, in_dim=256)
+    w1 = (w1 // 8).astype(np.int8)
+    b1 = (b1 >> 20).astype(np.int32)
+    b2 = (b2 >> 28).astype(np.int32)
+    x = random_images(seed, 6, in_dim=256)
+    ref_logits, ref_pred = rtl_infer_batch(x, w1, b1, w2, b2, shift=6)
+    logits, pred, _ = tc_infer_batch(x, w1, b1, w2, b2, shift=6, datapath=True)
+    assert np.array_equal(logits, ref_logits)
+    assert np.array_equal(pred, ref_pred)
@@ -7,7 +7,8 @@ Generate weights.memh from:
   4) b2_int32.txt  : 1 line (or multiple lines), total 3 signed int32 values
 
 Output:
-  weights.memh
+  weights.memh  (one 8-digit hex word per line, $readmemh)
+  weights.bin   (--bin: the same words as raw little-endian uint32, np.memmap-able)
 
 Packing format:
 - W1 first:
@@ -34,21 +35,64 @@ Packing format:
     3 int32 values, one 32-bit word per line
 
 Total output lines: 57731
+
+- Shift table (only when SHIFT.txt holds one shift per row, model.py --per_channel):
+    64 words after b2, 57731 .. 57794, word h = requant shift of hidden unit h
+    Total output lines: 57795
+
+Packed W1 (--w1_bits 4 or 2 -> weights_int4.memh / weights_ternary.memh), for
+W1 values that fit the field (model.py --w1_quant int4 / ternary):
+    Each word still holds one byte per row of a 4-row group, but every byte
+    carries 8/bits consecutive columns, column 0 in the low bits, as two's
+    complement fields:
+      4-bit: row k byte = col(2j) | col(2j+1) << 4            -> 28800 W1 words
+      2-bit: row k byte = col(4j) | col(4j+1) << 2 | ...      -> 14400 W1 words
+    b1, W2, b2 (and the shift table) follow unchanged.
+
+Sparse format (--sparse -> weights_sparse.memh), for a W1 pruned in 4-row blocks:
+  a W1 word whose 4 bytes are all zero is not stored; everything else keeps
+  the packing above.
+- Column bitmaps: 16 groups * 113 words, 0 .. 1807
+    bit (col % 32) of word (group * 113 + col // 32) = 1 -> column stored
+- Group bases: 17 words, 1808 .. 1824
+    address of each group's first stored W1 word; entry 16 = address of b1
+- W1 stored words: group by group, ascending column, from 1825
+- b1, W2, b2 (and the shift table) as above, right after the W1 words
+int_engine.load_sparse_memh() reads it back; --bin also writes weights_sparse.bin.
+
+Packing is vectorized (NumPy views and shifts over whole matrices), so the
+conversion takes milliseconds. Other scripts can pack in memory with
+pack_weights() / pack_sparse_weights() and write with write_memh() / write_bin()
+(model.py does, so a training run already leaves weights.memh behind).
+
+Only deps: numpy, standard library
 """
 
+import argparse
+import time
 from pathlib import Path
 
+import numpy as np
+
 BASE_DIR = Path(__file__).resolve().parent
 
 W1_FILE = BASE_DIR / "W1_int8.txt"
 W2_FILE = BASE_DIR / "W2_int8.txt"
 B1_FILE = BASE_DIR / "b1_int32.txt"
 B2_FILE = BASE_DIR / "b2_int32.txt"
+SHIFT_FILE = BASE_DIR / "SHIFT.txt"
 OUT_FILE = BASE_DIR / "weights.memh"
+SPARSE_OUT_FILE = BASE_DIR / "weights_sparse.memh"
+
+ROW_DIM = 4
+BITMAP_WORDS = (3600 + 31) // 32
 
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+_INT8_STR = np.array([str(v) for v in range(-128, 128)], dtype=object)
 
-def read_all_ints(path: str) -> list[int]:
-    """Read all whitespace-separated integers from a text file."""
+
+def read_all_ints(path: str) -> np.ndarray:
+    """Read all whitespace-separated integers from a text file (int64)."""
     try:
         text = Path(path).read_text(encoding="utf-8")
     except FileNotFoundError:
@@ -56,16 +100,14 @@ def read_all_ints(path: str) -> list[int]:
     except OSError as exc:
         raise OSError(f"Could not read file {path}: {exc}") from exc
 
-    vals: list[int] = []
-    for tok in text.split():
-        try:
-            vals.append(int(tok))
-        except ValueError as exc:
-            raise ValueError(f"Invalid integer '{tok}' in file {path}") from exc
-    return vals
+    # C-level parse; out-of-range values saturate and fail the int8/int32 checks later
+    try:
+        return np.fromstring(text, dtype=np.int64, sep=" ")
+    except ValueError as exc:
+        raise ValueError(f"Invalid integer in file {path}: {exc}") from exc
 
 
-def read_matrix(path: str, rows: int, cols: int) -> list[list[int]]:
+def read_matrix(path: str, rows: int, cols: int) -> np.ndarray:
     """Read a matrix with exactly rows*cols integers, allowing arbitrary whitespace."""
     vals = read_all_ints(path)
     expected = rows * cols
@@ -74,16 +116,10 @@ def read_matrix(path: str, rows: int, cols: int) -> list[list[int]]:
             f"{path}: expected {expected} integers for a {rows}x{cols} matrix, "
             f"but found {len(vals)}"
         )
+    return vals.reshape(rows, cols)
 
-    out: list[list[int]] = []
-    idx = 0
-    for _ in range(rows):
-        out.append(vals[idx:idx + cols])
-        idx += cols
-    return out
 
-
-def read_vector(path: str, length: int) -> list[int]:
+def read_vector(path: str, length: int) -> np.ndarray:
     """Read exactly length integers from a text file, allowing arbitrary whitespace."""
     vals = read_all_ints(path)
     if len(vals) != length:
@@ -93,129 +129,216 @@ def read_vector(path: str, length: int) -> list[int]:
     return vals
 
 
-def check_int8(val: int, name: str) -> None:
-    if not (-128 <= val <= 127):
-        raise ValueError(f"{name}: value {val} is out of signed int8 range")
-
-
-def check_int32(val: int, name: str) -> None:
-    if not (-2**31 <= val <= 2**31 - 1):
-        raise ValueError(f"{name}: value {val} is out of signed int32 range")
-
-
-def int8_to_u8(val: int) -> int:
-    """Convert signed int8 to unsigned 8-bit two's-complement representation."""
-    check_int8(val, "int8")
-    return val & 0xFF
-
-
-def int32_to_u32(val: int) -> int:
-    """Convert signed int32 to unsigned 32-bit two's-complement representation."""
-    check_int32(val, "int32")
-    return val & 0xFFFFFFFF
-
-
-def word_to_hex(word: int) -> str:
-    """Format a 32-bit word as 8 hex digits."""
-    return f"{word & 0xFFFFFFFF:08x}"
-
-
-def build_memh_lines(
-    w1: list[list[int]],
-    w2: list[list[int]],
-    b1: list[int],
-    b2: list[int],
-) -> list[str]:
-    lines: list[str] = []
-
-    # -------------------------
-    # W1: 64 x 3600 int8
-    # Pack 4 rows at a time.
-    # For each column:
-    #   row0 -> bits [7:0]
-    #   row1 -> bits [15:8]
-    #   row2 -> bits [23:16]
-    #   row3 -> bits [31:24]
-    # -------------------------
-    for row_base in range(0, 64, 4):
-        for col in range(3600):
-            b0 = int8_to_u8(w1[row_base + 0][col])
-            b1_ = int8_to_u8(w1[row_base + 1][col])
-            b2_ = int8_to_u8(w1[row_base + 2][col])
-            b3 = int8_to_u8(w1[row_base + 3][col])
-
-            word = (
-                b0
-                | (b1_ << 8)
-                | (b2_ << 16)
-                | (b3 << 24)
-            )
-            lines.append(word_to_hex(word))
-
-    # -------------------------
-    # b1: 64 int32
-    # One 32-bit word per line
-    # -------------------------
-    for val in b1:
-        lines.append(word_to_hex(int32_to_u32(val)))
-
-    # -------------------------
-    # W2: 3 x 64 int8
-    # For each column:
-    #   row0 -> bits [7:0]
-    #   row1 -> bits [15:8]
-    #   row2 -> bits [23:16]
-    #   bits [31:24] = 0
-    # -------------------------
-    for col in range(64):
-        b0 = int8_to_u8(w2[0][col])
-        b1_ = int8_to_u8(w2[1][col])
-        b2_ = int8_to_u8(w2[2][col])
-
-        word = (
-            b0
-            | (b1_ << 8)
-            | (b2_ << 16)
-        )
-        lines.append(word_to_hex(word))
+def check_range(arr, lo: int, hi: int, name: str) -> None:
+    arr = np.asarray(arr)
+    bad = (arr < lo) | (arr > hi)
+    if bad.any():
+        raise ValueError(f"{name}: value {arr[bad].flat[0]} is out of range {lo}..{hi}")
+
+
+def as_int8(arr, name: str) -> np.ndarray:
+    check_range(arr, -128, 127, name)
+    return np.asarray(arr).astype(np.int8)
+
+
+def as_int32(arr, name: str) -> np.ndarray:
+    check_range(arr, -2**31, 2**31 - 1, name)
+    return np.asarray(arr).astype(np.int32)
+
+
+def pack_rows(m: np.ndarray, bits: int = 8) -> np.ndarray:
+    """
+    (ROW_DIM*G, C) int8 -> (G, C*bits/8) uint32: one word per column (8/bits
+    columns for bits < 8) of each ROW_DIM-row group, row k of the group in byte k
+    (row0 = LSB).
+    """
+    g = m.shape[0] // ROW_DIM
+    rows = m.reshape(g, ROW_DIM, -1)
+    if bits < 8:
+        per = 8 // bits
+        fields = (rows.view(np.uint8) & ((1 << bits) - 1)).reshape(g, ROW_DIM, -1, per)
+        rows = np.bitwise_or.reduce(fields << (bits * np.arange(per, dtype=np.uint8)), axis=3)
+    cols = rows.transpose(0, 2, 1)                            # (G, words, 4) bytes
+    return np.ascontiguousarray(cols).view("<u4")[..., 0]
+
+
+def pack_weights(w1, b1, w2, b2, shifts=None, w1_bits: int = 8) -> np.ndarray:
+    """
+    weights.memh contents as a uint32 array (layout in the module docstring).
+    shifts: optional per-row requant shifts, appended as the shift table.
+    w1_bits: 8, or 4 / 2 for the packed W1 layout.
+    """
+    if w1_bits not in (8, 4, 2):
+        raise ValueError("w1_bits must be 8, 4 or 2")
+    check_range(w1, -(1 << (w1_bits - 1)), (1 << (w1_bits - 1)) - 1, f"W1 ({w1_bits}-bit)")
+    w1 = as_int8(w1, "W1")
+    w2 = as_int8(w2, "W2")
+    b1 = as_int32(np.reshape(b1, -1), "b1")
+    b2 = as_int32(np.reshape(b2, -1), "b2")
+
+    # W2 columns carry the class rows in the low bytes, upper bytes zero
+    w2p = np.zeros((ROW_DIM, w2.shape[1]), dtype=np.int8)
+    w2p[:w2.shape[0]] = w2
+    parts = [
+        pack_rows(w1, w1_bits).reshape(-1),
+        b1.view(np.uint32),
+        pack_rows(w2p).reshape(-1),
+        b2.view(np.uint32),
+    ]
+    if shifts is not None:
+        shifts = np.reshape(shifts, -1)
+        if len(shifts) != w1.shape[0]:
+            raise ValueError(f"shift table: expected {w1.shape[0]} per-row shifts, got {len(shifts)}")
+        check_range(shifts, 0, 31, "SHIFT")  # 5-bit shift field, as the TC's 0xC register
+        parts.append(shifts.astype(np.uint32))
+    return np.concatenate(parts).astype("<u4", copy=False)
+
+
+def pack_sparse_weights(w1, b1, w2, b2, shifts=None) -> tuple[np.ndarray, int]:
+    """Sparse layout (see the module docstring) as uint32. Returns (words, stored W1 words)."""
+    dense = pack_weights(w1, b1, w2, b2, shifts)
+    groups = np.shape(w1)[0] // ROW_DIM
+    cols = np.shape(w1)[1]
+    n_w1 = groups * cols
+    w1_words = dense[:n_w1].reshape(groups, cols)
+
+    keep = w1_words != 0
+    n_bm = -(-cols // 32)
+    padded = np.zeros((groups, n_bm * 32), dtype=bool)
+    padded[:, :cols] = keep
+    bitmaps = np.packbits(padded, axis=1, bitorder="little").view("<u4").reshape(-1)
+
+    header = groups * n_bm + groups + 1
+    counts = keep.sum(axis=1)
+    bases = (header + np.concatenate([[0], np.cumsum(counts)])).astype("<u4")
+    stored = w1_words[keep]                                   # group-major, ascending column
+    return np.concatenate([bitmaps, bases, stored, dense[n_w1:]]).astype("<u4", copy=False), int(counts.sum())
+
+
+def memh_bytes(words: np.ndarray) -> bytes:
+    """One lowercase 8-digit hex word per line, built with one vectorized lookup."""
+    be = np.asarray(words, dtype="<u4").astype(">u4").view(np.uint8).reshape(-1, 4)
+    out = np.empty((be.shape[0], 9), dtype=np.uint8)
+    out[:, 0:8:2] = _HEX_DIGITS[be >> 4]
+    out[:, 1:8:2] = _HEX_DIGITS[be & 0xF]
+    out[:, 8] = ord("\n")
+    return out.tobytes()
+
+
+def write_memh(path, words: np.ndarray) -> None:
+    try:
+        Path(path).write_bytes(memh_bytes(words))
+    except OSError as exc:
+        raise OSError(f"Could not write output file {path}: {exc}") from exc
 
-    # -------------------------
-    # b2: 3 int32
-    # One 32-bit word per line
-    # -------------------------
-    for val in b2:
-        lines.append(word_to_hex(int32_to_u32(val)))
 
-    return lines
+def write_bin(path, words: np.ndarray) -> None:
+    """Raw little-endian uint32; np.memmap(path, dtype='<u4') maps it back."""
+    try:
+        np.asarray(words, dtype="<u4").tofile(path)
+    except OSError as exc:
+        raise OSError(f"Could not write output file {path}: {exc}") from exc
+
+
+def packed_out_file(w1_bits: int) -> Path:
+    return BASE_DIR / {4: "weights_int4.memh", 2: "weights_ternary.memh"}[w1_bits]
+
+
+def write_ints_txt(path, arr) -> None:
+    """
+    Text export format read above (one matrix row per line, space-separated).
+    int8 rows are formatted through a lookup table, everything else via str().
+    """
+    arr = np.asarray(arr)
+    rows = arr.reshape(1, -1) if arr.ndim == 1 else arr
+    if arr.dtype == np.int8:
+        lines = (" ".join(_INT8_STR[r.astype(np.int16) + 128]) for r in rows)
+    else:
+        lines = (" ".join(map(str, r)) for r in rows.tolist())
+    try:
+        Path(path).write_text("\n".join(lines) + "\n", encoding="utf-8")
+    except OSError as exc:
+        raise OSError(f"Could not write output file {path}: {exc}") from exc
+
+
+def print_sparse_map(path, n_words: int, n_stored: int, shift_table: bool = False) -> None:
+    header = 16 * BITMAP_WORDS + 17
+    b1_addr = header + n_stored
+    print(f"Wrote {path} with {n_words} lines "
+          f"(dense: {57731 + 64 * shift_table}; {n_stored}/57600 W1 words stored).")
+    print("Address map:")
+    print(f"  bitmap : {0:5d} .. {16 * BITMAP_WORDS - 1}")
+    print(f"  bases  : {16 * BITMAP_WORDS:5d} .. {header - 1}")
+    print(f"  W1     : {header:5d} .. {b1_addr - 1}")
+    print(f"  b1     : {b1_addr:5d} .. {b1_addr + 63}")
+    print(f"  W2     : {b1_addr + 64:5d} .. {b1_addr + 127}")
+    print(f"  b2     : {b1_addr + 128:5d} .. {b1_addr + 130}")
+    if shift_table:
+        print(f"  shifts : {b1_addr + 131:5d} .. {b1_addr + 194}")
 
 
 def main() -> None:
+    ap = argparse.ArgumentParser(description="Pack the int8/int32 text export into weights.memh.")
+    ap.add_argument("--bin", action="store_true", help="also write weights.bin (raw little-endian uint32)")
+    ap.add_argument("--sparse", action="store_true",
+                    help="also write weights_sparse.memh (all-zero W1 words skipped)")
+    ap.add_argument("--w1_bits", type=int, default=8, choices=[8, 4, 2],
+                    help="also write the packed W1 layout (weights_int4.memh / weights_ternary.memh)")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
     w1 = read_matrix(W1_FILE, rows=64, cols=3600)
     w2 = read_matrix(W2_FILE, rows=3, cols=64)
     b1 = read_vector(B1_FILE, length=64)
     b2 = read_vector(B2_FILE, length=3)
+    # a single global SHIFT goes to the TC's shift register; one per row becomes the shift table
+    shifts = read_all_ints(SHIFT_FILE) if SHIFT_FILE.exists() else None
+    if shifts is not None and len(shifts) == 1:
+        shifts = None
+    t_read = time.perf_counter() - t0
 
-    memh_lines = build_memh_lines(w1, w2, b1, b2)
+    words = pack_weights(w1, b1, w2, b2, shifts)
 
-    expected_lines = 57600 + 64 + 64 + 3
-    if len(memh_lines) != expected_lines:
+    expected_lines = 57600 + 64 + 64 + 3 + (64 if shifts is not None else 0)
+    if len(words) != expected_lines:
         raise RuntimeError(
             f"Internal error: expected {expected_lines} output lines, "
-            f"but generated {len(memh_lines)}"
+            f"but generated {len(words)}"
         )
 
-    try:
-        Path(OUT_FILE).write_text("\n".join(memh_lines) + "\n", encoding="utf-8")
-    except OSError as exc:
-        raise OSError(f"Could not write output file {OUT_FILE}: {exc}") from exc
+    write_memh(OUT_FILE, words)
+    if args.bin:
+        write_bin(OUT_FILE.with_suffix(".bin"), words)
+    t_total = time.perf_counter() - t0
 
-    print(f"Wrote {OUT_FILE} with {len(memh_lines)} lines.")
+    print(f"Wrote {OUT_FILE} with {len(words)} lines"
+          + (f" (+ {OUT_FILE.with_suffix('.bin').name})" if args.bin else "")
+          + f" in {t_total * 1e3:.1f} ms ({t_read * 1e3:.1f} ms reading text).")
     print("Address map:")
     print("  W1 :     0 .. 57599")
     print("  b1 : 57600 .. 57663")
     print("  W2 : 57664 .. 57727")
     print("  b2 : 57728 .. 57730")
+    if shifts is not None:
+        print("  shift table : 57731 .. 57794")
+
+    if args.w1_bits < 8:
+        packed = pack_weights(w1, b1, w2, b2, shifts, args.w1_bits)
+        out = packed_out_file(args.w1_bits)
+        write_memh(out, packed)
+        if args.bin:
+            write_bin(out.with_suffix(".bin"), packed)
+        n_w1 = 57600 * args.w1_bits // 8
+        print(f"Wrote {out} with {len(packed)} lines (W1 {args.w1_bits}-bit: 0 .. {n_w1 - 1}, "
+              f"b1 from {n_w1}).")
+
+    if args.sparse:
+        sparse, n_stored = pack_sparse_weights(w1, b1, w2, b2, shifts)
+        write_memh(SPARSE_OUT_FILE, sparse)
+        if args.bin:
+            write_bin(SPARSE_OUT_FILE.with_suffix(".bin"), sparse)
+        print_sparse_map(SPARSE_OUT_FILE, len(sparse), n_stored, shifts is not None)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()